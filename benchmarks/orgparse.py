@@ -0,0 +1,103 @@
+"""
+How fast tanco reads a big test plan.
+
+    python benchmarks/orgparse.py [tests]
+
+Writes a synthetic v0.2 org file (100,000 tests by default, in groups
+of GROUP_SIZE, with settings at every scope, comments and descriptions)
+and times orgtest.read_challenge on it, then plancache.read_challenge
+once the parsed plan is in the cache (in a temporary TANCO_CACHE_DIR).
+For the streaming reader (orgtest.iter_tests), it times how long the
+first test takes to arrive, and a pass that picks out a single test.
+Last, the same tests split into FILES files in a directory, read with
+plans.read_plan (in a process pool) and an empty cache each time.
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tanco import orgtest, plancache, plans
+
+GROUP_SIZE = 100
+FILES = 8
+ROUNDS = 3
+
+
+def synthetic_plan(num_tests: int, first: int = 0) -> str:
+    """an org file with `num_tests` tests (numbered from `first`)"""
+    out = ['#+tanco-format: 0.2', '#+title: synthetic plan', '#+name: synthetic',
+           '#+timeout: 2s', '', 'Some text about the challenge.', '']
+    for i in range(first, first + num_tests):
+        if i % GROUP_SIZE == 0:
+            out += [f'* group {i // GROUP_SIZE}', '#+budget: time=1s', '']
+        out += [f'** TEST t{i} : test number {i}',
+                *(['#+timeout: 500ms'] if i % 10 == 0 else []),
+                '#+begin_src',
+                f'> add {i} 1',
+                f'{i + 1}',
+                '> echo \\# not a comment  # a comment',
+                '# not a comment',
+                '> q',
+                '#+end_src',
+                '',
+                f'Test {i} checks that adding works.',
+                'It has a two line description.',
+                '']
+    return '\n'.join(out) + '\n'
+
+
+def best_time(read, path: str):
+    """(the best time of ROUNDS calls to read(path), what it returned)"""
+    best = float('inf')
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        res = read(path)
+        best = min(best, time.perf_counter() - start)
+    return best, res
+
+
+def main(num_tests: int = 100_000):
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['TANCO_CACHE_DIR'] = tmp
+        for n in [num_tests, 10]:
+            path = os.path.join(tmp, f'plan-{n}.org')
+            with open(path, 'w') as f:
+                f.write(synthetic_plan(n))
+            os.utime(path, (time.time() - 60,) * 2)  # (so the cache trusts the mtime)
+            size = os.path.getsize(path)
+            parse, c = best_time(orgtest.read_challenge, path)
+            assert len(c.tests) == n
+            plancache.read_challenge(path)
+            cached, c = best_time(plancache.read_challenge, path)
+            assert len(c.tests) == n
+            first, test = best_time(lambda p: next(orgtest.iter_tests(p)), path)
+            assert test.name == 't0'
+            one, tests = best_time(lambda p: list(orgtest.iter_tests(p, [f't{n - 1}'])), path)
+            assert len(tests) == 1
+            print(f'{n} tests ({size / 2 ** 20:.2f}M), best of {ROUNDS}:')
+            print(f'  parsed in {parse * 1000:.1f}ms ({n / parse:,.0f} tests/s)')
+            print(f'  loaded from the cache in {cached * 1000:.2f}ms')
+            print(f'  first test streamed in {first * 1000:.2f}ms')
+            print(f'  last test picked out in {one * 1000:.1f}ms')
+        split = os.path.join(tmp, 'split')
+        os.mkdir(split)
+        per_file = num_tests // FILES
+        for i in range(FILES):
+            with open(os.path.join(split, f'part-{i}.org'), 'w') as f:
+                f.write(synthetic_plan(per_file, i * per_file))
+
+        def cold_read(path):
+            os.environ['TANCO_CACHE_DIR'] = tempfile.mkdtemp(dir=tmp)
+            return plans.read_plan(path)
+
+        split_time, c = best_time(cold_read, split)
+        assert len(c.tests) == per_file * FILES
+        print(f'{per_file * FILES} tests in {FILES} files: parsed in {split_time * 1000:.1f}ms'
+              f' ({len(c.tests) / split_time:,.0f} tests/s, {os.cpu_count()} cpus)')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
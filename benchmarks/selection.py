@@ -0,0 +1,58 @@
+"""
+How long it takes to pick a few tests out of a big plan.
+
+    python benchmarks/selection.py [tests]
+
+Builds a challenge of 50,000 tests by default (named like `g12.t34`,
+in groups of GROUP_SIZE), then times each kind of selector: the first
+lookup, which builds the part of the index it needs, and the later
+ones (as in `tanco watch`). The old way, a list scan per test, is
+timed for comparison.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tanco import selection
+from tanco.model import Challenge, TestDescription
+
+GROUP_SIZE = 100
+ROUNDS = 5
+
+
+def challenge(num_tests: int) -> Challenge:
+    return Challenge(tests=[TestDescription(name=f'g{i // GROUP_SIZE}.t{i % GROUP_SIZE}', grp=i // GROUP_SIZE)
+                            for i in range(num_tests)])
+
+
+def timed(fn) -> tuple[float, object]:
+    start = time.perf_counter()
+    res = fn()
+    return time.perf_counter() - start, res
+
+
+def main(num_tests: int = 50_000):
+    last = (num_tests - 1) // GROUP_SIZE
+    cases = [
+        ('3 names', [f'g{last}.t0', 'g7.t7', 'g0.t1']),
+        ('glob with a prefix', [f'g{last}.*']),
+        ('glob without one', ['*.t99']),
+        ('regex', [r're:^g1\.t[0-4]$']),
+        ('group', [f'grp:{last}']),
+    ]
+    names = cases[0][1]
+    tests = challenge(num_tests).tests
+    old, picked = timed(lambda: [t for t in tests if t.name in names])
+    print(f'{num_tests} tests, list scan for 3 names: {old * 1000:.2f}ms')
+    for label, selectors in cases:
+        c = challenge(num_tests)
+        first, picked = timed(lambda: selection.select(c, selectors))
+        assert picked
+        again = min(timed(lambda: selection.select(c, selectors))[0] for _ in range(ROUNDS))
+        print(f'  {label:20} {len(picked):4} tests: first {first * 1000:7.2f}ms, then {again * 1e6:8.1f}us')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
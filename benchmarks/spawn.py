@@ -0,0 +1,59 @@
+"""
+How long it takes tanco to launch a target, and how much of that is tanco.
+
+    python benchmarks/spawn.py [launches]
+
+Each way of starting a trivial program (`true`, or python where there's
+no `true`) runs in rounds, interleaved so that noise hits them all alike.
+The report has the median time per launch, including the exec and the
+wait, and the overhead over a bare subprocess.Popen.
+"""
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tanco import procs, runner
+from tanco.model import Config
+
+ROUNDS = 15
+
+
+def finish(program: subprocess.Popen):
+    for pipe in (program.stdin, program.stdout, program.stderr):
+        pipe.close()
+    program.wait()
+    procs.forget(program.pid)
+
+
+def main(launches: int = 750):
+    args = ['true'] if shutil.which('true') else [sys.executable, '-c', 'pass']
+    cfg = Config(program_args=args)
+    target = runner.prepare(cfg)
+    pipes = dict(stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    ways = {
+        'bare Popen': lambda: subprocess.Popen(target.args, **pipes),
+        'spawn, resolving each time': lambda: runner.spawn(cfg),
+        'spawn, prepared target': lambda: runner.spawn(cfg, target=target),
+    }
+    each = max(1, launches // ROUNDS)
+    times: dict[str, list[float]] = {name: [] for name in ways}
+    for _ in range(ROUNDS):
+        for name, launch in ways.items():
+            start = time.perf_counter()
+            for _ in range(each):
+                finish(launch())
+            times[name].append((time.perf_counter() - start) / each)
+    base = statistics.median(times['bare Popen'])
+    print(f'{each * ROUNDS} launches of {" ".join(args)} each:')
+    for name, samples in times.items():
+        secs = statistics.median(samples)
+        print(f'  {name:28} {secs * 1e6:8.0f}us per launch  ({(secs - base) * 1e6:+6.0f}us)')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,316 @@
+"""
+Asyncio engine for running tanco tests.
+
+This runs the same tests as `runner.run_tests` and `run_tests_persistent`,
+but talks to the target programs over non-blocking pipes, so tests can
+overlap with each other and with calls to the server. Each test runs in
+its own task, and cancelling the task kills its process.
+
+The coroutines here can also be awaited directly from other asyncio code
+(like the websocket handlers in `driver`).
+"""
+import asyncio
+import os
+import subprocess
+import time
+
+from . import limits, procs, runner, schedule, stream
+from . import model as m
+from .model import Config, ResultKind, TestDescription
+
+# longest line we'll read from a target
+READ_LIMIT = 2 ** 20
+
+
+async def spawn(cfg: Config, stderr=subprocess.PIPE, cgroup: limits.Cgroup | None = None,
+                persistent: bool = False, prepared: runner.PreparedTarget | None = None,
+                ) -> asyncio.subprocess.Process:
+    """start the target program with pipes for stdin, stdout and (unless stderr=None) stderr"""
+    prepared = prepared or runner.prepare(cfg)
+    preexec = limits.preexec(cfg.limits, persistent, cgroup) if cgroup or persistent else prepared.preexec
+    kw = dict(stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr,
+              env=prepared.env, limit=READ_LIMIT, close_fds=runner.CLOSE_FDS,
+              preexec_fn=preexec, **procs.popen_kw())
+    cmd = prepared.args
+    try:
+        if prepared.shell:
+            if isinstance(cmd, list):
+                cmd = cmd[0] if os.name != 'nt' else subprocess.list2cmdline(cmd)
+            proc = await asyncio.create_subprocess_shell(cmd, **kw)
+        else:
+            proc = await asyncio.create_subprocess_exec(*cmd, **kw)
+    except OSError as e:
+        runner.spawn_failed(cfg, e, prepared.name)
+        raise
+    procs.started(proc.pid)
+    return proc
+
+
+async def kill(proc: asyncio.subprocess.Process):
+    """kill the target and whatever it left running in its process group"""
+    # (asyncio reaps the target as soon as it exits, but its group id stays
+    # taken while anything is left in the group, so it's still safe to use)
+    procs.kill_tree(proc.pid)
+    await proc.wait()
+
+
+async def talk(proc: asyncio.subprocess.Process, data: bytes, matcher: stream.LineMatcher):
+    """send the input while feeding the output to the matcher, until it's had enough"""
+    assert proc.stdin and proc.stdout
+    stdin = proc.stdin
+
+    async def send():
+        try:
+            stdin.write(data)
+            await stdin.drain()
+            stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # it quit early. the output tells us what happened.
+    sending = asyncio.create_task(send())
+    try:
+        await read_output(proc, matcher)
+    finally:
+        sending.cancel()
+
+
+async def read_output(proc: asyncio.subprocess.Process, matcher: stream.LineMatcher):
+    """feed stdout to the matcher until the program exits or the matcher has seen enough"""
+    while True:
+        try:
+            line = await proc.stdout.readline()
+        except ValueError:  # longer than READ_LIMIT (and already dropped)
+            line = b'[... line too long ...]\n'
+        if not line:
+            break
+        if not matcher.feed(line.decode(errors='replace')):
+            return  # the caller kills it
+    await proc.wait()
+
+
+async def drain(reader: asyncio.StreamReader, capture: stream.Capture):
+    """copy a stream into the capture until it ends"""
+    while chunk := await reader.read(stream.CHUNK_SIZE):
+        capture.write(chunk)
+
+
+async def run_test(cfg: Config, test: TestDescription, timeout: float = m.DEFAULT_TIMEOUT,
+                   prepared: runner.PreparedTarget | None = None) -> m.TestResult:
+    """run one test in a fresh process (of the prepared target, if given).
+    raises asyncio.TimeoutError if the program doesn't finish in time."""
+    if cfg.input_path:
+        runner.send_cmds(cfg, None, test.ilines)
+        data = b''
+    else:
+        data = ''.join(line + '\n' for line in test.ilines).encode()
+    cgroup = limits.Cgroup.create(cfg.limits)
+    start = time.perf_counter()  # (from the launch, like runner.timed_result)
+    try:
+        proc = await spawn(cfg, cgroup=cgroup, prepared=prepared)
+    except BaseException:
+        if cgroup:
+            cgroup.remove()
+        raise
+    matcher = stream.LineMatcher(cfg, test.olines)
+    errs = stream.Capture()
+    draining = asyncio.create_task(drain(proc.stderr, errs))
+    try:
+        try:
+            await asyncio.wait_for(talk(proc, data, matcher), timeout)
+        finally:
+            await kill(proc)
+            try:
+                await asyncio.wait_for(draining, runner.STDERR_GRACE)
+            except asyncio.TimeoutError:
+                pass  # something else still has the pipe open
+        secs = time.perf_counter() - start
+        actual = matcher.lines()
+        res = runner.check_result(cfg, actual, test)
+        if res.error is not None:
+            res.error.stderr = errs.excerpt()
+        res.secs = secs
+        res.usage = m.Usage(wall=secs)  # (asyncio reaps the process, so no rusage)
+        res = limits.check(cfg.limits, res, proc.returncode, None, cgroup, errs.excerpt())
+    finally:
+        errs.close()
+        if cgroup:
+            cgroup.remove()
+    return runner.check_budget(test, res, actual)
+
+
+class TargetCrash(Exception):
+    """raised when a long-lived target dies or stops responding"""
+
+    def __init__(self, lines: list[str]):
+        super().__init__('\n'.join(lines))
+        self.lines = lines
+
+
+class AsyncTarget:
+    """
+    A long-lived target process that receives a batch of input lines
+    followed by an end command, and answers with output followed by a
+    delimiter line. Used for persistent test runs and for `bind`/`share`.
+    """
+
+    def __init__(self, cfg: Config, end_cmd: str, end_out: str, timeout: float | None = m.DEFAULT_TIMEOUT,
+                 framing: str = ''):
+        self.cfg = cfg
+        self.end_cmd = end_cmd
+        self.end_out = end_out
+        self.framing = framing  # 'length' for length-prefixed replies instead of end_out
+        self.timeout = timeout
+        self.proc: asyncio.subprocess.Process | None = None
+        self.replies: stream.Replies | None = None
+
+    async def start(self) -> asyncio.subprocess.Process:
+        self.proc = await spawn(self.cfg, stderr=None, persistent=True)
+        self.replies = stream.FramedReplies() if self.framing == 'length' else stream.DelimitedReplies(self.end_out)
+        return self.proc
+
+    async def send(self, lines: list[str], timeout: float | None = None) -> list[str]:
+        """send the lines and the end command, and return the raw output lines"""
+        timeout = timeout or self.timeout
+        proc = self.proc or await self.start()
+        assert proc.stdin and proc.stdout
+        try:
+            proc.stdin.write(''.join(line + '\n' for line in [*lines, self.end_cmd]).encode())
+            await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise TargetCrash(['Process stopped reading input during test.', str(e)])
+        try:
+            return await asyncio.wait_for(self.read_reply(proc.stdout), timeout)
+        except asyncio.TimeoutError:
+            if self.framing:
+                raise TargetCrash(['Timeout waiting for a reply frame after test input.',
+                                   'Make sure your program sends its length line, then the output.'])
+            raise TargetCrash([f'Timeout waiting for {self.end_out!r} after test input.',
+                               'Make sure your restart command produces the expected output on its own line.'])
+        except stream.FrameError as e:
+            raise TargetCrash(['Process sent a badly framed reply.', str(e)])
+
+    async def read_reply(self, stdout: asyncio.StreamReader) -> list[str]:
+        while (reply := self.replies.next()) is None:
+            if not (chunk := await stdout.read(stream.CHUNK_SIZE)):
+                raise TargetCrash(['Process exited unexpectedly during test.',
+                                   'Output before exit: ' + self.replies.pending()])
+            self.replies.feed(chunk)
+        return stream.reply_lines(reply)
+
+    async def run(self, test: TestDescription, timeout: float | None = None) -> m.TestResult:
+        start = time.perf_counter()
+        actual = runner.clean_output(self.cfg, '\n'.join(await self.send(test.ilines, timeout)))
+        secs = time.perf_counter() - start
+        res = runner.check_result(self.cfg, actual, test)
+        res.secs = secs
+        res.usage = m.Usage(wall=secs)
+        return runner.check_budget(test, res, actual)
+
+    async def stop(self):
+        if self.proc:
+            await kill(self.proc)
+            self.proc = None
+
+
+async def run_tests(cfg: Config, names=None, challenge: m.Challenge | None = None):
+    """
+    Run the tests on `--jobs` concurrent workers and report them in the order they were scheduled.
+    Uses persistent targets if restart_cmd is configured, otherwise a fresh process per test.
+    """
+    challenge = challenge or runner.get_challenge(cfg)
+    tests = challenge.tests
+    if not tests:
+        source = cfg.test_path or cfg.test_plan or 'database'
+        raise runner.NoTestsFoundError(
+            f'No tests found in {source}. '
+            'Make sure the file contains valid test definitions.',
+        )
+    log = runner.RunLog(cfg)
+    selected = log.uncached(runner.select_tests(cfg, log, challenge, names))
+    selected = schedule.order(cfg, log.plan, selected)
+    persistent = cfg.persistent
+    jobs = runner.num_jobs(cfg, selected)
+    # a single worker stops at the first failure, like the sequential runner
+    fail_fast = cfg.fail_fast or jobs == 1
+
+    loop = asyncio.get_running_loop()
+    results: list[asyncio.Future] = [loop.create_future() for _ in selected]
+    todo: asyncio.Queue[tuple[int, int]] = asyncio.Queue()  # (index, retries)
+    for i in range(len(selected)):
+        todo.put_nowait((i, 0))
+    stop = asyncio.Event()
+
+    async def work(slot: int):
+        wcfg = runner.worker_config(cfg, slot, jobs)
+        target = AsyncTarget(wcfg, cfg.restart_cmd, cfg.restart_expect, framing=cfg.framing) if persistent else None
+        prepared = None if persistent else runner.prepare(wcfg)
+        try:
+            while not (todo.empty() or stop.is_set()):
+                i, retries = todo.get_nowait()
+                test = selected[i]
+                timeout = log.timeout(test)
+                try:
+                    res = await (target.run(test, timeout) if target else run_test(wcfg, test, timeout, prepared))
+                except TargetCrash as e:
+                    assert target
+                    await target.stop()
+                    if retries < runner.MAX_RETRIES:
+                        todo.put_nowait((i, retries + 1))
+                        continue
+                    res = m.TestResult(ResultKind.Fail, error=m.MessageFailure(e.lines), secs=timeout)
+                except asyncio.TimeoutError:
+                    res = None
+                except Exception as e:
+                    stop.set()
+                    results[i].set_exception(e)
+                    return
+                results[i].set_result(res)
+                if fail_fast and (res is None or res.kind == ResultKind.Fail):
+                    stop.set()
+        finally:
+            if target:
+                await target.stop()
+
+    crew = asyncio.gather(*[work(slot) for slot in range(jobs)])
+    # once the workers stop, nothing else is coming:
+    crew.add_done_callback(lambda _: [f.cancel() for f in results])
+
+    num_passed = log.num_cached
+    failures: list[tuple[TestDescription, m.TestResult | None]] = []
+    pending: list[tuple[TestDescription, m.TestResult]] = []  # for the server to check
+    try:
+        for test, future in zip(selected, results):
+            try:
+                res = await future
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                continue  # never ran
+            if res and res.kind == ResultKind.AskServer:
+                pending.append((test, res))
+                continue
+            log.add(test, bool(res and res.is_pass()), res.secs if res else log.timeout(test),
+                    res.usage if res else None)
+            if res and res.is_pass():
+                print('.', end='', flush=True)
+                num_passed += 1
+            else:
+                failures.append((test, res))
+                if fail_fast:
+                    break
+        if not (failures and fail_fast):
+            # (the server call blocks, so it runs off the event loop)
+            num_passed += await asyncio.to_thread(runner.check_pending, cfg, log, pending, failures)
+    finally:
+        crew.cancel()
+        await asyncio.gather(crew, return_exceptions=True)
+        log.save()
+        if cfg.input_path and jobs > 1:
+            for slot in range(jobs):
+                path = runner.worker_config(cfg, slot, jobs).input_path
+                if os.path.exists(path):
+                    os.remove(path)
+
+    if failures:
+        runner.report_failures(cfg, num_passed, len(tests), failures)
+    else:
+        runner.report_pass(cfg, num_passed)
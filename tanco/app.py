@@ -372,40 +372,69 @@ async def send_attempt_fail(code, uid):
     return ['ok']
 
 
+async def check_outputs(code, uid, outputs: list[tuple[str, list[str]]]) -> list[m.TestResult]:
+    """
+    check a batch of (test name, actual output) for an attempt.
+    the passing tests are saved as progress, and the attempt moves
+    to the state for the first failure (or passes if there is none).
+    raises LookupError if any test is unknown.
+    """
+    # fetch the expected output
+    # TODO: update to allow arbitrary validation rules
+    tests = [db.get_attempt_test(uid, code, name) for name, _ in outputs]
+    results = [t.check_output(actual) for t, (_, actual) in zip(tests, outputs)]
+    for t, r in zip(tests, results):
+        print('test result:', t.name, r.to_data())
+
+    db.save_passes(code, [t.name for t, r in zip(tests, results) if r.is_pass()])
+    failed = [(t, r) for t, r in zip(tests, results) if not r.is_pass()]
+    if failed:
+        t, r = failed[0]
+        state, focus = db.set_attempt_state(uid, code, m.Transition.Fail, failing_test=t.name)
+        await notify_state(code, state, focus)
+        html = await quart.render_template('result.html', test=t, result=r)
+        await notify(code, html)
+    elif results:
+        state, focus = db.set_attempt_state(uid, code, m.Transition.Pass)
+        await notify_state(code, state, focus)
+
+    if obs := observers.get(code, []):
+        for t, r, (_, actual) in zip(tests, results, outputs):
+            html = await quart.render_template('result.html', test=t, result=r, actual=actual)
+            for o in obs:
+                await o.put(html)
+    return results
+
+
 @app.route('/a/<code>/check/<test_name>', methods=['POST'])
 @require_uid
 async def check_test_for_attempt(code, test_name, uid):
     actual = (await quart.request.json).get('actual')
     if actual is None:
         return "bad request: no 'actual' field in post", 400
-
-    # fetch the expected output
-    # TODO: update to allow arbitrary validation rules
     try:
-        t = db.get_attempt_test(uid, code, test_name)
+        [r] = await check_outputs(code, uid, [(test_name, actual)])
     except LookupError:
         return 'unknown test or attempt', 404
+    return r.to_data()
 
-    r = t.check_output(actual)
-    print('test result:', r.to_data())
 
-    if r.is_pass():
-        db.save_progress(code, test_name, True)
-        state, focus = db.set_attempt_state(uid, code, m.Transition.Pass)
-        await notify_state(code, state, focus)
-    else:
-        state, focus = db.set_attempt_state(uid, code, m.Transition.Fail, failing_test=test_name)
-        await notify_state(code, state, focus)
-        html = await quart.render_template('result.html', test=t, result=r)
-        await notify(code, html)
+@app.route('/a/<code>/check', methods=['POST'])
+@require_uid
+async def check_tests_for_attempt(code, uid):
+    """check a group of tests at once: {'results': [{'test_name': ..., 'actual': [...]}, ...]}"""
+    batch = (await quart.request.json).get('results')
+    try:
+        outputs = [(item['test_name'], list(item['actual'])) for item in batch]
+    except (KeyError, TypeError):
+        return "bad request: 'results' should be a list of {'test_name', 'actual'}", 400
+    try:
+        results = await check_outputs(code, uid, outputs)
+    except LookupError:
+        return 'unknown test or attempt', 404
+    return [r.to_data() for r in results]
 
-    if obs := observers.get(code, []):
-        html = await quart.render_template('result.html', test=t, result=r, actual=actual)
-        for o in obs:
-            await o.put(html)
-    return r.to_data()
 
-
 # == Website Authentication ===================================
 
 @app.route('/whoami', methods=['GET'])
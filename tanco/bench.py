@@ -0,0 +1,188 @@
+"""
+Benchmark a target against its tests (`tanco bench`).
+
+Each selected test runs a few times to warm up (filling caches, JIT
+compilers and so on), then RUNS more times one after another, each
+in a fresh process (or on one persistent worker, with restart-cmd).
+The timings are summarized per test and per group.
+
+The samples of the first benchmark of each test are saved as its
+baseline (`--save` replaces them). Later runs compare against the
+baseline with a Mann-Whitney U test, and flag the tests that got
+significantly slower, so a noisy run doesn't cry wolf.
+"""
+import dataclasses
+import math
+import statistics
+import subprocess
+import time
+from dataclasses import dataclass
+
+from . import database as db
+from . import model as m
+from . import runner
+from .model import Config, TestDescription
+
+RUNS = 20
+WARMUP = 3
+# flag a change when it's this unlikely to be noise...
+ALPHA = 0.01
+# ... and the median moved by at least this much
+MIN_CHANGE = 0.05
+
+
+def percentile(samples: list[float], q: float) -> float:
+    """nearest-rank percentile (q from 0 to 100)"""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(q * len(ordered) / 100) - 1)]
+
+
+@dataclass
+class Summary:
+    runs: int
+    min: float
+    median: float
+    p95: float
+    p99: float
+    throughput: float  # runs per second
+
+    @classmethod
+    def of(cls, samples: list[float]) -> 'Summary':
+        return cls(len(samples), min(samples), statistics.median(samples),
+                   percentile(samples, 95), percentile(samples, 99), len(samples) / (sum(samples) or 1e-9))
+
+
+def slower_p(new: list[float], old: list[float]) -> float:
+    """
+    one-sided Mann-Whitney U test: the chance of seeing `new` rank this
+    far above `old` if they came from the same distribution.
+    (normal approximation, which is fine from about 8 samples each)
+    """
+    combined = sorted([(x, 0) for x in new] + [(x, 1) for x in old])
+    ranks = [0.0] * len(combined)
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1  # ties share their average rank
+        i = j + 1
+    n1, n2 = len(new), len(old)
+    u = sum(r for r, (_, side) in zip(ranks, combined) if side == 0) - n1 * (n1 + 1) / 2
+    sd = math.sqrt(n1 * n2 * (n1 + n2 + 1) / 12)
+    if not sd:
+        return 1.0
+    z = (u - n1 * n2 / 2) / sd
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def verdict(new: list[float], old: list[float] | None) -> str:
+    """how the new samples compare with the baseline"""
+    if not old:
+        return ''
+    change = statistics.median(new) / statistics.median(old) - 1
+    if change > MIN_CHANGE and (p := slower_p(new, old)) < ALPHA:
+        return f'SLOWER {change:+.0%} (p={p:.3f})'
+    if change < -MIN_CHANGE and (p := slower_p(old, new)) < ALPHA:
+        return f'faster {change:+.0%} (p={p:.3f})'
+    return f'{change:+.0%}'
+
+
+def fmt_secs(secs: float) -> str:
+    return f'{secs * 1000:.2f}ms' if secs < 10 else f'{secs:.1f}s'
+
+
+class Bench:
+    """
+    runs one test at a time, on fresh processes or a single persistent worker.
+    (no warm processes waiting in the background: each run includes startup)
+    """
+
+    def __init__(self, cfg: Config):
+        self.cfg = cfg = dataclasses.replace(cfg, prespawn=0)
+        persistent = cfg.persistent
+        self.worker = runner.PersistentWorker(cfg) if persistent else None
+        self.spawner = None if persistent else runner.Spawner(cfg)
+
+    def run(self, test: TestDescription, timeout: float) -> m.TestResult:
+        if self.worker:
+            start = time.perf_counter()
+            res = runner.check_result(self.cfg, self.worker.run(test, timeout), test)
+            res.secs = time.perf_counter() - start
+            return res
+        return runner.timed_result(self.cfg, self.spawner.take(), test, timeout)
+
+    def close(self):
+        if self.worker:
+            self.worker.stop()
+        if self.spawner:
+            self.spawner.close()
+
+
+def sample(bench: Bench, test: TestDescription, timeout: float, runs: int, warmup: int) -> list[float] | str:
+    """the run times of the test, or why it couldn't be timed"""
+    samples = []
+    for i in range(warmup + runs):
+        try:
+            res = bench.run(test, timeout)
+        except subprocess.TimeoutExpired:
+            return 'timed out'
+        except runner.WorkerCrash as e:
+            bench.worker.stop()
+            return e.lines[0]
+        if not res.is_pass():
+            return 'failed'
+        if i >= warmup:
+            samples.append(res.secs)
+    return samples
+
+
+def bench(cfg: Config, names=None, runs: int = RUNS, warmup: int = WARMUP, save: bool = False):
+    """benchmark the selected tests, print a report, and compare with (or save) the baseline"""
+    challenge = runner.get_challenge(cfg)
+    plan = runner.plan_key(cfg)
+    log = runner.RunLog(cfg)
+    tests = runner.select_tests(cfg, log, challenge, names)
+    if not tests:
+        raise runner.NoTestsFoundError('No tests to benchmark.')
+    baselines = db.bench_baselines(plan) if plan else {}
+    print(f'Benchmarking {len(tests)} tests: {warmup} warm-up + {runs} timed runs each.')
+    print(f"{'test':30} {'min':>9} {'median':>9} {'p95':>9} {'p99':>9} {'runs/s':>8}  vs baseline")
+    results: dict[str, list[float]] = {}
+    groups: dict[int, list[tuple[TestDescription, Summary]]] = {}
+    tool = Bench(cfg)
+    try:
+        for test in tests:
+            if test.olines is None:
+                print(f'{test.name:30} (skipped: only the server can check it)')
+                continue
+            got = sample(tool, test, log.timeout(test), runs, warmup)
+            if isinstance(got, str):
+                print(f'{test.name:30} ({got})')
+                continue
+            results[test.name] = got
+            s = Summary.of(got)
+            groups.setdefault(test.grp, []).append((test, s))
+            print(f'{test.name:30} {fmt_secs(s.min):>9} {fmt_secs(s.median):>9} {fmt_secs(s.p95):>9}'
+                  f' {fmt_secs(s.p99):>9} {s.throughput:>8.1f}  {verdict(got, baselines.get(test.name))}')
+    finally:
+        tool.close()
+    if len(groups) > 1:
+        print()
+        print(f"{'group':30} {'tests':>5} {'medians':>9} {'tests/s':>8}")
+        for grp, members in groups.items():
+            total = sum(s.median for _, s in members)
+            label = f'{grp} ({members[0][0].name}...)'
+            print(f'{label:30} {len(members):>5} {fmt_secs(total):>9} {len(members) / (total or 1e-9):>8.1f}')
+    # tests without a baseline get one now
+    keep = {name: got for name, got in results.items() if save or name not in baselines}
+    if plan and keep:
+        db.save_bench_baselines(plan, keep)
+        print()
+        print(f'Saved the timings of {len(keep)} tests as the baseline for', plan)
+    slower = [name for name in results if verdict(results[name], baselines.get(name)).startswith('SLOWER')]
+    if slower:
+        print()
+        print('Significantly slower than the baseline:', ' '.join(slower))
+    return results
@@ -0,0 +1,88 @@
+"""
+Cache of passing test results.
+
+A test's cache key is a hash of everything that could change its result:
+the target's configuration, the contents of the target's `cache-files`,
+and the test's input and expected output. When a key has passed before,
+the test can be skipped.
+
+Since tanco can't know which files a program reads, nothing is cached
+unless the target lists its sources (or binary) in `cache-files`.
+"""
+import glob
+import hashlib
+import os
+
+from . import database as db
+from .model import Config, TestDescription
+
+# read files in chunks of this size when hashing them
+CHUNK_SIZE = 2 ** 16
+
+
+def hash_file(h, path: str):
+    h.update(path.encode() + b'\0')
+    with open(path, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            h.update(chunk)
+    h.update(b'\0')
+
+
+def target_files(cfg: Config) -> list[str]:
+    """the files in `cache-files`, plus the program itself if it's a file (like ./my-program)"""
+    paths = {path for pattern in cfg.cache_files
+             for path in glob.glob(pattern, recursive=True)}
+    paths.update(arg for arg in cfg.program_args if os.path.isfile(arg))
+    return sorted(path for path in paths if os.path.isfile(path))
+
+
+def target_digest(cfg: Config) -> str:
+    """hash of the target's settings and files"""
+    h = hashlib.sha256()
+    settings = [cfg.program_args, cfg.use_shell, cfg.skip_lines, bool(cfg.input_path),
+                cfg.restart_cmd, cfg.restart_expect, cfg.limits]
+    h.update(repr(settings).encode())
+    for path in target_files(cfg):
+        hash_file(h, path)
+    return h.hexdigest()
+
+
+def test_key(digest: str, test: TestDescription) -> str:
+    h = hashlib.sha256(digest.encode())
+    for lines in (test.ilines, test.olines):
+        h.update(b'\0'.join(line.encode() for line in lines) + b'\1')
+    if test.budget:
+        h.update(repr(test.budget).encode())
+    return h.hexdigest()
+
+
+class ResultCache:
+    """keys of the passing tests in a run"""
+
+    def __init__(self, cfg: Config):
+        self.enabled = cfg.use_cache and bool(cfg.cache_files)
+        self.digest = target_digest(cfg) if self.enabled else ''
+        self.passes: list[str] = []
+
+    def key(self, test: TestDescription) -> str | None:
+        """the test's cache key (None if its result can't be cached)"""
+        if not self.enabled or test.olines is None:
+            return None  # only the server can check this one
+        return test_key(self.digest, test)
+
+    def uncached(self, tests: list[TestDescription]) -> list[TestDescription]:
+        """the tests that haven't passed with the current target"""
+        if not self.enabled:
+            return tests
+        keys = [self.key(t) for t in tests]
+        seen = db.cached_passes([k for k in keys if k])
+        return [t for t, k in zip(tests, keys) if k not in seen]
+
+    def add(self, test: TestDescription, passed: bool):
+        if passed and (key := self.key(test)):
+            self.passes.append(key)
+
+    def save(self):
+        if self.passes:
+            db.save_cached_passes(self.passes)
+        self.passes = []
@@ -83,3 +83,13 @@ class TancoClient:
             'jwt': who['jwt'],
             'actual': actual})
         return m.TestResult.from_data(res)
+
+    def check_outputs(self, attempt: str, outputs: list[tuple[str, list[str]]]) -> list[m.TestResult]:
+        """check a batch of (test name, actual output) in one request"""
+        who = self.whoami()
+        if not who:
+            raise LookupError('You must be logged in to check output.')
+        res = self.post(f'a/{attempt}/check', {
+            'jwt': who['jwt'],
+            'results': [{'test_name': name, 'actual': actual} for name, actual in outputs]})
+        return [m.TestResult.from_data(data) for data in res]
@@ -1,3 +1,4 @@
+import json
 import os
 import pathlib
 import sqlite3
@@ -9,14 +10,32 @@ if 'TANCO_SDB_PATH' in os.environ:
 else:
     SDB_PATH = pathlib.Path('~/.tanco.sdb').expanduser()
 
+# every schema version, in order. init.sql creates the latest one,
+# and sql/upgrade-{version}.sql moves a database up to {version}.
+SCHEMA_VERSIONS = ['0.1', '0.2', '0.3', '0.4', '0.5', '0.6']
+
+
+def sql_script(name: str) -> str:
+    import tanco
+    return pathlib.Path(*tanco.__path__, 'sql', name).read_text()
+
 
 def ensure_sdb():
     if not SDB_PATH.exists():
         print('Creating database at', SDB_PATH)
-        import tanco
-        sql = pathlib.Path(*tanco.__path__, 'sql', 'init.sql').read_text()
         dbc = begin()
-        dbc.executescript(sql)
+        dbc.executescript(sql_script('init.sql'))
+        dbc.commit()
+    else:
+        upgrade_sdb()
+
+
+def upgrade_sdb():
+    """apply any schema upgrades that an older database is missing"""
+    ver = query("select val from meta where key='schema_version'")[0]['val']
+    for new in SCHEMA_VERSIONS[SCHEMA_VERSIONS.index(ver) + 1:]:
+        dbc = begin()
+        dbc.executescript(sql_script(f'upgrade-{new}.sql'))
         dbc.commit()
 
 
@@ -100,32 +119,47 @@ def get_next_tests(aid: str, uid: int):
         """, {'code': aid, 'uid': uid})
 
 
-def save_progress(attempt: str, test: str, _passed: bool):
-    """save progress when a test passes"""
-    commit("""
+SAVE_PROGRESS = """
       insert into progress (aid, tid)
         select a.id as aid, t.id as tid
         from attempts a, tests t
         where a.chid = t.chid
           and a.code = ? and t.name = ?
-        """, [attempt, test])
+        """
 
 
-def save_rule(attempt: str, test: str, rule: dict):
-    """save a rule for a test"""
-    # TODO: save the rule to the database as json
-    # json.dumps(rule)
+def save_passes(attempt: str, tests: list[str]):
+    """save progress for a batch of passing tests in one transaction"""
+    tx = begin()
+    tx.executemany(SAVE_PROGRESS, [(attempt, test) for test in tests])
+    tx.commit()
 
-    # for now, we still have this 'olines' thing
-    assert rule['kind'] == 'lines', \
-        f"don't know how to save {rule['kind']!r} rules"
-    commit("""
+
+SAVE_RULE = """
         update tests set olines = ?
         where name = ?
           and chid = (
             select a.chid from attempts a
             where a.code = ?)
-        """, ['\n'.join(rule['data']), test, attempt])
+        """
+
+
+def rule_olines(rule: dict) -> str:
+    # TODO: save the rule to the database as json
+    # json.dumps(rule)
+
+    # for now, we still have this 'olines' thing
+    assert rule['kind'] == 'lines', \
+        f"don't know how to save {rule['kind']!r} rules"
+    return '\n'.join(rule['data'])
+
+
+def save_rules(attempt: str, rules: list[tuple[str, dict]]):
+    """save progress and the rule for a batch of (test name, rule) that passed, in one transaction"""
+    tx = begin()
+    tx.executemany(SAVE_PROGRESS, [(attempt, test) for test, _ in rules])
+    tx.executemany(SAVE_RULE, [(rule_olines(rule), test, attempt) for test, rule in rules])
+    tx.commit()
 
 
 def get_attempt_test(uid, code, test_name):
@@ -257,3 +291,114 @@ def current_status(attempt):
             where a.chid = c.id and c.sid = s.id and a.code=?""", [attempt])[0]
     except IndexError:
         raise LookupError(f'attempt: {attempt}')
+
+
+def save_runs(plan: str, runs: list[tuple[str, bool, float]], usage: list[tuple | None] | None = None):
+    """record (test name, passed, seconds) for each test in a run,
+    and make them the latest status of those tests. `usage` has a
+    (grp, user secs, sys secs, max rss) tuple or None for each run."""
+    tx = begin()
+    last_id = tx.execute('select coalesce(max(id), 0) from test_runs').fetchone()[0]
+    tx.executemany('insert into test_runs (plan, test, passed, secs) values (?, ?, ?, ?)',
+                   [(plan, test, int(passed), secs) for (test, passed, secs) in runs])
+    if usage:
+        ids = [row[0] for row in tx.execute('select id from test_runs where id > ? order by id', [last_id])]
+        tx.executemany('insert into test_usage (run, grp, user_secs, sys_secs, max_rss) values (?, ?, ?, ?, ?)',
+                       [(run, *used) for run, used in zip(ids, usage) if used])
+    tx.execute("""
+        insert into test_status (plan, test, passed, secs, run)
+          select plan, test, passed, secs, id from test_runs where id > ? order by id
+        on conflict (plan, test) do update
+          set passed=excluded.passed, secs=excluded.secs, run=excluded.run""", [last_id])
+    tx.commit()
+
+
+def run_history(plan: str, limit: int = 100) -> dict[str, list[float]]:
+    """recent run times of the passing tests in a plan, by test name"""
+    res: dict[str, list[float]] = {}
+    for row in query("""
+            select test, secs from (
+              select test, secs, row_number() over (
+                partition by test order by id desc) as n
+              from test_runs where plan = ? and passed)
+            where n <= ?""", [plan, limit]):
+        res.setdefault(row['test'], []).append(row['secs'])
+    return res
+
+
+def cached_passes(keys: list[str]) -> set[str]:
+    """which of these test cache keys have passed before (and mark those as used now)"""
+    # json_each avoids sqlite's limit on the number of parameters
+    where = 'where key in (select value from json_each(?))'
+    tx = begin()
+    tx.execute(f'update test_cache set ts = current_timestamp {where}', [json.dumps(keys)])
+    rows = tx.execute(f'select key from test_cache {where}', [json.dumps(keys)]).fetchall()
+    tx.commit()
+    return {row[0] for row in rows}
+
+
+# forget cached passes that haven't been used for this long
+CACHE_DAYS = 30
+
+
+def save_cached_passes(keys: list[str]):
+    tx = begin()
+    tx.executemany('insert or replace into test_cache (key) values (?)', [(k,) for k in keys])
+    tx.execute("delete from test_cache where ts < datetime('now', ?)", [f'-{CACHE_DAYS} days'])
+    tx.commit()
+
+
+def test_status(plan: str) -> dict[str, dict]:
+    """the latest result of each test in the plan: {name: {passed, secs, run}}"""
+    return {row.pop('test'): row for row in query(
+        'select test, passed, secs, run from test_status where plan = ?', [plan])}
+
+
+def has_status(plan: str) -> bool:
+    """have any tests in the plan run yet?"""
+    return bool(query('select 1 from test_status where plan = ? limit 1', [plan]))
+
+
+def last_failures(plan: str) -> list[str]:
+    """tests in the plan whose most recent run failed, most recent first"""
+    return [row['test'] for row in query(
+        'select test from test_status where plan = ? and not passed order by run desc', [plan])]
+
+
+def latest_usage(plan: str) -> list[dict]:
+    """the latest run of each test in the plan, with its cpu and memory use (if known):
+    [{test, passed, secs, grp, user_secs, sys_secs, max_rss}]"""
+    return query("""
+        select s.test, s.passed, s.secs, u.grp, u.user_secs, u.sys_secs, u.max_rss
+        from test_status s left join test_usage u on u.run = s.run
+        where s.plan = ? order by s.secs desc""", [plan])
+
+
+def recent_times(plan: str, limit: int) -> dict[str, list[float]]:
+    """the latest run times of each test in a plan, newest first"""
+    res: dict[str, list[float]] = {}
+    for row in query("""
+            select test, secs from (
+              select id, test, secs, row_number() over (
+                partition by test order by id desc) as n
+              from test_runs where plan = ?)
+            where n <= ? order by id desc""", [plan, limit]):
+        res.setdefault(row['test'], []).append(row['secs'])
+    return res
+
+
+def bench_baselines(plan: str) -> dict[str, list[float]]:
+    """the saved benchmark samples for each test in the plan"""
+    return {row['test']: json.loads(row['samples']) for row in query(
+        'select test, samples from bench_baselines where plan = ?', [plan])}
+
+
+def save_bench_baselines(plan: str, results: dict[str, list[float]]):
+    """make these samples the baseline for their tests"""
+    tx = begin()
+    tx.executemany("""
+        insert into bench_baselines (plan, test, samples) values (?, ?, ?)
+        on conflict (plan, test) do update
+          set samples=excluded.samples, ts=current_timestamp""",
+                   [(plan, test, json.dumps(samples)) for test, samples in results.items()])
+    tx.commit()
@@ -0,0 +1,187 @@
+"""
+Line diffs for failed tests.
+
+The lines use difflib.Differ's notation, read as a patch that turns
+the actual output into the expected output:
+
+    '  ' a line that matches
+    '- ' a line to remove from the output
+    '+ ' a line to add
+    '? ' hints about which characters changed in the line above
+
+The default engine ('myers') finds a shortest edit script with
+Myers' O(ND) algorithm, comparing lines by their (interned) hash
+instead of character by character. Long runs of matching lines are
+collapsed to CONTEXT lines on each side of a change, the whole diff
+is capped at MAX_LINES, and the '?' hints are only worked out for
+the changed lines that are actually shown.
+
+'difflib' is the old engine: the full `difflib.Differ` output. It
+can take seconds on big outputs, but is sometimes easier to read.
+More engines can be registered with the `engine` decorator and
+picked with `"diff": "name"` in `.tanco`.
+"""
+import difflib
+from typing import Callable
+
+# matching lines to show around each change
+CONTEXT = 3
+# the most diff lines to produce
+MAX_LINES = 200
+# give up on finding a shortest diff after this many edits
+MAX_EDITS = 1000
+# no '?' hints for lines longer than this
+INTRALINE_MAX = 500
+
+Engine = Callable[[list[str], list[str]], list[str]]
+ENGINES: dict[str, Engine] = {}
+DEFAULT = 'myers'
+
+
+def engine(name: str):
+    """register a diff engine under `name`"""
+    def register(fn: Engine) -> Engine:
+        ENGINES[name] = fn
+        return fn
+    return register
+
+
+def compare(actual: list[str], expected: list[str], name: str | None = None) -> list[str]:
+    """the diff lines that turn `actual` into `expected`"""
+    try:
+        fn = ENGINES[name or DEFAULT]
+    except KeyError:
+        raise ValueError(f'unknown diff engine {name!r} (try one of: {", ".join(ENGINES)})')
+    return fn(actual, expected)
+
+
+@engine('difflib')
+def full_diff(actual, expected):
+    """every line, with character hints (slow on big outputs)"""
+    return list(difflib.Differ().compare(actual, expected))
+
+
+def edit_script(a: list[int], b: list[int]) -> list[tuple[str, int, int]]:
+    """
+    Myers' algorithm: a shortest list of ('=', '-' or '+', i, j) steps
+    from a to b. falls back to replacing everything past MAX_EDITS.
+    """
+    n, m = len(a), len(b)
+    # matching ends are free (and common: usually only a few lines differ)
+    pre = 0
+    while pre < n and pre < m and a[pre] == b[pre]:
+        pre += 1
+    suf = 0
+    while suf < n - pre and suf < m - pre and a[n - 1 - suf] == b[m - 1 - suf]:
+        suf += 1
+    head = [('=', i, i) for i in range(pre)]
+    tail = [('=', n - suf + k, m - suf + k) for k in range(suf)]
+    a, b = a[pre:n - suf], b[pre:m - suf]
+    n, m = len(a), len(b)
+    if not n or not m:
+        middle = [('-', pre + i, pre) for i in range(n)] + [('+', pre + n, pre + j) for j in range(m)]
+        return head + middle + tail
+    # v[k] = furthest x on diagonal k (k = x - y). keep a copy per round to trace back.
+    offset = n + m
+    v = [0] * (2 * offset + 2)
+    trace = []
+    found = None
+    for d in range(min(n + m, MAX_EDITS) + 1):
+        trace.append(v[offset - d:offset + d + 2])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]  # step down: insert b[y-1]
+            else:
+                x = v[offset + k - 1] + 1  # step right: delete a[x-1]
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x, y = x + 1, y + 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                found = d
+                break
+        if found is not None:
+            break
+    if found is None:
+        middle = [('-', pre + i, pre) for i in range(n)] + [('+', pre + n, pre + j) for j in range(m)]
+        return head + middle + tail
+    # walk back from (n, m) through the saved rounds
+    steps = []
+    x, y = n, m
+    for d in range(found, -1, -1):
+        prev = trace[d]  # v before round d, for diagonals -d..d+1
+        k = x - y
+        if k == -d or (k != d and prev[k - 1 + d] < prev[k + 1 + d]):
+            pk = k + 1
+        else:
+            pk = k - 1
+        px = prev[pk + d]
+        py = px - pk
+        while x > px and y > py:
+            x, y = x - 1, y - 1
+            steps.append(('=', x, y))
+        if d:
+            steps.append(('+', px, py) if x == px else ('-', px, py))
+        x, y = px, py
+    steps.reverse()
+    return head + [(op, pre + i, pre + j) for op, i, j in steps] + tail
+
+
+def hints(old: str, new: str) -> list[str]:
+    """'-', '?', '+', '?' lines for a changed line, like difflib.Differ"""
+    if len(old) > INTRALINE_MAX or len(new) > INTRALINE_MAX:
+        return ['- ' + old, '+ ' + new]
+    return list(difflib.Differ().compare([old], [new]))
+
+
+@engine('myers')
+def myers_diff(actual, expected):
+    """changed lines with a little context (fast on big outputs)"""
+    ids: dict[str, int] = {}
+    a = [ids.setdefault(line, len(ids)) for line in actual]
+    b = [ids.setdefault(line, len(ids)) for line in expected]
+    script = edit_script(a, b)
+    changed = [n for n, (op, _, _) in enumerate(script) if op != '=']
+    if not changed:
+        return ['  ' + line for line in actual]
+    # which matching steps are close enough to a change to show
+    shown = set()
+    for n in changed:
+        shown.update(range(max(0, n - CONTEXT), min(len(script), n + CONTEXT + 1)))
+    res: list[str] = []
+    done = 0  # changed lines shown so far
+    n = 0
+    while n < len(script) and len(res) < MAX_LINES:
+        op, i, j = script[n]
+        if n not in shown:
+            start = n
+            while n < len(script) and n not in shown:
+                n += 1
+            res.append(f'@@ {n - start} matching lines @@')
+            continue
+        if op == '=':
+            res.append('  ' + actual[i])
+            n += 1
+            continue
+        # a block of changes: removals, then additions
+        dels, adds = [], []
+        while n < len(script) and script[n][0] != '=':
+            op, i, j = script[n]
+            if op == '-':
+                dels.append(actual[i])
+            else:
+                adds.append(expected[j])
+            n += 1
+        pairs = min(len(dels), len(adds))
+        for old, new in zip(dels, adds):
+            if len(res) >= MAX_LINES:
+                break
+            res.extend(hints(old, new))
+            done += 2
+        for sign, rest in [('- ', dels[pairs:]), ('+ ', adds[pairs:])]:
+            for line in rest[:max(0, MAX_LINES - len(res))]:
+                res.append(sign + line)
+                done += 1
+    if left := len(changed) - done:
+        res.append(f'@@ ... and {left} more changed lines @@')
+    return res
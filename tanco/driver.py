@@ -18,7 +18,7 @@ import websockets as w
 
 from . import database as db
 from . import model as m
-from . import orgtest, runner
+from . import aiorunner, bench, orgtest, procs, runner, schedule, stats, watch
 from .client import TancoClient
 from .model import Config, TestDescription
 
@@ -31,6 +31,7 @@ class TancoDriver(cmdlib.Cmd):
         self.result = None    # for passing data between commands
         self.client = TancoClient()
         self.target = None    # target program
+        self.atarget: aiorunner.AsyncTarget | None = None  # target program for websockets
         self.cmdqueue = ['']
         self.end_cmd = ';'
         self.end_out = ''
@@ -297,6 +298,55 @@ class TancoDriver(cmdlib.Cmd):
         """Print tanco version (by calling `pip show tanco`) """
         subprocess.run(['pip', 'show', 'tanco'])
 
+    @staticmethod
+    def do_bench(arg):
+        """Time each test over many runs, and compare with the saved baseline.
+        Usage: bench [-t / --tests ORG_FILE] [-n / --runs N] [-w / --warmup N]
+                     [--timeout SECS] [--save] [TEST_NAMES...]
+        """
+        parser = argparse.ArgumentParser(prog='bench', description='Benchmark the target on each test')
+        parser.add_argument('-t', '--tests', help='Path to an org file (or a directory of them) containing tests')
+        parser.add_argument('-n', '--runs', type=int, default=bench.RUNS,
+                            help=f'Timed runs per test (default: {bench.RUNS})')
+        parser.add_argument('-w', '--warmup', type=int, default=bench.WARMUP,
+                            help=f'Untimed runs per test before those (default: {bench.WARMUP})')
+        parser.add_argument('--timeout', type=m.parse_duration,
+                            help='Time limit per run, e.g. 2s or 250ms, unless the test plan sets one')
+        parser.add_argument('--save', action='store_true', help='Make these timings the new baseline')
+        parser.add_argument('test_names', nargs='*', help=TEST_NAMES_HELP)
+        try:
+            args = parser.parse_args(shlex.split(arg) if arg else [])
+        except SystemExit:
+            return
+        cfg = runner.load_config()
+        if args.tests:
+            cfg.test_path = args.tests
+        if args.timeout:
+            cfg.timeout = args.timeout
+        with runner.test_errors(cfg):
+            bench.bench(cfg, args.test_names or None, max(1, args.runs), max(0, args.warmup), args.save)
+
+    @staticmethod
+    def do_stats(arg):
+        """Show the slowest tests, their trends and per-group totals (from recorded runs).
+        Usage: stats [-t / --tests ORG_FILE] [-n / --top N]
+        """
+        parser = argparse.ArgumentParser(prog='stats', description='Show run times and resource use of tests')
+        parser.add_argument('-t', '--tests', help='Path to an org file (or a directory of them) containing tests')
+        parser.add_argument('-n', '--top', type=int, default=10, help='How many of the slowest tests to show')
+        try:
+            args = parser.parse_args(shlex.split(arg) if arg else [])
+        except SystemExit:
+            return
+        cfg = runner.load_config()
+        if args.tests:
+            cfg.test_path = args.tests
+        plan = runner.plan_key(cfg)
+        if not plan:
+            print('No test plan. Use -t ORG_FILE, or `tanco init` to start an attempt.')
+            return
+        stats.show(plan, args.top)
+
     @staticmethod
     def do_status(_arg):
         """print information about the current attempt"""
@@ -359,7 +409,7 @@ class TancoDriver(cmdlib.Cmd):
         self.do_show()
 
     def do_spawn(self, _arg):
-        self.target = runner.spawn(runner.load_config())
+        self.target = runner.spawn(runner.load_config(), stderr=None)
 
     def ensure_target(self):
         if not self.target:
@@ -381,9 +431,33 @@ class TancoDriver(cmdlib.Cmd):
         if not suppress:
             print(self.output)
 
+    async def aspawn(self):
+        """(re)start the target program used by the websocket commands"""
+        if self.atarget:
+            await self.atarget.stop()
+        self.atarget = aiorunner.AsyncTarget(runner.load_config(), self.end_cmd, self.end_out, timeout=None)
+        await self.atarget.start()
+
+    async def asend(self, msg: str) -> str:
+        """like `send`, but awaits the reply without blocking the event loop"""
+        if not self.atarget:
+            await self.aspawn()
+        assert self.atarget
+        if msg.endswith(self.end_cmd): msg = msg[:-1]
+        self.output = '\n'.join(line.rstrip() for line in await self.atarget.send([msg]))
+        return self.output
+
+    @staticmethod
+    async def atest(names=None):
+        """like `test`, but on the asyncio engine"""
+        cfg = runner.load_config()
+        with runner.test_errors(cfg):
+            await aiorunner.run_tests(cfg, names)
+
     async def ws_talk(self, ws: w.WebSocketCommonProtocol):
         """communicate with a websocket for 'share' and 'bind' commands"""
-        self.ensure_target()
+        if not self.atarget:
+            await self.aspawn()
 
         async for msg in ws:
             assert isinstance(msg, str)
@@ -395,17 +469,15 @@ class TancoDriver(cmdlib.Cmd):
             if tokens:
                 match tokens[0]:
                     case 'send':
-                        cmd = shlex.join(tokens[1:])
-                        self.do_send(cmd, suppress=True)
-                        res = self.output
+                        res = await self.asend(shlex.join(tokens[1:]))
                     case 'test':
-                        self.do_test('')
+                        await self.atest()
                         res = 'ran `tanco test`'
                     case 'next':
-                        self.do_next('')
+                        await asyncio.to_thread(self.do_next, '')
                         res = 'ran `tanco next`'
                     case 'spawn':
-                        self.do_spawn('')
+                        await self.aspawn()
                         res = 'ran `tanco spawn`'
                     case _: res = 'ERROR: unknown command'
             else:
@@ -443,11 +515,12 @@ class TancoDriver(cmdlib.Cmd):
     @staticmethod
     def do_test(arg):
         """Run the tests.
-        Usage: test [-t / --tests ORG_FILE] [TEST_NAMES...]
+        Usage: test [-t / --tests ORG_FILE] [-j JOBS] [-x] [--engine ENGINE] [TEST_NAMES...]
         """
         parser = argparse.ArgumentParser(prog='test', description='Run tanco tests')
-        parser.add_argument('-t', '--tests', help='Path to org file containing tests')
-        parser.add_argument('test_names', nargs='*', help='Specific test names to run')
+        parser.add_argument('-t', '--tests', help='Path to an org file (or a directory of them) containing tests')
+        _add_run_options(parser)
+        parser.add_argument('test_names', nargs='*', help=TEST_NAMES_HELP)
 
         try:
             args = parser.parse_args(shlex.split(arg) if arg else [])
@@ -458,10 +531,38 @@ class TancoDriver(cmdlib.Cmd):
         cfg = runner.load_config()
         if args.tests:
             cfg.test_path = args.tests
+        _apply_run_options(cfg, args)
 
         names = args.test_names or None
         _run_tests_with_error_handling(cfg, names)
 
+    @staticmethod
+    def do_watch(arg):
+        """Rerun the tests whenever a file in this directory changes.
+        Usage: watch [-t / --tests ORG_FILE] [-j JOBS] [-x] [--engine ENGINE]
+                     [--debounce SECS] [--poll] [TEST_NAMES...]
+        """
+        parser = argparse.ArgumentParser(prog='watch', description='Rerun tanco tests on every change')
+        parser.add_argument('-t', '--tests', help='Path to an org file (or a directory of them) containing tests')
+        _add_run_options(parser)
+        parser.add_argument('--debounce', type=m.parse_duration, default=watch.DEBOUNCE,
+                            help='Wait for this much quiet after a change before running (default: 200ms)')
+        parser.add_argument('--poll', action='store_true',
+                            help='Check file modification times instead of using inotify')
+        parser.add_argument('test_names', nargs='*', help=TEST_NAMES_HELP)
+
+        try:
+            args = parser.parse_args(shlex.split(arg) if arg else [])
+        except SystemExit:
+            return
+
+        cfg = runner.load_config()
+        if args.tests:
+            cfg.test_path = args.tests
+        cfg.schedule = 'focus'
+        _apply_run_options(cfg, args)
+        watch.watch(cfg, args.test_names or None, args.debounce, args.poll)
+
     @staticmethod
     def do_q(_arg):
         """Exit the shell."""
@@ -474,13 +575,15 @@ class TancoDriver(cmdlib.Cmd):
 
     def do_run(self, arg):
         """Run tests from an org file or from the database
-        Usage: run [-t / --tests ORG_FILE] [-c COMMAND] [-v / --verbose] [TEST_NAMES...] [-- PROGRAM_ARGS...]
+        Usage: run [-t / --tests ORG_FILE] [-c COMMAND] [-v / --verbose] [-j JOBS] [-x]
+                   [--engine ENGINE] [TEST_NAMES...] [-- PROGRAM_ARGS...]
         """
         parser = argparse.ArgumentParser(prog='run', description='Run tanco tests')
-        parser.add_argument('-t', '--tests', help='Path to org file containing tests')
+        parser.add_argument('-t', '--tests', help='Path to an org file (or a directory of them) containing tests')
         parser.add_argument('-c', help='Run command via shell (e.g. -c \'python script.py\')')
         parser.add_argument('-v', '--verbose', action='store_true', help='Print configuration before running tests')
-        parser.add_argument('test_names', nargs='*', help='Specific test names to run')
+        _add_run_options(parser)
+        parser.add_argument('test_names', nargs='*', help=TEST_NAMES_HELP)
 
         # Split on '--' to separate tanco args from program args
         tokens = shlex.split(arg) if arg else []
@@ -512,6 +615,7 @@ class TancoDriver(cmdlib.Cmd):
         elif not args.tests:
             # No program override; use .tanco defaults
             pass
+        _apply_run_options(cfg, args)
 
         # Dump config if verbose flag is set
         if args.verbose:
@@ -523,29 +627,47 @@ class TancoDriver(cmdlib.Cmd):
         _run_tests_with_error_handling(cfg, names)
 
 
+# the TEST_NAMES of test, run, watch and bench (see selection.py)
+TEST_NAMES_HELP = 'Tests to run: names, globs (io.*), re:REGEX, grp:N or :failed'
+
+
+def _add_run_options(parser: argparse.ArgumentParser):
+    """options shared by `test`, `run` and `watch`"""
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='Number of tests to run at once (default: one per cpu core)')
+    parser.add_argument('-x', '--fail-fast', action='store_true',
+                        help='Stop starting new tests after the first failure')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'],
+                        help='How to drive the target programs (default: threads)')
+    parser.add_argument('--timeout', type=m.parse_duration,
+                        help='Time limit per test, e.g. 2s or 250ms, unless the test plan sets one')
+    parser.add_argument('--order', choices=sorted(schedule.SCHEDULES),
+                        help='Which tests to run first (default: failed-fastest, or focus for watch)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Rerun tests that already passed with the same cache-files')
+
+
+def _apply_run_options(cfg: Config, args: argparse.Namespace):
+    if args.jobs is not None:
+        cfg.jobs = args.jobs
+    if args.fail_fast:
+        cfg.fail_fast = True
+    if args.engine:
+        cfg.engine = args.engine
+    if args.timeout:
+        cfg.timeout = args.timeout
+    if args.no_cache:
+        cfg.use_cache = False
+    if args.order:
+        cfg.schedule = args.order
+
+
 def _run_tests_with_error_handling(cfg, names=None):
-    try:
-        runner.run_tests(cfg, names)
-    except runner.NoTestPlanError:
-        runner.error(cfg, ['No challenge selected.',
-                          'Use `tanco init`, `tanco test -t file.org`, or set TEST_PLAN environment variable.'])
-    except runner.NoTestsFoundError as e:
-        runner.error(cfg, [str(e),
-                          '',
-                          'For org files, tests should be defined using:',
-                          '  ** TEST testname : title',
-                          '  #+begin_src',
-                          '  > input line',
-                          '  expected output',
-                          '  #+end_src'])
-    except FileNotFoundError as e:
-        runner.error(cfg, [f'Test file not found: {e.filename}',
-                          '',
-                          'Make sure the path is correct and the file exists.'])
-    except runner.StopTesting:
-        pass
-    except Exception:
-        runner.handle_unexpected_error(cfg)
+    with runner.test_errors(cfg):
+        if cfg.engine == 'asyncio':
+            asyncio.run(aiorunner.run_tests(cfg, names))
+        else:
+            runner.run_tests(cfg, names)
 
 
 def _migrate_org_file(lines):
@@ -706,6 +828,7 @@ def show_help():
 
 def main():
     db.ensure_sdb()
+    procs.exit_on_sigterm()
     d = TancoDriver()
     if '-q' in sys.argv:
         sys.argv.remove('-q')
@@ -0,0 +1,186 @@
+"""
+Keep the target inside the resource limits from `.tanco`:
+
+    "limits": {"cpu": "10s", "memory": "512M", "fsize": "64M", "nproc": 64}
+
+Each fresh process gets setrlimit() calls between fork and exec
+(POSIX only): RLIMIT_CPU, RLIMIT_AS, RLIMIT_FSIZE and RLIMIT_NPROC.
+RLIMIT_NPROC counts every process the user owns, and RLIMIT_AS counts
+address space rather than memory (which upsets some runtimes), so
+with `"cgroup": "/sys/fs/cgroup/<delegated dir>"` each run gets its
+own cgroup v2 group instead, with memory.max and pids.max set, and
+the kernel tells us when they were hit. (tanco needs write access
+to that directory: see "delegation" in the cgroup v2 docs.)
+
+A persistent worker runs every test, so it gets no cpu limit or cgroup.
+
+After every run, `check` works out whether a limit stopped the target,
+from the exit signal or the cgroup's event counters, and fails the test
+if so (a program cut off by its cpu limit may well have printed the
+right output first). When the output was wrong anyway, the error
+messages the usual runtimes print also count.
+"""
+import os
+import signal
+import tempfile
+import time
+
+from . import model as m
+from .model import Limits, ResultKind
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+# what runtimes print when an allocation or a fork fails
+MEMORY_ERRORS = ['MemoryError', 'bad_alloc', 'out of memory', 'Out of memory',
+                 'OutOfMemoryError', 'Cannot allocate memory']
+NPROC_ERRORS = ['Resource temporarily unavailable', "can't start new thread"]
+FSIZE_ERRORS = ['File too large']
+
+
+def rlimits(lim: Limits, persistent: bool = False, cgroup: 'Cgroup | None' = None) -> list[tuple[int, int, int]]:
+    """the (resource, soft, hard) limits to set in the child"""
+    if resource is None:
+        return []
+    res = []
+    if lim.cpu is not None and not persistent:
+        # SIGXCPU at the soft limit, SIGKILL a second later for programs that ignore it
+        soft = max(1, -int(-lim.cpu // 1))
+        res.append((resource.RLIMIT_CPU, soft, soft + 1))
+    if lim.memory is not None and cgroup is None:
+        res.append((resource.RLIMIT_AS, lim.memory, lim.memory))
+    if lim.fsize is not None:
+        res.append((resource.RLIMIT_FSIZE, lim.fsize, lim.fsize))
+    if lim.nproc is not None and cgroup is None and hasattr(resource, 'RLIMIT_NPROC'):
+        res.append((resource.RLIMIT_NPROC, lim.nproc, lim.nproc))
+    return res
+
+
+class Cgroup:
+    """a cgroup v2 group for one run of the target"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @classmethod
+    def create(cls, lim: Limits) -> 'Cgroup | None':
+        """a new group under lim.cgroup with the memory and process limits (None if not configured)"""
+        if not lim.cgroup:
+            return None
+        if not os.path.exists(os.path.join(lim.cgroup, 'cgroup.controllers')):
+            raise ValueError(f'{lim.cgroup} is not a cgroup v2 directory')
+        res = cls(tempfile.mkdtemp(prefix='tanco-', dir=lim.cgroup))
+        if lim.memory is not None:
+            res.write('memory.max', str(lim.memory))
+            res.write('memory.swap.max', '0')
+        if lim.nproc is not None:
+            res.write('pids.max', str(lim.nproc))
+        return res
+
+    def write(self, name: str, value: str):
+        try:
+            with open(os.path.join(self.path, name), 'w') as f:
+                f.write(value)
+        except FileNotFoundError:
+            if name != 'memory.swap.max':  # (not there without swap accounting)
+                raise
+
+    def events(self) -> dict[str, int]:
+        """the counters from memory.events and pids.events"""
+        res = {}
+        for name in ['memory.events', 'pids.events']:
+            try:
+                with open(os.path.join(self.path, name)) as f:
+                    for line in f:
+                        key, _, value = line.partition(' ')
+                        res[f'{name.split(".")[0]}.{key}'] = int(value)
+            except (OSError, ValueError):
+                pass
+        return res
+
+    def remove(self):
+        """kill anything left in the group and delete it"""
+        if os.path.exists(os.path.join(self.path, 'cgroup.kill')):
+            self.write('cgroup.kill', '1')
+        for _ in range(100):
+            try:
+                os.rmdir(self.path)
+                return
+            except FileNotFoundError:
+                return
+            except OSError:  # (busy until the killed processes are gone)
+                time.sleep(0.01)
+
+
+def preexec(lim: Limits, persistent: bool = False, cgroup: Cgroup | None = None):
+    """a preexec_fn for Popen that applies the limits (None if there are none)"""
+    todo = rlimits(lim, persistent, cgroup)
+    procs = os.path.join(cgroup.path, 'cgroup.procs') if cgroup else None
+    if not todo and not procs:
+        return None
+
+    def apply():
+        # (runs in the child between fork and exec: keep it small)
+        if procs:
+            fd = os.open(procs, os.O_WRONLY)
+            os.write(fd, b'0')
+            os.close(fd)
+        for res, soft, hard in todo:
+            resource.setrlimit(res, (soft, hard))
+    return apply
+
+
+def fmt_size(size: int) -> str:
+    return f'{size / 2 ** 20:g}M'
+
+
+def breach(lim: Limits, returncode: int | None, used: m.Usage | None, stderr: str,
+           cgroup: Cgroup | None = None) -> str | None:
+    """which limit (if any) stopped the program"""
+    events = cgroup.events() if cgroup else {}
+    if events.get('memory.oom_kill'):
+        return 'memory'
+    if events.get('pids.max'):
+        return 'nproc'
+    if lim.cpu is not None:
+        if returncode == -getattr(signal, 'SIGXCPU', 0):
+            return 'cpu'
+        if returncode == -getattr(signal, 'SIGKILL', 0) and used and used.user is not None \
+                and used.user + (used.sys or 0) >= lim.cpu:
+            return 'cpu'
+    if lim.fsize is not None:
+        if returncode == -getattr(signal, 'SIGXFSZ', 0) or any(e in stderr for e in FSIZE_ERRORS):
+            return 'fsize'
+    if lim.memory is not None and any(e in stderr for e in MEMORY_ERRORS):
+        return 'memory'
+    if lim.nproc is not None and any(e in stderr for e in NPROC_ERRORS):
+        return 'nproc'
+    return None
+
+
+def describe(lim: Limits, limit: str) -> str:
+    match limit:
+        case 'cpu': return f'It used more than {lim.cpu:g}s of cpu time.'
+        case 'memory': return f'It ran out of memory (limit: {fmt_size(lim.memory)}).'
+        case 'fsize': return f'It tried to write a file bigger than {fmt_size(lim.fsize)}.'
+        case 'nproc': return f"It couldn't start another process (limit: {lim.nproc})."
+
+
+def check(lim: Limits, res: m.TestResult, returncode: int | None, used: m.Usage | None,
+          cgroup: Cgroup | None = None, stderr: str = '') -> m.TestResult:
+    """
+    turn a run that a limit stopped into a LimitFailure, even if its output
+    matched. (the error messages in stderr only count when the test failed anyway.)
+    """
+    if res.error is not None:
+        stderr = res.error.stderr
+        limit = breach(lim, returncode, used, stderr, cgroup)
+    else:
+        limit = breach(lim, returncode, used, '', cgroup)
+    if limit is None:
+        return res
+    failure = m.LimitFailure(limit, [describe(lim, limit), *(['', *res.error.error_lines()] if res.error else [])])
+    failure.stderr = stderr
+    return m.TestResult(ResultKind.Fail, error=failure, actual=res.actual, secs=res.secs, usage=res.usage)
@@ -1,13 +1,36 @@
-import difflib
 import json
 import os
+import re
 from dataclasses import dataclass, field
 from enum import Enum
 
+from . import diff
+
 ResultKind = Enum('ResultKind', 'Pass Fail AskServer')
 Transition = Enum('Transition', 'Pass Next Fail')
 AttemptState = Enum('AttemptState', 'Start Build Fix Change Done')
 
+DURATION_UNITS = {'': 1.0, 's': 1.0, 'ms': 0.001, 'us': 0.000001, 'm': 60.0}
+
+
+def parse_duration(text: str) -> float:
+    """parse '2', '1.5s', '250ms' etc. into seconds"""
+    match = re.fullmatch(r'\s*([0-9]*\.?[0-9]+)\s*(s|ms|us|m|)\s*', text)
+    if not match:
+        raise ValueError(f'invalid duration: {text!r}')
+    return float(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+SIZE_UNITS = {'': 1, 'b': 1, 'k': 2 ** 10, 'm': 2 ** 20, 'g': 2 ** 30}
+
+
+def parse_size(text: str) -> int:
+    """parse '4096', '512k', '64M', '1.5GB' etc. into bytes"""
+    match = re.fullmatch(r'\s*([0-9]*\.?[0-9]+)\s*([bkmg]?)(?:i?b)?\s*', text, re.IGNORECASE)
+    if not match:
+        raise ValueError(f'invalid size: {text!r}')
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).lower()])
+
 
 class ValidationRule:
     def to_data(self):
@@ -34,11 +57,20 @@ class LineDiffRule(ValidationRule):
 
 
 class TestFailure(AssertionError):
+    stderr: str = ''  # excerpt of what the program wrote to stderr (kept locally)
+
     def error_lines(self):
         raise NotImplementedError
 
+    def report_lines(self):
+        """the error lines, plus the stderr excerpt if there is one"""
+        lines = self.error_lines()
+        if self.stderr:
+            lines = [*lines, '', '---- what your program wrote to stderr ----', *self.stderr.splitlines()]
+        return lines
+
     def print_error(self):
-        for line in self.error_lines():
+        for line in self.report_lines():
             print(line)
 
 
@@ -49,8 +81,9 @@ class LineDiffFailure(TestFailure):
         self.diff = diff
 
     @staticmethod
-    def from_lines(actual: list[str], expected: list[str]):
-        return LineDiffFailure(actual, list(difflib.Differ().compare(actual, expected)))
+    def from_lines(actual: list[str], expected: list[str], engine: str | None = None):
+        """diff the lines with the named engine from diff.ENGINES (or the default)"""
+        return LineDiffFailure(actual, diff.compare(actual, expected, engine))
 
     @staticmethod
     def from_data(data: dict) -> 'LineDiffFailure':
@@ -65,12 +98,136 @@ class LineDiffFailure(TestFailure):
         return (['---- how to patch your output to pass the test ----', *self.diff])
 
 
+class BudgetFailure(TestFailure):
+    """the output was right, but the program used too much time or memory"""
+
+    def __init__(self, overruns: list[str]):
+        self.overruns = overruns
+
+    @staticmethod
+    def from_data(data: dict) -> 'BudgetFailure':
+        return BudgetFailure(data['overruns'])
+
+    def to_data(self):
+        return {'kind': 'budget', 'data': {'overruns': self.overruns}}
+
+    def error_lines(self):
+        return ['---- the output was right, but your program went over budget ----', *self.overruns]
+
+
+class LimitFailure(TestFailure):
+    """the program was stopped (or crashed) by one of the target's resource limits"""
+
+    def __init__(self, limit: str, lines: list[str]):
+        self.limit = limit
+        self.lines = lines
+
+    @staticmethod
+    def from_data(data: dict) -> 'LimitFailure':
+        return LimitFailure(data['limit'], data['lines'])
+
+    def to_data(self):
+        return {'kind': 'limit', 'data': {'limit': self.limit, 'lines': self.lines}}
+
+    def error_lines(self):
+        return [f'---- your program went over its {self.limit} limit ----', *self.lines]
+
+
+class MessageFailure(TestFailure):
+    """a failure that is described by a few lines of text"""
+
+    def __init__(self, lines: list[str]):
+        self.lines = lines
+
+    @staticmethod
+    def from_data(data: dict) -> 'MessageFailure':
+        return MessageFailure(data['lines'])
+
+    def to_data(self):
+        return {'kind': 'message', 'data': {'lines': self.lines}}
+
+    def error_lines(self):
+        return self.lines
+
+
+@dataclass
+class Usage:
+    """resources a target used for one test (None where the os can't tell)"""
+    wall: float = 0
+    user: float | None = None  # cpu seconds
+    sys: float | None = None
+    max_rss: int | None = None  # peak resident memory, in bytes
+
+
+@dataclass
+class Budget:
+    """limits that a passing run has to stay within (None means no limit)"""
+    time: float | None = None  # wall seconds
+    cpu: float | None = None  # user + system seconds
+    rss: int | None = None  # peak resident memory, in bytes
+
+    @classmethod
+    def parse(cls, text: str) -> 'Budget':
+        """parse 'time=50ms cpu=20ms rss=64M'"""
+        res = cls()
+        for item in text.split():
+            key, _, value = item.partition('=')
+            match key:
+                case 'time' | 'cpu': setattr(res, key, parse_duration(value))
+                case 'rss': res.rss = parse_size(value)
+                case _: raise ValueError(f'unknown budget {key!r} (try time=, cpu= or rss=)')
+        return res
+
+    def merged(self, other: 'Budget') -> 'Budget':
+        """this budget, with the limits that `other` sets replaced"""
+        return Budget(*(b if b is not None else a for a, b in
+                        [(self.time, other.time), (self.cpu, other.cpu), (self.rss, other.rss)]))
+
+    def overruns(self, usage: Usage) -> list[str]:
+        """what went over budget (limits the os can't measure are skipped)"""
+        res = []
+        if self.time is not None and usage.wall > self.time:
+            res.append(f'time: {usage.wall * 1000:.1f}ms (budget: {self.time * 1000:g}ms)')
+        if self.cpu is not None and usage.user is not None:
+            if (cpu := usage.user + (usage.sys or 0)) > self.cpu:
+                res.append(f'cpu: {cpu * 1000:.1f}ms (budget: {self.cpu * 1000:g}ms)')
+        if self.rss is not None and usage.max_rss is not None and usage.max_rss > self.rss:
+            res.append(f'rss: {usage.max_rss / 2 ** 20:.1f}M (budget: {self.rss / 2 ** 20:g}M)')
+        return res
+
+
+@dataclass
+class Limits:
+    """resource limits for each run of the target (None means no limit)"""
+    cpu: float | None = None  # cpu seconds
+    memory: int | None = None  # bytes of address space (or of memory, in a cgroup)
+    fsize: int | None = None  # the biggest file it may write, in bytes
+    nproc: int | None = None  # processes (for the whole user, unless in a cgroup)
+    cgroup: str | None = None  # a cgroup v2 directory to make a group per run in
+
+    @classmethod
+    def from_data(cls, data: dict) -> 'Limits':
+        """parse {"cpu": "10s", "memory": "512M", "fsize": "64M", "nproc": 64, "cgroup": "..."}"""
+        res = cls()
+        for key, value in data.items():
+            match key:
+                case 'cpu': res.cpu = parse_duration(value) if isinstance(value, str) else float(value)
+                case 'memory' | 'fsize': setattr(res, key, parse_size(value) if isinstance(value, str) else int(value))
+                case 'nproc': res.nproc = int(value)
+                case 'cgroup': res.cgroup = value
+                case _: raise ValueError(f'unknown limit {key!r} (try cpu, memory, fsize, nproc or cgroup)')
+        return res
+
+
 @dataclass
 class TestResult:
     kind: ResultKind
     error: TestFailure | None = None
     rule: ValidationRule | None = None
     actual: list[str] = field(default_factory=list)
+    secs: float = 0  # how long the test took to run (not sent to the server)
+    remote: bool = False  # checked by the server (so it already knows)
+    usage: Usage | None = None  # cpu and memory (not sent to the server)
 
     @staticmethod
     def from_data(data: dict) -> 'TestResult':
@@ -81,6 +238,9 @@ class TestResult:
                 err = data['error']
                 match err['kind']:
                     case 'diff': res.error = LineDiffFailure.from_data(err['data'])
+                    case 'message': res.error = MessageFailure.from_data(err['data'])
+                    case 'budget': res.error = BudgetFailure.from_data(err['data'])
+                    case 'limit': res.error = LimitFailure.from_data(err['data'])
                     case _: raise ValueError(f"unknown error kind: {err['kind']}")
             case ResultKind.Pass:
                 rule = data['rule']
@@ -113,6 +273,8 @@ class TestDescription:
     body: str = ''
     ilines: list[str] = field(default_factory=list)
     olines: list[str] = field(default_factory=list)
+    timeout: float | None = None  # seconds (from the test plan)
+    budget: Budget | None = None  # time and memory limits (from the test plan)
 
     @property
     def rule(self) -> ValidationRule | None:
@@ -121,14 +283,14 @@ class TestDescription:
         else:
             return LineDiffRule(self.olines)
 
-    def check_output(self, actual: list[str]) -> TestResult:
+    def check_output(self, actual: list[str], diff_engine: str | None = None) -> TestResult:
         if self.olines is None:
             return TestResult(ResultKind.AskServer)
         elif self.olines == actual:
             rule = LineDiffRule(self.olines)
             return TestResult(ResultKind.Pass, rule=rule)
         else:
-            e = LineDiffFailure.from_lines(actual=actual, expected=self.olines)
+            e = LineDiffFailure.from_lines(actual=actual, expected=self.olines, engine=diff_engine)
             return TestResult(ResultKind.Fail, error=e, actual=actual)
 
 
@@ -140,9 +302,11 @@ class Challenge:
     server: str = ''
     title: str = ''
     tests: list[TestDescription] = field(default_factory=list)
+    includes: list[str] = field(default_factory=list)  # from `#+include:` (see plans.py)
 
 
 DEFAULT_TARGET = './my-program'
+DEFAULT_TIMEOUT = 5.0
 
 
 @dataclass
@@ -167,6 +331,33 @@ class Config:
     restart_cmd: str = ''
     # expected response after restart_cmd (output delimiter)
     restart_expect: str = ''
+    # 'length' if the persistent target sends each reply as a length line, then
+    # that many bytes (instead of ending it with restart_expect)
+    framing: str = ''
+    # number of tests to run at once (0 means one per cpu core)
+    jobs: int = 0
+    # stop scheduling new tests as soon as one fails
+    fail_fast: bool = False
+    # how many target processes to launch ahead of the test that needs them
+    prespawn: int = 1
+    # 'threads' (runner) or 'asyncio' (aiorunner)
+    engine: str = 'threads'
+    # seconds to wait for each test, unless the test plan says otherwise
+    timeout: float = 0
+    # per-test overrides: {test name or 'prefix.*': seconds}
+    timeouts: dict[str, float] = field(default_factory=dict)
+    # if set, time out at this multiple of a test's recorded p99 run time
+    adaptive_timeout: float = 0
+    # files (or glob patterns) that make up the target, for the result cache
+    cache_files: list[str] = field(default_factory=list)
+    # skip tests that already passed with the same target files
+    use_cache: bool = True
+    # order to run the tests in (a strategy from schedule.SCHEDULES)
+    schedule: str = 'failed-fastest'
+    # how to show failed output (an engine from diff.ENGINES)
+    diff: str = diff.DEFAULT
+    # resource limits for the target (a dict in .tanco, see Limits.from_data)
+    limits: Limits = field(default_factory=Limits)
 
     def __post_init__(self):
         if not self.input_path:
@@ -175,6 +366,20 @@ class Config:
             self.skip_lines = int(os.environ.get('SKIP_LINES', '0'))
         if not self.test_plan:
             self.test_plan = os.environ.get('TEST_PLAN')
+        # .tanco may give timeouts as strings like '250ms'
+        if isinstance(self.timeout, str):
+            self.timeout = parse_duration(self.timeout)
+        self.timeouts = {k: parse_duration(v) if isinstance(v, str) else v
+                         for k, v in self.timeouts.items()}
+        if isinstance(self.limits, dict):
+            self.limits = Limits.from_data(self.limits)
+        if self.framing not in ('', 'length'):
+            raise ValueError(f'unknown framing {self.framing!r} (try "length")')
+
+    @property
+    def persistent(self) -> bool:
+        """whether the tests run on long-lived targets, reset with restart_cmd between tests"""
+        return bool(self.restart_cmd and (self.restart_expect or self.framing))
 
     @staticmethod
     def default_target():
@@ -190,8 +395,13 @@ class Config:
             target['restart-cmd'] = self.restart_cmd
         if self.restart_expect:
             target['restart-expect'] = self.restart_expect
+        if self.framing:
+            target['framing'] = self.framing
+        if self.cache_files:
+            target['cache-files'] = self.cache_files
         data = {'targets': {'main': target}}
-        for key in ['input_path', 'test_plan', 'skip_lines']:
+        for key in ['input_path', 'test_plan', 'skip_lines', 'jobs',
+                    'timeout', 'timeouts', 'adaptive_timeout']:
             if getattr(self, key):
                 data[key] = getattr(self, key)
         return json.dumps(data, indent=2)
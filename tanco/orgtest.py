@@ -27,6 +27,20 @@ Format v0.2 (current):
 
    Description lines appear here as plain text.
 
+Settings like `#+timeout: 250ms` apply to the whole
+challenge when they appear before the first headline, to
+a group of tests when they follow an ordinary headline,
+and to a single test when they follow its TEST headline
+(or its `#+name:` in v0.1).
+
+`#+budget: time=50ms cpu=20ms rss=64M` sets limits that a
+test's run has to stay within to pass. A narrower scope only
+replaces the limits it names.
+
+`#+include: other.org` adds the tests of another file (relative
+to this one) after this file's tests. The parser only lists
+them in `Challenge.includes`: see plans.py.
+
 Test lines are simple sequences of lines in the
 following format:
 
@@ -45,7 +59,23 @@ import os
 import re
 from collections import namedtuple
 
-from .model import Challenge, TestDescription
+from .model import Budget, Challenge, TestDescription, parse_duration
+
+# settings that can be given per challenge, group or test:
+# '#+directive:' -> (TestDescription attribute, parser for the value)
+META_DIRECTIVES = {
+    '#+timeout:': ('timeout', parse_duration),
+    '#+budget:': ('budget', Budget.parse),
+}
+
+
+def merge_meta(outer: dict, inner: dict) -> dict:
+    """settings from an inner scope override the outer ones
+    (values with a `merged` method, like budgets, are combined)"""
+    res = dict(outer)
+    for key, value in inner.items():
+        res[key] = res[key].merged(value) if hasattr(res.get(key), 'merged') else value
+    return res
 
 # For v0.1 compatibility
 OldTestDescription = namedtuple('OldTestDescription', ['name', 'lines'])
@@ -65,20 +95,26 @@ class TestReaderStateMachine:
     Supports both v0.1 (#+name: + = and : prefixes) and v0.2 (TEST headlines) formats.
     """
     def __init__(self):
-        self.states = [ # NOTE: this is ordered and first field should == index
-            (0, self.do_nothing),
-            (1, self.on_test_code),
-            (2, self.on_meta_line),
-            (3, self.on_body_text)]  # v0.2: collecting text after #+end_src
+        # the handler for lines that don't cause a transition, by state
+        self.states = [
+            self.on_between_tests,  # 0
+            self.on_test_code,      # 1
+            self.on_meta_line,      # 2
+            self.on_body_text]      # 3 (v0.2: collecting text after #+end_src)
+        # (line prefix, to_state, handler), by state
         self.transitions = [
-            (0, '#+name:', 0, self.on_test_name),
-            (0, '#+begin_src', 1, self.on_begin_test),
-            (1, '#+end_src',   0, self.on_end_test)]
+            [('#+name:', 0, self.on_test_name),
+             ('#+begin_src', 1, self.on_begin_test)],
+            [('#+end_src', 0, self.on_end_test)],
+            [],
+            []]
         self.state = 2
         self.lineno = 0
         self.next_name = self.prev_name = ''
-        self.test_names = []  # only for unique names
+        self.test_names = set()  # only for unique names
         self.tests = []       # collected (name, lines) descriptions
+        self.next_out = 0     # index in self.tests of the next test to build
+        self.names = None     # if set, only build the tests with these names
         self.challenge = Challenge()
         self.focus = None     # used to collect lines for current test
 
@@ -96,23 +132,72 @@ class TestReaderStateMachine:
             r'^\*+\s*(?:TODO|DONE)?\s*TEST\s+(\S+)'
         )
 
+        # settings from META_DIRECTIVES, by scope
+        self.scope = 'challenge'  # or 'group' or 'test'
+        self.meta_test = ''       # test that 'test' scope refers to
+        self.challenge_meta: dict = {}
+        self.group_meta: dict = {}
+        self.test_meta: dict[str, dict] = {}      # set on the test itself
+        self.inherited_meta: dict[str, dict] = {}  # from challenge and group
+
+        # each headline (other than TEST headlines) starts a new group
+        self.grp = 0
+        self.test_grps: dict[str, int] = {}
+
     # -- event handlers -----------------------------------------
 
     def on_line(self, line):
         self.lineno += 1
-        match = [row[2:] for row in self.transitions
-                 if row[0] == self.state and line.startswith(row[1])]
-        if match:  # match :: [( to_state, method )] of len 1
-            self.state = match[0][0]
-            match[0][1](line)
-        else: self.states[self.state][1](line)
+        for prefix, to_state, handler in self.transitions[self.state]:
+            if line.startswith(prefix):
+                self.state = to_state
+                handler(line)
+                return
+        self.states[self.state](line)
+
+    def on_directive(self, line) -> bool:
+        """store a META_DIRECTIVES setting in the current scope (or an include). returns False for other lines"""
+        if not line.startswith('#+'):
+            return False
+        directive = META_DIRECTIVES.get(line[:line.find(':') + 1])
+        if directive is None:
+            if line.startswith('#+include:'):  # another file of tests, to follow this one's
+                self.challenge.includes.append(line.split(':', 1)[1].strip())
+                return True
+            return False
+        key, parse = directive
+        try:
+            value = parse(line.split(':', 1)[1].strip())
+        except ValueError as e:
+            raise ValueError(f'{e} on line {self.lineno}')
+        if self.scope == 'test':
+            meta = self.test_meta.setdefault(self.meta_test, {})
+        elif self.scope == 'group':
+            meta = self.group_meta
+        else:
+            meta = self.challenge_meta
+        meta.update(merge_meta(meta, {key: value}))
+        return True
 
-    def do_nothing(self, line):
-        pass
+    def on_group_headline(self):
+        self.scope = 'group'
+        self.group_meta = {}
+        self.grp += 1
+
+    def on_between_tests(self, line):
+        if self.on_directive(line):
+            pass
+        elif line.startswith('*') and self.format_version != '0.2':
+            self.on_group_headline()
 
     def on_meta_line(self, line):
         c = self.challenge
 
+        if not line.startswith(('#', '*')):
+            return  # text, or a blank line
+        if self.on_directive(line):
+            return
+
         # Detect format version
         if line.startswith('#+tanco-format:'):
             self.format_version = line.split(':', 1)[1].strip()
@@ -155,6 +240,7 @@ class TestReaderStateMachine:
                 self.current_test_name = test_name
                 self.current_test_title = test_title
                 self.current_headline = line.rstrip()
+                self.scope, self.meta_test = 'test', test_name
                 # Transition to state 0 to look for #+begin_src
                 self.state = 0
             else:
@@ -163,21 +249,20 @@ class TestReaderStateMachine:
                     raise ValueError(
                         f'invalid test name {loose.group(1)!r} on line {self.lineno}: '
                         f'names may only contain [a-zA-Z0-9._-]')
+                self.on_group_headline()
 
-        # Allow other lines - they might be comments or other org content
-        elif not line.strip():  # Empty lines are fine
-            pass
-        elif line.startswith('#'):  # Other org directives are fine
-            pass
-        else:  # Regular text is fine too
-            pass
+        elif line.startswith('*'):  # v0.1 section headline
+            self.on_group_headline()
+
+        # Other org directives and comments are fine
 
     def on_test_name(self, line):
         self.next_name = line.split(':')[1].strip()
         assert self.next_name not in self.test_names, (
             'duplicate name {0!r} on line {1}'
             .format(self.next_name, self.lineno))
-        self.test_names.append(self.next_name)
+        self.test_names.add(self.next_name)
+        self.scope, self.meta_test = 'test', self.next_name
 
     def on_begin_test(self, _line):
         # Determine test name based on format version
@@ -195,7 +280,7 @@ class TestReaderStateMachine:
                 raise AssertionError(
                     f'duplicate name {test_name!r} on line {self.lineno}'
                 )
-            self.test_names.append(test_name)
+            self.test_names.add(test_name)
 
             # Use TestContainer for v0.2, OldTestDescription for v0.1
             if self.format_version == '0.2':
@@ -204,7 +289,11 @@ class TestReaderStateMachine:
                 self.tests.append(OldTestDescription(test_name, []))
 
             self.focus = self.tests[-1].lines
+            if self.names is not None and test_name not in self.names:
+                self.focus = None  # (not selected: no need for its lines)
             self.prev_name = test_name
+            self.inherited_meta[test_name] = merge_meta(self.challenge_meta, self.group_meta)
+            self.test_grps[test_name] = self.grp
         else:
             # If no name or duplicate name, ignore this block
             self.focus = None
@@ -223,11 +312,15 @@ class TestReaderStateMachine:
             self.state = 3  # Start collecting body text
             self.body_lines = []
         # In v0.1, go back to state 0 (already handled by transition table)
+        else:
+            self.scope = 'group'
 
     def on_body_text(self, line):
         """Collect plain text after #+end_src in v0.2 format."""
+        if self.on_directive(line):  # settings for this test
+            pass
         # Stop collecting when we hit a new headline or another test directive
-        if line.startswith('*') or line.startswith('#+name:') or line.startswith('#+begin_src'):
+        elif line.startswith(('*', '#+name:', '#+begin_src')):
             # Finalize current test with collected body
             self._finalize_v02_test()
             # Process this line in the appropriate state
@@ -240,7 +333,7 @@ class TestReaderStateMachine:
 
     def _finalize_v02_test(self):
         """Finalize a v0.2 test by adding title and body from headline and collected text."""
-        if not self.tests:
+        if not self.tests or self.tests[-1] is None:
             return
 
         # Get the most recent test
@@ -264,23 +357,70 @@ class TestReaderStateMachine:
 
     def parse(self, path):
         """
-        Generates a sequence of TestDescription named tuples:
-        Format is: (name:Str, lines:[Str])
+        Reads the file in one go and returns the Challenge, with its tests.
+        """
+        with open(path) as f:
+            return self.parse_text(f.read())
+
+    def parse_text(self, text):
+        """
+        Returns the Challenge described by the text of an org file.
+        """
+        lines = text.split('\n')
+        if text.endswith('\n'):
+            lines.pop()  # (the file ends with a newline, not an empty line)
+        self.challenge.tests = list(self.stream(lines))
+        return self.challenge
+
+    def stream_file(self, path, names=None):
+        """
+        Like `stream`, reading the file as it goes.
         """
-        for line in open(path):
+        with open(path) as f:
+            yield from self.stream((line[:-1] if line.endswith('\n') else line for line in f), names)
+
+    def stream(self, lines, names=None):
+        """
+        Generates the TestDescriptions as soon as they're complete, so a
+        caller can start on the first test before the rest are read.
+        With `names`, the other tests are skipped instead of being built.
+        (self.challenge fills in as the header lines go by.)
+        """
+        self.names = None if names is None else set(names)
+        for line in lines:
             self.on_line(line)
+            if self.next_out < len(self.tests) and self.state in (0, 2):
+                yield from self.finished_tests()
 
         # Finalize last test in v0.2 format if needed
         if self.format_version == '0.2' and self.state == 3:
             self._finalize_v02_test()
-
+        yield from self.finished_tests(at_end=True)
+
+    def finished_tests(self, at_end=False):
+        """build the tests that nothing later in the file can change"""
+        while self.next_out < len(self.tests):
+            raw = self.tests[self.next_out]
+            if not at_end and self.next_out == len(self.tests) - 1 and (
+                    self.state in (1, 3) or (self.scope == 'test' and self.meta_test == raw.name)):
+                return  # (its code, text or settings may not be over yet)
+            self.tests[self.next_out] = None  # (done with its lines)
+            self.next_out += 1
+            if self.names is None or raw.name in self.names:
+                yield self.build_test(raw)
+
+    def build_test(self, raw):
+        """the TestDescription for a collected test, with its group and settings"""
         # Parse tests based on format version
         if self.format_version == '0.2':
-            self.challenge.tests = [parse_test_v02(x) for x in self.tests]
+            test = parse_test_v02(raw)
         else:
-            self.challenge.tests = [parse_test_v01(x) for x in self.tests]
-
-        return self.challenge
+            test = parse_test_v01(raw)
+        test.grp = self.test_grps.get(test.name, 0)
+        meta = merge_meta(self.inherited_meta.get(test.name, {}), self.test_meta.get(test.name, {}))
+        for key, value in meta.items():
+            setattr(test, key, value)
+        return test
 
 
 def parse_test_v01(test):
@@ -361,6 +501,11 @@ def read_challenge(path):
     return TestReaderStateMachine().parse(path)
 
 
+def iter_tests(path, names=None):
+    """the tests in the org file (or just the ones in `names`), as they're read"""
+    return TestReaderStateMachine().stream_file(path, names)
+
+
 def tests(path=None):
     """
     Convenience function to instantiate a TestReaderStateMachine
@@ -0,0 +1,193 @@
+"""
+Cache of parsed test plans.
+
+Reading a big org file on every run adds up, so the parsed Challenge
+is kept under the user cache directory (`$TANCO_CACHE_DIR`, or
+`$XDG_CACHE_HOME/tanco`, or `~/.cache/tanco`) in marshal format, one
+file per plan. An entry is used as-is when the plan's size and mtime
+still match. When only the mtime moved, the contents are hashed and
+compared before the plan is parsed again. Entries written by another
+version of the parser (orgtest.py, and model.py, where the durations,
+budgets and fields are defined) are ignored.
+
+Like git's index, an entry isn't trusted on mtime alone when the file
+changed just before it was cached, since a second edit within the same
+clock tick wouldn't change the mtime.
+
+The cache is only an optimization: if it can't be read or written,
+plans are parsed as usual.
+"""
+import contextlib
+import dataclasses
+import functools
+import gc
+import hashlib
+import io
+import marshal
+import os
+import pathlib
+import tempfile
+import time
+from importlib.metadata import PackageNotFoundError, version
+
+from . import model, orgtest
+from .model import Budget, Challenge, TestDescription
+
+# bump when the layout of an entry changes
+FORMAT = 2
+# a file modified this recently might change again without its mtime changing
+RACY_NS = 2 * 10 ** 9
+
+CHALLENGE_FIELDS = [f.name for f in dataclasses.fields(Challenge) if f.name != 'tests']
+TEST_FIELDS = [f.name for f in dataclasses.fields(TestDescription)]
+BUDGET_FIELDS = [f.name for f in dataclasses.fields(Budget)]
+
+
+def cache_dir() -> pathlib.Path:
+    if path := os.environ.get('TANCO_CACHE_DIR'):
+        return pathlib.Path(path)
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return pathlib.Path(base, 'tanco')
+
+
+@functools.cache
+def parser_version() -> str:
+    """
+    changes whenever the parser's source does, or the model's (which
+    parses `#+timeout:` and `#+budget:`, and defines the fields)
+    """
+    h = hashlib.sha256(repr([FORMAT, CHALLENGE_FIELDS, TEST_FIELDS, BUDGET_FIELDS]).encode())
+    try:
+        for module in [orgtest, model]:
+            with open(module.__file__, 'rb') as f:
+                h.update(f.read())
+    except OSError:  # (no source to read: fall back on the package version)
+        try:
+            h.update(version('tanco').encode())
+        except PackageNotFoundError:
+            pass
+    return h.hexdigest()
+
+
+def entry_path(path: str) -> pathlib.Path:
+    name = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:32]
+    return cache_dir() / 'plans' / f'{name}.marshal'
+
+
+def encode(c: Challenge) -> tuple:
+    tests = []
+    for t in c.tests:
+        row = [getattr(t, name) for name in TEST_FIELDS]
+        if t.budget is not None:
+            row[TEST_FIELDS.index('budget')] = tuple(getattr(t.budget, name) for name in BUDGET_FIELDS)
+        tests.append(tuple(row))
+    return tuple(getattr(c, name) for name in CHALLENGE_FIELDS), tests
+
+
+def decode(data: tuple) -> Challenge:
+    head, rows = data
+    c = Challenge(**dict(zip(CHALLENGE_FIELDS, head)))
+    budget = TEST_FIELDS.index('budget')
+    for row in rows:
+        t = TestDescription(*row)
+        if row[budget] is not None:
+            t.budget = Budget(*row[budget])
+        c.tests.append(t)
+    return c
+
+
+def read_header(f) -> tuple | None:
+    """(size, mtime_ns, digest) from the start of an open entry, if it's for this parser"""
+    try:
+        fmt, parser, *rest = marshal.load(f)  # (only reads the header)
+    except (EOFError, ValueError, TypeError):
+        return None
+    if fmt != FORMAT or parser != parser_version():
+        return None
+    return tuple(rest)
+
+
+def load(entry: pathlib.Path) -> tuple | None:
+    """(size, mtime_ns, digest, data) from a cache entry, if it's for this parser"""
+    try:
+        with open(entry, 'rb') as f:
+            if (header := read_header(f)) is None:
+                return None
+            return (*header, marshal.loads(f.read()))  # (much faster than marshal.load)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+
+def save(entry: pathlib.Path, st: os.stat_result, digest: str, data: tuple):
+    # a recently modified file gets mtime 0, so the next read checks its hash
+    mtime = st.st_mtime_ns if time.time_ns() - st.st_mtime_ns > RACY_NS else 0
+    try:
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=entry.parent, prefix=entry.stem, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            # (a separate header, so `fresh` can check it without loading the plan)
+            marshal.dump((FORMAT, parser_version(), st.st_size, mtime, digest), f)
+            marshal.dump(data, f)
+        os.replace(tmp, entry)  # (so readers never see half an entry)
+    except (OSError, ValueError):
+        pass
+
+
+@contextlib.contextmanager
+def gc_paused():
+    """
+    a plan is a lot of small objects and no cycles, so the collector
+    would only slow down building it (by as much as 5x for a big one)
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def fresh(path: str) -> bool:
+    """is there a cache entry for the plan that `cached` would use?"""
+    try:
+        st = os.stat(path)
+        with open(entry_path(path), 'rb') as f:
+            header = read_header(f)
+    except OSError:
+        return False
+    return header is not None and header[0] == st.st_size and header[1] == st.st_mtime_ns
+
+
+def cached(path: str) -> Challenge | None:
+    """the plan from the cache, if the file hasn't been touched since (without reading it)"""
+    with gc_paused():
+        st = os.stat(path)
+        entry = load(entry_path(path))
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            return decode(entry[3])
+    return None
+
+
+def read_challenge(path: str) -> Challenge:
+    """orgtest.read_challenge, through the cache"""
+    with gc_paused():
+        return _read_challenge(path)
+
+
+def _read_challenge(path: str) -> Challenge:
+    st = os.stat(path)
+    entry = entry_path(path)
+    cached = load(entry)
+    if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+        return decode(cached[3])
+    with open(path, 'rb') as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    if cached and cached[0] == len(raw) and cached[2] == digest:
+        save(entry, st, digest, cached[3])  # (touched, but not changed)
+        return decode(cached[3])
+    # decode it the way open() would
+    c = orgtest.TestReaderStateMachine().parse_text(io.TextIOWrapper(io.BytesIO(raw)).read())
+    save(entry, st, digest, encode(c))
+    return c
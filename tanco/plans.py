@@ -0,0 +1,133 @@
+"""
+Test plans made of more than one org file.
+
+`--tests` can point at a directory, meaning every `*.org` file in it
+(and below it) in order of their paths, and a file can pull in others
+with `#+include: other.org` (relative to the including file). The
+tests of each file come first, then those of its includes, in the
+order of the `#+include:` lines. (A directory's files that another
+file includes only appear there.)
+
+Every file is parsed on its own, through the plan cache, and the
+files that aren't cached are parsed in a process pool when there's
+enough of them to make it worthwhile. The results are merged into one
+Challenge: the header (name, title, server) comes from the first file
+that has one, groups are numbered across files, and a test name can
+only be used once in the whole plan. Settings like `#+timeout:` don't
+cross from one file to another.
+"""
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from . import plancache
+from .model import Challenge
+
+# parse in a process pool once the uncached files add up to this many bytes
+PARALLEL_BYTES = 2 ** 22
+
+
+def plan_roots(path: str) -> list[str]:
+    """the files a plan starts from"""
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, '**', '*.org'), recursive=True))
+    return [path]
+
+
+def resolve(path: str, includes: list[str]) -> list[str]:
+    """the paths of a file's includes"""
+    return [os.path.normpath(os.path.join(os.path.dirname(path), inc)) for inc in includes]
+
+
+def parse_file(path: str) -> Challenge:
+    try:
+        return plancache.read_challenge(path)
+    except (ValueError, AssertionError) as e:  # (so the message says which file)
+        raise ValueError(f'{path}: {e}') from e
+
+
+def parse_encoded(path: str) -> tuple:
+    """parse_file, for a worker process (plain tuples are quicker to send back)"""
+    return plancache.encode(parse_file(path))
+
+
+def parse_files(paths: list[str]) -> dict[str, Challenge]:
+    """the parsed files, from the plan cache or the process pool where possible"""
+    res = {}
+    todo = []
+    for path in paths:
+        if os.path.isfile(path) and (c := plancache.cached(path)) is not None:
+            res[path] = c
+        else:
+            todo.append(path)
+    jobs = min(len(todo), os.cpu_count() or 1)
+    if jobs > 1 and sum(os.path.getsize(p) for p in todo if os.path.isfile(p)) >= PARALLEL_BYTES:
+        with ProcessPoolExecutor(jobs) as pool, plancache.gc_paused():
+            for path, data in zip(todo, pool.map(parse_encoded, todo)):
+                res[path] = plancache.decode(data)
+    else:
+        res.update((path, parse_file(path)) for path in todo)
+    return res
+
+
+def read_files(roots: list[str], done: frozenset[str] = frozenset()) -> list[tuple[str, Challenge]]:
+    """
+    the roots and everything they include (except the files in `done`,
+    which have been read already), in plan order
+    """
+    parsed: dict[str, Challenge] = {}
+    todo = list(roots)
+    while todo:  # (a wave of files at a time, since includes are only known after parsing)
+        parsed.update(parse_files(todo))
+        todo = sorted({inc for path, c in parsed.items() for inc in resolve(path, c.includes)}
+                      - parsed.keys() - done)
+    included = {inc for path, c in parsed.items() for inc in resolve(path, c.includes)}
+    res: list[tuple[str, Challenge]] = []
+    seen = set(done)
+
+    def visit(path: str, trail: tuple[str, ...]):
+        if path in trail or path in done:
+            raise ValueError(f'{path} is part of an include cycle')
+        if path in seen:
+            raise ValueError(f'{path} is included more than once')
+        seen.add(path)
+        res.append((path, parsed[path]))
+        for inc in resolve(path, parsed[path].includes):
+            visit(inc, (*trail, path))
+
+    for root in roots:
+        if root not in included:
+            visit(root, ())
+    if stuck := sorted(parsed.keys() - seen):
+        raise ValueError(f'{stuck[0]} is part of an include cycle')
+    return res
+
+
+def merge(files: list[tuple[str, Challenge]], where: dict[str, str] | None = None, grp: int = 0) -> Challenge:
+    """
+    one Challenge with the tests of all the files (which it lists in
+    `includes`). `where` maps the test names used already to their
+    files, and `grp` is the first group number to use.
+    """
+    if len(files) == 1 and not where and not grp:
+        return files[0][1]
+    where = dict(where or {})
+    res = Challenge()
+    for path, c in files:
+        for key in ['name', 'title', 'server']:
+            if not getattr(res, key):
+                setattr(res, key, getattr(c, key))
+        for test in c.tests:
+            if test.name in where:
+                raise ValueError(f'duplicate name {test.name!r} in {path} (also in {where[test.name]})')
+            where[test.name] = path
+            test.grp += grp
+            res.tests.append(test)
+        grp = max((t.grp for t in c.tests), default=grp - 1) + 1
+    res.includes = [path for path, _ in files]
+    return res
+
+
+def read_plan(path: str) -> Challenge:
+    """the Challenge for an org file or a directory of them, includes and all"""
+    return merge(read_files(plan_roots(path)))
@@ -0,0 +1,104 @@
+"""
+Start each target in a process group of its own, and kill it as a tree.
+
+On POSIX a target starts a new session (so a new process group, with
+no controlling terminal). Ctrl-C then reaches tanco but not the target,
+and killing the group also takes out whatever the target started: the
+real program behind `/bin/sh -c`, helpers it forked, and so on. When
+the target exits by itself, the rest of its group is killed before it
+is reaped (so the group id can't have been reused yet). Anything that
+starts a session of its own escapes; a cgroup limit catches those.
+On Windows the target gets a new process group and `taskkill /T`.
+
+The targets that haven't been killed or reaped are kept in LIVE, and
+killed when tanco exits (on SIGTERM too, see `exit_on_sigterm`).
+"""
+import atexit
+import contextlib
+import os
+import select
+import signal
+import subprocess
+import sys
+import threading
+
+# pids (and so process group ids) of the targets still running
+LIVE: set[int] = set()
+_lock = threading.Lock()
+
+
+def popen_kw() -> dict:
+    """the Popen (or asyncio.create_subprocess_*) arguments for a new process group"""
+    if os.name == 'nt':
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'start_new_session': True}
+
+
+def started(pid: int):
+    with _lock:
+        LIVE.add(pid)
+
+
+def kill_tree(pid: int):
+    """kill the target and everything in its process group (call before it's reaped)"""
+    with _lock:
+        LIVE.discard(pid)
+    if os.name == 'nt':
+        subprocess.run(['taskkill', '/F', '/T', '/PID', str(pid)], capture_output=True)
+        return
+    with contextlib.suppress(ProcessLookupError, PermissionError):
+        os.killpg(pid, signal.SIGKILL)
+
+
+def finish(program: subprocess.Popen) -> bool:
+    """
+    wait for the target to exit, without reaping it, then kill whatever it left
+    behind. returns False if the os can't wait like that (leftovers are then only
+    killed on timeout), or if it's already been reaped.
+    """
+    if program.returncode is not None:
+        return False  # (once it's reaped, its group id could belong to someone else)
+    try:
+        if hasattr(os, 'waitid'):
+            os.waitid(os.P_PID, program.pid, os.WEXITED | os.WNOWAIT)
+        elif hasattr(select, 'kqueue'):  # macOS and the BSDs
+            wait_exit(program.pid)
+        else:
+            return False
+    except ChildProcessError:
+        return False
+    kill_tree(program.pid)
+    return True
+
+
+def wait_exit(pid: int):
+    """wait for a child to exit, without reaping it, through a kqueue"""
+    kq = select.kqueue()
+    try:
+        event = select.kevent(pid, filter=select.KQ_FILTER_PROC, flags=select.KQ_EV_ADD | select.KQ_EV_ONESHOT,
+                              fflags=select.KQ_NOTE_EXIT)
+        with contextlib.suppress(ProcessLookupError):  # (it has exited already)
+            kq.control([event], 1, None)
+    finally:
+        kq.close()
+
+
+def forget(pid: int):
+    """stop tracking a target that has been reaped"""
+    with _lock:
+        LIVE.discard(pid)
+
+
+@atexit.register
+def kill_all():
+    """kill every target that is still running"""
+    with _lock:
+        pids = list(LIVE)
+    for pid in pids:
+        kill_tree(pid)
+
+
+def exit_on_sigterm():
+    """treat SIGTERM like an exit, so the targets get cleaned up (call from the main thread)"""
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, lambda signum, _frame: sys.exit(128 + signum))
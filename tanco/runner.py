@@ -2,20 +2,29 @@
 """
 Test-running logic for validating tanco tests.
 """
+import contextlib
+import dataclasses
 import errno
+import itertools
 import json
 import os
+import queue
+import shlex
 import shutil
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 import traceback
-
-import pexpect
-from pexpect.popen_spawn import PopenSpawn
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable
 
 from . import database as db
+from . import limits, orgtest, plancache, plans, procs, schedule, selection, stream, usage
 from . import model as m
-from . import orgtest
+from .cache import ResultCache
 from .client import TancoClient
 from .model import Challenge, Config, ResultKind, TestDescription, TestFailure
 
@@ -79,6 +88,12 @@ def load_config() -> Config:
             kw['restart_cmd'] = target['restart-cmd']
         if 'restart-expect' in target:
             kw['restart_expect'] = target['restart-expect']
+        if 'framing' in target:
+            kw['framing'] = target['framing']
+        if 'cache-files' in target:
+            kw['cache_files'] = target['cache-files']
+        if 'limits' in target:
+            kw['limits'] = target['limits']
 
     # Load from environment variables (can override .tanco or provide defaults)
     if 'INPUT_PATH' in os.environ and 'input_path' not in kw:
@@ -102,9 +117,8 @@ class StopTesting(Exception):
     pass
 
 
-def spawn(cfg: m.Config | None = None):
-    if not cfg:
-        cfg = load_config()
+def target_command(cfg: Config) -> tuple[str | list[str], bool, str]:
+    """resolve the configured program into (command, use_shell, name for error messages)"""
     program_args, use_shell = cfg.program_args, cfg.use_shell
     cmd_for_popen = None
     prog_name_for_error = "<unknown>" # Default for error messages
@@ -173,54 +187,383 @@ def spawn(cfg: m.Config | None = None):
 
         cmd_for_popen = cmd_list # List for shell=False or POSIX shell=True without -c
 
+    return cmd_for_popen, use_shell, prog_name_for_error
+
+
+def target_env(cfg: Config) -> dict[str, str] | None:
+    """tell the program where to find its input (each worker has its own file)"""
+    return dict(os.environ, INPUT_PATH=cfg.input_path) if cfg.input_path else None
+
+
+# python opens every file and pipe non-inheritable (PEP 446), so on POSIX there's
+# nothing for Popen to close in the child, and skipping that keeps the launch on
+# the cheap vfork path. (windows decides which handles to pass on differently)
+CLOSE_FDS = os.name == 'nt'
+
+
+@dataclasses.dataclass
+class PreparedTarget:
+    """what it takes to launch the target, worked out once and reused for every test"""
+    args: str | list[str]
+    shell: bool
+    env: dict[str, str] | None
+    name: str  # the program, for error messages
+    preexec: Callable | None  # applies the rlimits (cgroups need one per process instead)
+
+
+def prepare(cfg: Config) -> PreparedTarget:
+    """resolve the program (searching PATH and so on) and its environment"""
+    args, shell, name = target_command(cfg)
+    return PreparedTarget(args, shell, target_env(cfg), name,
+                          None if cfg.limits.cgroup else limits.preexec(cfg.limits))
+
+
+def spawn(cfg: m.Config | None = None, stderr=subprocess.PIPE, target: PreparedTarget | None = None):
+    """start the target. stderr is captured unless told otherwise (stderr=None inherits ours)"""
+    if not cfg:
+        cfg = load_config()
+    target = target or prepare(cfg)
+    cgroup = limits.Cgroup.create(cfg.limits)
+    launched = time.perf_counter()
     try:
-        return subprocess.Popen(cmd_for_popen,
-                              shell=use_shell,
+        program = subprocess.Popen(target.args,
+                              shell=target.shell,
                               universal_newlines=True,
+                              env=target.env,
                               stdin=subprocess.PIPE,
-                              stdout=subprocess.PIPE)
+                              stdout=subprocess.PIPE,
+                              stderr=stderr,
+                              close_fds=CLOSE_FDS,
+                              preexec_fn=limits.preexec(cfg.limits, cgroup=cgroup) if cgroup else target.preexec,
+                              **procs.popen_kw())
     except OSError as e:
-        if e.errno == errno.ENOENT:
-            fail(cfg, [str(e),
-                      f"Couldn't find program or command: {prog_name_for_error}",
-                      'Make sure it is installed and in your PATH or the path is correct.'])
-        elif e.errno in [errno.EPERM, errno.EACCES]:
-            fail(cfg, [str(e),
-                      f"Couldn't run {prog_name_for_error!r} due to a permission error.",
-                      'Make sure the file/script has execute permissions.'])
-        elif getattr(e, 'winerror', 0) == 193: # Specific check for WinError 193
-             fail(cfg, [str(e),
-                        f"Command {prog_name_for_error!r} is not a valid executable.",
-                        "Make sure you are running scripts via their interpreter (e.g., 'python script.py')",
-                        "or using the shell ('-c' flag) if necessary."])
-        elif e.errno == errno.EPIPE:
-            fail(cfg, [str(e),
-                      f'{prog_name_for_error!r} quit before reading any input.',
-                      'Make sure it is reading commands from standard input.'])
-        else:
-            handle_unexpected_error(cfg)
+        if cgroup:
+            cgroup.remove()
+        spawn_failed(cfg, e, target.name)
+        return None
+    procs.started(program.pid)
+    program.cgroup = cgroup  # (removed by release)
+    program.clock = launched  # (see timed_result)
+    return program
+
+
+def release(program: subprocess.Popen):
+    """delete the cgroup the program ran in, if it had one"""
+    if cgroup := getattr(program, 'cgroup', None):
+        cgroup.remove()
+        program.cgroup = None
+
+
+def spawn_failed(cfg: Config, e: OSError, prog_name_for_error: str):
+    """explain why the program couldn't be started"""
+    if e.errno == errno.ENOENT:
+        fail(cfg, [str(e),
+                  f"Couldn't find program or command: {prog_name_for_error}",
+                  'Make sure it is installed and in your PATH or the path is correct.'])
+    elif e.errno in [errno.EPERM, errno.EACCES]:
+        fail(cfg, [str(e),
+                  f"Couldn't run {prog_name_for_error!r} due to a permission error.",
+                  'Make sure the file/script has execute permissions.'])
+    elif getattr(e, 'winerror', 0) == 193: # Specific check for WinError 193
+         fail(cfg, [str(e),
+                    f"Command {prog_name_for_error!r} is not a valid executable.",
+                    "Make sure you are running scripts via their interpreter (e.g., 'python script.py')",
+                    "or using the shell ('-c' flag) if necessary."])
+    elif e.errno == errno.EPIPE:
+        fail(cfg, [str(e),
+                  f'{prog_name_for_error!r} quit before reading any input.',
+                  'Make sure it is reading commands from standard input.'])
+    else:
+        handle_unexpected_error(cfg)
 
 
-def send_cmds(cfg: Config, program, ilines):
+class Launches:
+    """how many more target processes a run needs (shared by the Spawners of its workers)"""
+
+    def __init__(self, count: int):
+        self.count = count
+        # notified when a launch made ahead is ready (see Spawner.fill)
+        self.changed = threading.Condition()
+
+    def claim(self) -> bool:
+        """count one more launch, if it's still needed"""
+        with self.changed:
+            if self.count <= 0:
+                return False
+            self.count -= 1
+            return True
+
+
+class Spawner:
+    """
+    Keeps the next few target processes launched and waiting on stdin,
+    so their startup time overlaps with the test that is running now.
+    With a `limit` (a count, or Launches shared with other Spawners),
+    it stops launching ahead once the run has all the processes it needs.
+    """
+
+    def __init__(self, cfg: Config, limit: int | Launches | None = None):
+        self.cfg = cfg
+        # a warm process could read the input file before it's rewritten
+        self.depth = 0 if cfg.input_path else cfg.prespawn
+        self.launches = Launches(limit) if isinstance(limit, int) else limit
+        self.ready: deque[subprocess.Popen] = deque()
+        self.starting = 0  # launches claimed by fill() that aren't in `ready` yet
+        self.peers: list[Spawner] = []  # the other workers' Spawners, to take ready processes from
+        self.target = prepare(cfg)
+
+    def take(self, fresh: bool = False) -> subprocess.Popen:
+        """the next process: a ready one, unless there's none or a `fresh` one is wanted"""
+        program = None if fresh else self.next_ready()
+        if program is None and not fresh and self.launches is not None:
+            program = self.await_ready()
+        if program is None:
+            program = spawn(self.cfg, target=self.target)
+        else:
+            program.clock = time.perf_counter()  # (it started up during an earlier test)
+        self.fill()
+        return program
+
+    def next_ready(self) -> subprocess.Popen | None:
+        """one of our ready processes, or else one of a peer's (so none goes unused)"""
+        for spawner in [self, *self.peers]:
+            with contextlib.suppress(IndexError):  # (a peer might take it first)
+                return spawner.ready.popleft()
+        return None
+
+    def await_ready(self) -> subprocess.Popen | None:
+        """
+        claim a launch for the caller to make, and return None. but if the run
+        has all the launches it needs, wait for one that's still starting up.
+        """
+        with self.launches.changed:
+            while True:
+                program = self.next_ready()
+                if program is not None:
+                    return program
+                if self.launches.count > 0:
+                    self.launches.count -= 1
+                    return None
+                if not any(spawner.starting for spawner in [self, *self.peers]):
+                    return None  # (a launch we didn't count for, but the test still needs one)
+                self.launches.changed.wait()
+
+    def fill(self):
+        while len(self.ready) < self.depth and (self.launches is None or self.claim_ahead()):
+            try:
+                self.ready.append(spawn(self.cfg, target=self.target))
+            finally:
+                if self.launches is not None:
+                    with self.launches.changed:
+                        self.starting -= 1
+                        self.launches.changed.notify_all()
+
+    def claim_ahead(self) -> bool:
+        """claim a launch for fill(), and count it as starting until it's ready"""
+        with self.launches.changed:
+            if not self.launches.claim():
+                return False
+            self.starting += 1
+            return True
+
+    def close(self):
+        """shut down any processes that were never used"""
+        while self.ready:
+            program = self.ready.popleft()
+            procs.kill_tree(program.pid)
+            program.communicate()
+            release(program)
+
+
+def send_cmds(cfg: Config, program, ilines) -> threading.Thread | None:
+    """
+    write the input file, or start feeding the input to the program's stdin.
+    returns the feeder thread, if one is still writing (see `stream.feed`).
+    """
     if cfg.input_path:
-        cmds = open(cfg.input_path, 'w')
-        for cmd in ilines:
-            cmds.write(cmd + '\n')
-        cmds.close()
-    else:
-        for cmd in ilines:
-            program.stdin.write(cmd + '\n')
-            program.stdin.flush()
+        write_input(cfg.input_path, ilines)
+        return None
+    return stream.feed(program.stdin, ilines)
 
 
-def run_test(cfg: Config, program: subprocess.Popen, test: TestDescription):
+def write_input(path: str, ilines: list[str]):
+    """replace the input file in one step, so the target never sees half of it"""
+    folder, name = os.path.split(os.path.abspath(path))
+    root, ext = os.path.splitext(name)
+    # (named so `tanco watch` ignores it, like the input file itself)
+    fd, tmp = tempfile.mkstemp(prefix=root + '.', suffix='.tmp' + ext, dir=folder)
+    try:
+        with open(fd, 'w') as f:
+            f.write(''.join(cmd + '\n' for cmd in ilines))
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
+        raise
+
+
+def collect_output(cfg: Config, program: subprocess.Popen, test: TestDescription,
+                   timeout: float = m.DEFAULT_TIMEOUT,
+                   errs: stream.Capture | None = None) -> tuple[list[str], m.Usage | None]:
+    """
+    send the test input to the program and return its cleaned-up output,
+    and the cpu time and memory it used (if the os can tell us).
+    the output is compared as it arrives, and the program is killed as
+    soon as the result is certain (see `stream`). stderr goes to `errs`.
+    """
+    # drain stderr from the start, so the program never blocks on it:
+    pump = None
+    if program.stderr:
+        pump = stream.pump(program.stderr.buffer, errs if errs is not None else stream.Capture())
     # send all the input lines (to stdin or a file):
-    send_cmds(cfg, program, test.ilines)
+    feeder = send_cmds(cfg, program, test.ilines)
+    if feeder is None:
+        with contextlib.suppress(OSError):
+            program.stdin.close()
     # listen for the response:
-    (actual, _errs) = program.communicate(timeout=5)
-    # TODO: handle errors in the `errs` string
-    actual = clean_output(cfg, actual)
-    local_check_output(cfg, actual, test)
+    expired = threading.Event()
+    # held to kill the program or to reap it. once it's reaped, its group id could be reused
+    reaping = threading.Lock()
+
+    def expire():
+        with reaping:
+            if program.returncode is None:
+                expired.set()
+                procs.kill_tree(program.pid)
+    timer = threading.Timer(timeout, expire)
+    timer.start()
+    matcher = stream.LineMatcher(cfg, test.olines)
+    try:
+        if not stream.read_lines(program.stdout, matcher):
+            procs.kill_tree(program.pid)
+        exited = procs.finish(program)  # (the timer kills it if it takes too long)
+        used = usage.wait(program, reaping, exited)
+        procs.forget(program.pid)
+    finally:
+        timer.cancel()
+        program.stdout.close()
+        if feeder:
+            feeder.join(STDERR_GRACE)  # (the program is gone, so it can't block for long)
+        if pump:
+            pump.join(STDERR_GRACE)
+            program.stderr.close()
+    if expired.is_set():
+        program.wait()
+        raise subprocess.TimeoutExpired(program.args, timeout)
+    return matcher.lines(), used
+
+
+# seconds to wait for the rest of stderr once the program is done
+STDERR_GRACE = 1.0
+
+
+def run_test(cfg: Config, program: subprocess.Popen, test: TestDescription,
+             timeout: float = m.DEFAULT_TIMEOUT):
+    res = timed_result(cfg, program, test, timeout)
+    if res.kind == ResultKind.Fail:
+        assert res.error is not None
+        fail(cfg, res.error.report_lines(), test, res)
+
+
+def cold_start(test: TestDescription) -> bool:
+    """should the test get a process launched just for it? (so a time budget includes startup)"""
+    return test.budget is not None and test.budget.time is not None
+
+
+def timed_result(cfg: Config, program: subprocess.Popen, test: TestDescription, timeout: float) -> m.TestResult:
+    """
+    run the test and check the output, noting how long the program took,
+    what it used, and what it wrote to stderr (if it failed). the time is
+    counted from when the program was launched, or for one that was
+    launched ahead (see Spawner), from when it was handed the test.
+    """
+    errs = stream.Capture()
+    try:
+        start = getattr(program, 'clock', None) or time.perf_counter()
+        actual, used = collect_output(cfg, program, test, timeout, errs)
+        secs = time.perf_counter() - start
+        res = check_result(cfg, actual, test)
+        if res.error is not None:
+            res.error.stderr = errs.excerpt()
+        res.secs = secs
+        res.usage = used or m.Usage()
+        res.usage.wall = secs
+        res = limits.check(cfg.limits, res, program.returncode, used, getattr(program, 'cgroup', None),
+                           errs.excerpt())
+    finally:
+        errs.close()
+        release(program)
+    return check_budget(test, res, actual)
+
+
+def plan_key(cfg: Config) -> str:
+    """what the run history is filed under: the org file, or else the attempt"""
+    path = cfg.test_path or cfg.test_plan
+    return os.path.abspath(path) if path else cfg.attempt
+
+
+# adaptive timeouts need this many passing runs of a test
+ADAPTIVE_MIN_RUNS = 5
+# ... and never go below this many seconds
+ADAPTIVE_FLOOR = 0.5
+
+
+def p99(samples: list[float]) -> float:
+    ordered = sorted(samples)
+    return ordered[max(0, -(-99 * len(ordered) // 100) - 1)]
+
+
+class RunLog:
+    """
+    Run times of the tests in a plan: recorded after each run,
+    and used to derive adaptive timeouts. Passing tests also go
+    into the result cache.
+    """
+
+    def __init__(self, cfg: Config):
+        self.cfg = cfg
+        self.plan = plan_key(cfg)
+        self.history = db.run_history(self.plan) if cfg.adaptive_timeout and self.plan else {}
+        self.runs: list[tuple[str, bool, float]] = []
+        self.usage: list[tuple | None] = []  # (grp, user, sys, max_rss) for each run, if known
+        self.cache = ResultCache(cfg)
+        self.num_cached = 0
+
+    def uncached(self, tests: list[TestDescription]) -> list[TestDescription]:
+        """drop the tests that passed before with the same target and test"""
+        res = self.cache.uncached(tests)
+        self.num_cached = len(tests) - len(res)
+        if self.num_cached:
+            print(f'Skipping {self.num_cached} unchanged tests that passed before (--no-cache to rerun).')
+        return res
+
+    def timeout(self, test: TestDescription) -> float:
+        """
+        seconds to wait for the test. from first to last choice:
+        exact name in .tanco `timeouts`, adaptive timeout (if enabled and the test
+        has enough history), longest matching 'prefix.*' in `timeouts`, the test plan
+        (test, then group, then challenge), .tanco `timeout`, and DEFAULT_TIMEOUT.
+        """
+        cfg = self.cfg
+        if test.name in cfg.timeouts:
+            return cfg.timeouts[test.name]
+        if cfg.adaptive_timeout and len(runs := self.history.get(test.name, [])) >= ADAPTIVE_MIN_RUNS:
+            return max(ADAPTIVE_FLOOR, cfg.adaptive_timeout * p99(runs))
+        prefixes = [k for k in cfg.timeouts if k.endswith('*') and test.name.startswith(k[:-1])]
+        if prefixes:
+            return cfg.timeouts[max(prefixes, key=len)]
+        return test.timeout or cfg.timeout or m.DEFAULT_TIMEOUT
+
+    def add(self, test: TestDescription, passed: bool, secs: float, used: m.Usage | None = None):
+        self.runs.append((test.name, passed, secs))
+        self.usage.append(used and (test.grp, used.user, used.sys, used.max_rss))
+        self.cache.add(test, passed)
+
+    def save(self):
+        if self.runs and self.plan:
+            db.save_runs(self.plan, self.runs, self.usage)
+        self.runs, self.usage = [], []
+        self.cache.save()
 
 
 def clean_output(cfg: Config, actual: str) -> list[str]:
@@ -232,132 +575,330 @@ def clean_output(cfg: Config, actual: str) -> list[str]:
     return lines
 
 
-def run_tests_persistent(cfg: Config, tests: list[TestDescription], names=None):
-    """Run tests using a persistent process, sending restart_cmd between tests."""
-    # Build command string for PopenSpawn
-    program_args = cfg.program_args
-    if program_args and program_args[0] == '-c':
-        # Shell mode: join the command
-        cmd = ' '.join(program_args[1:])
-        if os.name == 'nt':
-            cmd = cmd.replace('/', '\\')
-    else:
-        # Normal mode: join args with spaces
-        cmd = ' '.join(program_args)
+class WorkerCrash(Exception):
+    """raised when a persistent target dies or stops responding"""
 
-    # Spawn persistent process
-    try:
-        child = PopenSpawn(cmd, encoding='utf-8', timeout=5)
-    except Exception as e:
-        fail(cfg, [f'Failed to spawn process: {e}',
-                   f'Command: {cmd}'])
+    def __init__(self, lines: list[str]):
+        super().__init__('\n'.join(lines))
+        self.lines = lines
 
-    num_passed = 0
-    try:
-        for i, test in enumerate(tests):
-            if names and test.name not in names:
-                continue
-
-            # Send input lines
-            for line in test.ilines:
-                child.sendline(line)
-
-            # Send restart command to mark end of input and trigger output delimiter
-            child.sendline(cfg.restart_cmd)
 
-            # Wait for delimiter (must be on its own line, consume the newline)
-            try:
-                child.expect(cfg.restart_expect + r'\r?\n', timeout=5)
-            except pexpect.TIMEOUT:
-                fail(cfg, [f'Timeout waiting for {cfg.restart_expect!r} after test input.',
-                           'Make sure your restart command produces the expected output on its own line.'], test)
-            except pexpect.EOF:
-                output = child.before if child.before else ''
-                fail(cfg, ['Process exited unexpectedly during test.',
-                           f'Output before exit: {output}'], test)
-
-            # Extract output (everything between input and delimiter)
-            raw_output = child.before if child.before else ''
-            actual = clean_output(cfg, raw_output)
-
-            # Validate
-            local_check_output(cfg, actual, test)
+class PersistentWorker:
+    """A long-lived target process, reset with `restart_cmd` between tests."""
 
-            print('.', end='', flush=True)
-            num_passed += 1
+    def __init__(self, cfg: Config):
+        self.cfg = cfg
+        self.child: subprocess.Popen | None = None
+        self.used: m.Usage | None = None
+        self.output: queue.SimpleQueue[bytes] | None = None  # chunks of stdout (and stderr)
+        self.replies: stream.Replies | None = None
 
-        # All tests passed
-        print()
-        print('All %d tests passed.' % num_passed)
-        print()
-        if cfg.test_path:
-            print('All tests in %s passed.' % cfg.test_path)
+    def command(self) -> str:
+        """Build the command string (split like a shell would, except on windows)"""
+        program_args = self.cfg.program_args
+        if program_args and program_args[0] == '-c':
+            # Shell mode: join the command
+            cmd = ' '.join(program_args[1:])
+            if os.name == 'nt':
+                cmd = cmd.replace('/', '\\')
         else:
-            print('This may be a good time to commit your changes,')
-            print('or spend some time improving your code.')
-            if cfg.attempt:
-                print()
-                print("When you're ready, run `tanco next` to start work on the next feature.")
-                print()
-                TancoClient().send_pass(cfg)
-
-    except (TestFailure, StopTesting):
-        print()
-        print('%d of %d tests passed.' % (num_passed, len(tests)))
+            # Normal mode: join args with spaces
+            cmd = ' '.join(program_args)
+        return cmd
+
+    def start(self) -> subprocess.Popen:
+        cmd = self.command()
+        try:
+            self.child = subprocess.Popen(shlex.split(cmd) if os.name == 'posix' else cmd,
+                                          stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                          stderr=subprocess.STDOUT,
+                                          preexec_fn=limits.preexec(self.cfg.limits, persistent=True),
+                                          **procs.popen_kw())
+        except Exception as e:
+            fail(self.cfg, [f'Failed to spawn process: {e}',
+                            f'Command: {cmd}'])
+        procs.started(self.child.pid)
+        self.output = stream.chunks(self.child.stdout)
+        self.replies = stream.replies(self.cfg)
+        return self.child
+
+    def run(self, test: TestDescription, timeout: float = m.DEFAULT_TIMEOUT) -> list[str]:
+        """send the test input and return the output that comes before the delimiter.
+        what the process used during the test is left in self.used"""
+        cfg = self.cfg
+        child = self.child or self.start()
+        self.used = None
+        before = usage.snapshot(child.pid)
+        # the input lines, then the restart command to mark the end of the input
+        data = ''.join(line + '\n' for line in [*test.ilines, cfg.restart_cmd]).encode()
+        try:
+            stream.write_all(child.stdin.fileno(), [data])
+        except OSError as e:
+            raise WorkerCrash(['Process stopped reading input during test.', str(e)])
+        reply = self.read_reply(timeout)
+        self.used = usage.since(before, usage.snapshot(child.pid))
+        return clean_output(cfg, reply.decode(errors='replace'))
+
+    def read_reply(self, timeout: float) -> bytes:
+        """wait for the output of the test (up to the delimiter, or the whole frame)"""
+        deadline = time.perf_counter() + timeout
+        try:
+            while (reply := self.replies.next()) is None:
+                chunk = self.output.get(timeout=max(0.0, deadline - time.perf_counter()))
+                if not chunk:
+                    raise WorkerCrash(['Process exited unexpectedly during test.',
+                                       f'Output before exit: {self.replies.pending()}'])
+                self.replies.feed(chunk)
+        except queue.Empty:
+            if self.cfg.framing:
+                raise WorkerCrash(['Timeout waiting for a reply frame after test input.',
+                                   'Make sure your program sends its length line, then the output.'])
+            raise WorkerCrash([f'Timeout waiting for {self.cfg.restart_expect!r} after test input.',
+                               'Make sure your restart command produces the expected output on its own line.'])
+        except stream.FrameError as e:
+            raise WorkerCrash(['Process sent a badly framed reply.', str(e)])
+        return reply
+
+    def stop(self):
+        if self.child:
+            procs.kill_tree(self.child.pid)
+            with contextlib.suppress(OSError):
+                self.child.stdin.close()
+            self.child.wait()
+            procs.forget(self.child.pid)
+            self.child = None
+
+
+# how many times a test may be handed to a fresh worker after
+# the one running it crashed or timed out
+MAX_RETRIES = 1
+
+
+def run_tests_persistent(cfg: Config, challenge: Challenge, names=None):
+    """
+    Run tests on a pool of persistent processes, sending restart_cmd between tests.
+    A worker that crashes or times out is replaced, and its test goes back on the queue.
+    """
+    tests = challenge.tests
+    log = RunLog(cfg)
+    selected = log.uncached(select_tests(cfg, log, challenge, names))
+    selected = schedule.order(cfg, log.plan, selected)
+    jobs = num_jobs(cfg, selected)
+    # a single worker behaves like the old sequential runner
+    fail_fast = cfg.fail_fast or jobs == 1
+    todo: queue.SimpleQueue[tuple[int, int]] = queue.SimpleQueue()  # (index, retries)
+    for i in range(len(selected)):
+        todo.put((i, 0))
+    done: queue.SimpleQueue[tuple[int | None, object]] = queue.SimpleQueue()
+    stop = threading.Event()
+
+    def work():
+        worker = PersistentWorker(cfg)
+        try:
+            while not stop.is_set():
+                try:
+                    i, retries = todo.get_nowait()
+                except queue.Empty:
+                    return
+                test = selected[i]
+                start = time.perf_counter()
+                try:
+                    actual = worker.run(test, log.timeout(test))
+                    res = check_result(cfg, actual, test)
+                except WorkerCrash as e:
+                    worker.stop()
+                    if retries < MAX_RETRIES:
+                        todo.put((i, retries + 1))
+                        continue
+                    res = m.TestResult(ResultKind.Fail, error=m.MessageFailure(e.lines))
+                except BaseException as e:
+                    stop.set()
+                    done.put((i, e))
+                    return
+                res.secs = time.perf_counter() - start
+                res.usage = worker.used or m.Usage()
+                res.usage.wall = res.secs
+                res = check_budget(test, res, actual)
+                if fail_fast and res.kind == ResultKind.Fail:
+                    stop.set()
+                done.put((i, res))
+        finally:
+            worker.stop()
+            done.put((None, None))
+
+    threads = [threading.Thread(target=work, daemon=True) for _ in range(jobs)]
+    for thread in threads:
+        thread.start()
+
+    num_passed = log.num_cached
+    failures: list[tuple[TestDescription, m.TestResult | None]] = []
+    pending: list[tuple[TestDescription, m.TestResult]] = []  # for the server to check
+    results: dict[int, object] = {}
+    next_i, live = 0, jobs
+    try:
+        # report the results in order as they come in
+        while next_i < len(selected) and live:
+            i, outcome = done.get()
+            if i is None:
+                live -= 1
+                continue
+            results[i] = outcome
+            while next_i in results and not (failures and fail_fast):
+                outcome = results.pop(next_i)
+                if isinstance(outcome, BaseException):
+                    raise outcome
+                assert isinstance(outcome, m.TestResult)
+                if outcome.kind == ResultKind.AskServer:
+                    pending.append((selected[next_i], outcome))
+                    next_i += 1
+                    continue
+                log.add(selected[next_i], outcome.is_pass(), outcome.secs, outcome.usage)
+                if outcome.kind == ResultKind.Pass:
+                    print('.', end='', flush=True)
+                    num_passed += 1
+                else:
+                    failures.append((selected[next_i], outcome))
+                next_i += 1
+            if failures and fail_fast:
+                break
+        if not (failures and fail_fast):
+            num_passed += check_pending(cfg, log, pending, failures)
+    except KeyboardInterrupt:
+        procs.kill_all()
         raise
     finally:
-        # Clean up
-        try:
-            child.kill(9)
-        except Exception:
-            pass
-
-
-def save_new_rule(attempt: str, test: str, rule: m.ValidationRule):
-    db.save_progress(attempt, test, True)
-    db.save_rule(attempt, test, rule.to_data())
-
-
-def local_check_output(cfg: m.Config, actual: list[str], test: TestDescription):
-    local_res = test.check_output(actual)
-    match local_res.kind:
-        case ResultKind.Pass: pass
-        case ResultKind.Fail:
-            # a regression! (test failed and have the rule,
-            # so we have to tell the server)
-            assert local_res.error is not None
-            fail(cfg, local_res.error.error_lines(), test, local_res)
-        case ResultKind.AskServer:
-            if cfg.test_path:  # We're running from org file
-                # When running from org file, treat missing output rules as failure
-                fail(cfg, ["Test failed - output didn't match expected result"], test)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        log.save()
+
+    if failures:
+        report_failures(cfg, num_passed, len(tests), failures)
+    else:
+        report_pass(cfg, num_passed)
+
+
+def check_result(cfg: m.Config, actual: list[str], test: TestDescription) -> m.TestResult:
+    """
+    validate the output without reporting anything. tests that only the server can
+    check come back as AskServer results (holding the output) for `check_pending`.
+    """
+    local_res = test.check_output(actual, cfg.diff)
+    if local_res.kind != ResultKind.AskServer:
+        return local_res
+    if cfg.test_path:  # We're running from org file
+        # When running from org file, treat missing output rules as failure
+        err = m.MessageFailure(["Test failed - output didn't match expected result"])
+        return m.TestResult(ResultKind.Fail, error=err, actual=actual)
+    local_res.actual = actual
+    return local_res
+
+
+def check_budget(test: TestDescription, res: m.TestResult, actual: list[str]) -> m.TestResult:
+    """turn a pass into a failure if the run went over the test's budget"""
+    if not (test.budget and res.is_pass() and res.usage):
+        return res
+    if overruns := test.budget.overruns(res.usage):
+        return m.TestResult(ResultKind.Fail, error=m.BudgetFailure(overruns), actual=actual,
+                            secs=res.secs, usage=res.usage)
+    return res
+
+
+def check_with_server(cfg: Config, pending: list[tuple[TestDescription, m.TestResult]]) -> list[m.TestResult]:
+    """send a group of AskServer results to the server in one request,
+    and save the rules for the ones that passed in one transaction"""
+    results = TancoClient().check_outputs(cfg.attempt, [(t.name, r.actual) for t, r in pending])
+    if any(r.kind == ResultKind.AskServer for r in results):
+        raise RecursionError('Server validation loop')
+    db.save_rules(cfg.attempt, [(t.name, r.rule.to_data())
+                                for (t, _), r in zip(pending, results) if r.is_pass()])
+    for (_, asked), r in zip(pending, results):
+        r.secs, r.usage, r.remote = asked.secs, asked.usage, True
+        r.actual = r.actual or asked.actual
+    return results
+
+
+def check_pending(cfg: Config, log: 'RunLog', pending: list[tuple[TestDescription, m.TestResult]],
+                  failures: list[tuple[TestDescription, m.TestResult | None]]) -> int:
+    """check the tests the server has to judge, and report them. returns how many passed"""
+    num_passed = 0
+    if pending:
+        for (test, _), res in zip(pending, check_with_server(cfg, pending)):
+            log.add(test, res.is_pass(), res.secs, res.usage)
+            if res.is_pass():
+                print('.', end='', flush=True)
+                num_passed += 1
             else:
-                client = TancoClient()
-                remote_res = client.check_output(cfg.attempt, test.name, actual)
-                match remote_res.kind:
-                    case ResultKind.Pass:
-                        save_new_rule(cfg.attempt, test.name, remote_res.rule)
-                    case ResultKind.Fail:
-                        raise remote_res.error
-                    case ResultKind.AskServer:
-                        raise RecursionError('Server validation loop')
+                failures.append((test, res))
+    return num_passed
+
+
+def select_tests(cfg: Config, log: 'RunLog', challenge: Challenge, names=None) -> list[TestDescription]:
+    """the tests that `names` picks: names, globs, re:, grp: or :failed (see selection.py)"""
+    try:
+        return selection.select(challenge, names, log.plan)
+    except ValueError as e:
+        fail(cfg, [str(e)])
 
 
 def get_challenge(cfg: Config) -> Challenge:
     if cfg.test_path or cfg.test_plan:
         path = cfg.test_path or cfg.test_plan
         try:
-            return orgtest.read_challenge(path)
+            return plans.read_plan(path)
         except ValueError as e:
-            fail(cfg, [f'{path}: {e}'])
+            fail(cfg, [str(e)])  # (which names the file)
     elif cfg.attempt:
         return db.challenge_from_attempt(cfg.attempt)
     else:
         raise NoTestPlanError("No tests specified. Use --tests PATH or ensure you're in a tanco project.")
 
 
-def run_tests(cfg: Config, names=None):
-    challenge = get_challenge(cfg)
+def report_pass(cfg: Config, num_passed: int):
+    print()
+    print('All %d tests passed.' % num_passed)
+    print()
+    if cfg.test_path:
+        print('All tests in %s passed.' % cfg.test_path)
+    else:
+        print('This may be a good time to commit your changes,')
+        print('or spend some time improving your code.')
+        if cfg.attempt:
+            print()
+            print("When you're ready, run `tanco next` to start work on the next feature.")
+            print()
+            TancoClient().send_pass(cfg)
+
+
+def num_jobs(cfg: Config, tests: Iterable[TestDescription]) -> int:
+    """
+    how many tests to run at once. a target that reads a fixed `input_path`
+    only runs in parallel when asked to (with --jobs), since each worker's
+    input file is only passed on in INPUT_PATH.
+    """
+    jobs = cfg.jobs or (1 if cfg.input_path else os.cpu_count() or 1)
+    return max(1, min(jobs, len(tests))) if isinstance(tests, list) else jobs
+
+
+def worker_config(cfg: Config, slot: int, jobs: int) -> Config:
+    """give each of several workers its own input file, so they don't clobber each other"""
+    if not cfg.input_path or jobs == 1:
+        return cfg
+    root, ext = os.path.splitext(cfg.input_path)
+    return dataclasses.replace(cfg, input_path=f'{root}.{slot}{ext}')
+
+
+def run_tests(cfg: Config, names=None, challenge: Challenge | None = None,
+              spawners: list[Spawner] | None = None):
+    """
+    Run the tests (all of them, or the ones in `names`) in the order given by cfg.schedule.
+    Callers that run the tests again and again (like `tanco watch`) can pass in the parsed
+    challenge, and Spawners to keep warm targets in between runs.
+    """
+    if challenge is None and streams(cfg):
+        run_tests_streaming(cfg, names, spawners)
+        return
+    challenge = challenge or get_challenge(cfg)
     tests = challenge.tests
 
     # Check for empty tests list
@@ -369,33 +910,46 @@ def run_tests(cfg: Config, names=None):
         )
 
     # Use persistent process mode if restart_cmd is configured
-    if cfg.restart_cmd and cfg.restart_expect:
-        run_tests_persistent(cfg, tests, names)
+    if cfg.persistent:
+        run_tests_persistent(cfg, challenge, names)
         return
 
-    num_passed = 0
+    log = RunLog(cfg)
+    selected = log.uncached(select_tests(cfg, log, challenge, names))
+    selected = schedule.order(cfg, log.plan, selected)
+    if num_jobs(cfg, selected) > 1:
+        run_tests_parallel(cfg, selected, len(tests), log, spawners)
+        return
+
+    num_passed = log.num_cached
+    pending: list[tuple[TestDescription, m.TestResult]] = []  # for the server to check
+    spawner = spawners[0] if spawners else Spawner(cfg, limit=len(selected))
     try:
-        for i, test in enumerate(tests):
-            if names and test.name not in names: continue
-            program = spawn(cfg)
-            run_test(cfg, program, test)
-            # either it passed or threw exception
+        for test in selected:
+            program = spawner.take(cold_start(test))
+            start = time.perf_counter()
+            try:
+                res = timed_result(cfg, program, test, log.timeout(test))
+            except subprocess.TimeoutExpired:
+                log.add(test, False, time.perf_counter() - start)
+                raise
+            if res.kind == ResultKind.AskServer:
+                pending.append((test, res))
+                continue
+            log.add(test, res.is_pass(), res.secs, res.usage)
+            if res.kind == ResultKind.Fail:
+                # a regression! (test failed and have the rule,
+                # so we have to tell the server)
+                assert res.error is not None
+                fail(cfg, res.error.report_lines(), test, res)
             print('.', end='', flush=True)
             num_passed += 1
+        failures: list[tuple[TestDescription, m.TestResult | None]] = []
+        num_passed += check_pending(cfg, log, pending, failures)
+        if failures:
+            report_failures(cfg, num_passed, len(tests), failures)
         else:
-            print()
-            print('All %d tests passed.' % num_passed)
-            print()
-            if cfg.test_path:
-                print('All tests in %s passed.' % cfg.test_path)
-            else:
-                print('This may be a good time to commit your changes,')
-                print('or spend some time improving your code.')
-                if cfg.attempt:
-                    print()
-                    print("When you're ready, run `tanco next` to start work on the next feature.")
-                    print()
-                    TancoClient().send_pass(cfg)
+            report_pass(cfg, num_passed)
     except (subprocess.TimeoutExpired, TestFailure) as e:
         # TODO: is this even reachable??
         print()
@@ -411,7 +965,174 @@ def run_tests(cfg: Config, names=None):
             for line in test.ilines:
                 print(line)
             print()
-            fail(cfg, e.error_lines(), test)
+            fail(cfg, e.report_lines(), test)
+    finally:
+        if not spawners:
+            spawner.close()
+        log.save()
+
+
+def streams(cfg: Config) -> bool:
+    """
+    whether the tests can start while the org file is still being read: they have
+    to run in plan order (which any order is, for a plan that has never run), on
+    fresh processes, and without the result cache (which looks them all up at once).
+    a plan that's in the plan cache is quicker to load.
+    """
+    path = cfg.test_path or cfg.test_plan
+    return (bool(path) and not cfg.persistent
+            and not (cfg.use_cache and cfg.cache_files)
+            and os.path.isfile(path) and schedule.keeps_plan_order(cfg, plan_key(cfg))
+            and not plancache.fresh(path))
+
+
+def run_tests_streaming(cfg: Config, names=None, spawners: list[Spawner] | None = None):
+    """
+    Run the tests in plan order as the org file is read, building only the ones `names` picks.
+    (the files it includes are read once it's done, the usual way)
+    """
+    path = cfg.test_path or cfg.test_plan
+    reader = orgtest.TestReaderStateMachine()
+    included: list[TestDescription] = []
+    log = RunLog(cfg)
+    exact = selection.exact_names(names)
+    try:
+        wanted = selection.matcher(names, log.plan) if names else None
+    except ValueError as e:
+        fail(cfg, [str(e)])
+
+    def read():
+        try:
+            # (the reader skips the tests it doesn't need to build, when it can tell)
+            yield from (t for t in reader.stream_file(path, exact) if not wanted or wanted(t))
+        except ValueError as e:
+            fail(cfg, [f'{path}: {e}'])
+        if not reader.challenge.includes:
+            return
+        try:
+            files = plans.read_files(plans.resolve(path, reader.challenge.includes), frozenset([path]))
+            included.extend(plans.merge(files, dict.fromkeys(reader.test_names, path), reader.grp + 1).tests)
+        except ValueError as e:
+            fail(cfg, [str(e)])
+        yield from (t for t in included if not wanted or wanted(t))
+
+    tests = read()
+    first = next(tests, None)
+    if first is None and not reader.test_names:
+        raise NoTestsFoundError(
+            f'No tests found in {path}. '
+            'Make sure the file contains valid test definitions.',
+        )
+    tests = itertools.chain([first], tests) if first else tests
+    if num_jobs(cfg, tests) == 1:
+        cfg = dataclasses.replace(cfg, fail_fast=True)  # (stop at the first failure, as one by one)
+    run_tests_parallel(cfg, tests, None, log, spawners,
+                       plan_size=lambda: len(reader.test_names) + len(included))
+
+
+def run_tests_parallel(cfg: Config, tests: Iterable[TestDescription], num_tests: int | None, log: RunLog,
+                       warm: list[Spawner] | None = None, plan_size: Callable[[], int] | None = None):
+    """Run tests on a pool of workers, each spawning a fresh target per test.
+    Results are reported in the order given, as if the tests had run one by one.
+    Spawners passed in as `warm` are used first, and left open afterwards.
+    `tests` can be a generator, in which case each test starts as soon as it's
+    generated, and `plan_size` (called at the end) gives the number of tests."""
+    jobs = num_jobs(cfg, tests)
+    slots: queue.SimpleQueue[int] = queue.SimpleQueue()
+    for slot in range(jobs):
+        slots.put(slot)
+    warm = (warm or [])[:jobs]
+    # (one process per test between them, unless `tests` is a generator and we can't tell)
+    launches = Launches(len(tests)) if isinstance(tests, list) else None
+    spawners = warm + [Spawner(worker_config(cfg, slot, jobs), launches) for slot in range(len(warm), jobs)]
+    if not cfg.input_path:  # (otherwise each worker's processes read their own input file)
+        for spawner in spawners:
+            spawner.peers = [s for s in spawners if s is not spawner]
+    stop = threading.Event()
+
+    def work(test: TestDescription) -> m.TestResult | None:
+        if stop.is_set():
+            return None  # skipped because of --fail-fast
+        slot = slots.get()
+        try:
+            wcfg = spawners[slot].cfg
+            res = timed_result(wcfg, spawners[slot].take(cold_start(test)), test, log.timeout(test))
+        except BaseException:
+            if cfg.fail_fast: stop.set()
+            raise
+        finally:
+            slots.put(slot)
+        if cfg.fail_fast and res.kind == ResultKind.Fail:
+            stop.set()
+        return res
+
+    num_passed = log.num_cached
+    failures: list[tuple[TestDescription, m.TestResult | None]] = []  # None means timeout
+    pending: list[tuple[TestDescription, m.TestResult]] = []  # for the server to check
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            submitted: list[tuple[TestDescription, Future]] = []
+            try:
+                for test in tests:
+                    submitted.append((test, pool.submit(work, test)))
+                for test, future in submitted:
+                    try:
+                        res = future.result()
+                    except subprocess.TimeoutExpired:
+                        log.add(test, False, log.timeout(test))
+                        failures.append((test, None))
+                    else:
+                        if res is None:
+                            continue  # never ran
+                        if res.kind == ResultKind.AskServer:
+                            pending.append((test, res))
+                            continue
+                        log.add(test, res.is_pass(), res.secs, res.usage)
+                        if res.kind == ResultKind.Pass:
+                            print('.', end='', flush=True)
+                            num_passed += 1
+                        else:
+                            failures.append((test, res))
+                    if failures and cfg.fail_fast:
+                        break
+            except KeyboardInterrupt:
+                procs.kill_all()  # (so the running tests end now, instead of at their timeouts)
+                raise
+            finally:
+                stop.set()
+                for _, future in submitted:
+                    future.cancel()
+        if not (failures and cfg.fail_fast):
+            num_passed += check_pending(cfg, log, pending, failures)
+    finally:
+        log.save()
+        for spawner in spawners:
+            if spawner not in warm:
+                spawner.close()
+            if spawner.cfg.input_path != cfg.input_path and os.path.exists(spawner.cfg.input_path):
+                os.remove(spawner.cfg.input_path)
+
+    if num_tests is None:
+        num_tests = plan_size() if plan_size else len(submitted)
+    if failures:
+        report_failures(cfg, num_passed, num_tests, failures)
+    else:
+        report_pass(cfg, num_passed)
+
+
+def report_failures(cfg: Config, num_passed: int, num_tests: int,
+                    failures: list[tuple[TestDescription, m.TestResult | None]]):
+    """summarize a run, then fail with the first failure (None means the test timed out)"""
+    print()
+    print('%d of %d tests passed.' % (num_passed, num_tests))
+    if len(failures) > 1:
+        print('Failed:', ' '.join(test.name for test, _ in failures))
+    test, res = failures[0]
+    if res is None:
+        print('Test [%s] timed out.' % test.name)
+    else:
+        assert res.error is not None
+        fail(cfg, res.error.report_lines(), test, None if res.remote else res)
 
 
 def find_target(cfg: Config, argv: list[str]) -> Config:
@@ -511,31 +1232,38 @@ def handle_unexpected_error(cfg: Config):
                '  https://github.com/tangentcode/tanco/issues'])
 
 
-def main(names: list[str]):
-    cfg = load_config()
+@contextlib.contextmanager
+def test_errors(cfg: Config):
+    """explain the problem if a test run goes wrong (used by the driver commands)"""
     try:
-        run_tests(cfg, names)
+        yield
     except NoTestPlanError:
         error(cfg, ['No challenge selected.',
-                    'Use `tanco init` or set TEST_PLAN environment variable.'])
+                   'Use `tanco init`, `tanco test -t file.org`, or set TEST_PLAN environment variable.'])
     except NoTestsFoundError as e:
         error(cfg, [str(e),
-                    '',
-                    'For org files, tests should be defined using:',
-                    '  ** TEST testname : title',
-                    '  #+begin_src',
-                    '  > input line',
-                    '  expected output',
-                    '  #+end_src'])
+                   '',
+                   'For org files, tests should be defined using:',
+                   '  ** TEST testname : title',
+                   '  #+begin_src',
+                   '  > input line',
+                   '  expected output',
+                   '  #+end_src'])
     except FileNotFoundError as e:
         error(cfg, [f'Test file not found: {e.filename}',
-                    '',
-                    'Make sure the path is correct and the file exists.'])
+                   '',
+                   'Make sure the path is correct and the file exists.'])
     except StopTesting:
         pass
     except Exception:
         handle_unexpected_error(cfg)
 
 
+def main(names: list[str]):
+    cfg = load_config()
+    with test_errors(cfg):
+        run_tests(cfg, names)
+
+
 if __name__ == '__main__':
     main(sys.argv)
@@ -0,0 +1,128 @@
+"""
+Decides which order to run the tests in.
+
+Each strategy in SCHEDULES takes the tests (in plan order) and
+what we know about their latest runs, and returns them in the
+order they should run. The default puts the tests that failed
+last time first, then the fastest, so a regression usually shows
+up within the first second of a run.
+
+Other strategies can be added with the `strategy` decorator:
+
+    @schedule.strategy('slowest')
+    def slowest(tests, history):
+        return sorted(tests, key=lambda t: -history.secs(t))
+
+and picked with `--order slowest` or `"schedule": "slowest"` in `.tanco`.
+"""
+import contextlib
+from dataclasses import dataclass, field
+from typing import Callable
+
+from . import database as db
+from .model import Config, TestDescription
+
+@dataclass
+class History:
+    """what the last runs of a plan tell us about its tests"""
+    status: dict[str, dict] = field(default_factory=dict)  # test name -> {passed, secs, run}
+    failed: list[str] = field(default_factory=list)  # failing tests, most recent failure first
+    focus_grp: int | None = None  # the group being worked on, if we know it
+
+    def __post_init__(self):
+        self.ranks = {name: i for i, name in enumerate(self.failed)}
+
+    @classmethod
+    def load(cls, plan: str | None) -> 'History':
+        if not plan:
+            return cls()
+        status = db.test_status(plan)
+        failed = sorted((name for name, row in status.items() if not row['passed']),
+                        key=lambda name: -status[name]['run'])
+        return cls(status, failed)
+
+    def secs(self, test: TestDescription) -> float:
+        """how long the test took last time (0 if it never ran, so new tests go first)"""
+        row = self.status.get(test.name)
+        return row['secs'] if row else 0.0
+
+    def failed_rank(self, test: TestDescription) -> int:
+        """0 for the most recent failure, 1 for the next... and len(failed) for passing tests"""
+        return self.ranks.get(test.name, len(self.failed))
+
+
+Strategy = Callable[[list[TestDescription], History], list[TestDescription]]
+SCHEDULES: dict[str, Strategy] = {}
+
+
+def strategy(name: str):
+    """register a scheduling strategy under `name`"""
+    def register(fn: Strategy) -> Strategy:
+        SCHEDULES[name] = fn
+        return fn
+    return register
+
+
+@strategy('plan')
+def plan_order(tests, _history):
+    """the order of the org file (or the database)"""
+    return list(tests)
+
+
+@strategy('failed-first')
+def failed_first(tests, history):
+    """recently failed tests, then the rest in plan order"""
+    return sorted(tests, key=history.failed_rank)
+
+
+@strategy('fastest')
+def fastest(tests, history):
+    """quickest tests first, by their last run time"""
+    return sorted(tests, key=history.secs)
+
+
+@strategy('failed-fastest')
+def failed_fastest(tests, history):
+    """recently failed tests, then the rest, quickest first"""
+    return sorted(tests, key=lambda t: (history.failed_rank(t), history.secs(t)))
+
+
+@strategy('focus')
+def focus(tests, history):
+    """recently failed tests, then the rest of the focus group, then everything else (quickest first)"""
+    return sorted(tests, key=lambda t: (history.failed_rank(t), t.grp != history.focus_grp,
+                                        history.secs(t)))
+
+
+def focus_grp(cfg: Config, tests: list[TestDescription], history: History) -> int | None:
+    """the group of the attempt's focus test, or else of the latest failure"""
+    name = history.failed[0] if history.failed else None
+    if cfg.attempt and not (cfg.test_path or cfg.test_plan):
+        with contextlib.suppress(LookupError):
+            name = db.current_status(cfg.attempt)['focus'] or name
+    return next((t.grp for t in tests if t.name == name), None)
+
+
+# the strategies that only go by the history (so they keep the plan order without one)
+HISTORY_ONLY = {'failed-first', 'fastest', 'failed-fastest', 'focus'}
+
+
+def keeps_plan_order(cfg: Config, plan: str | None) -> bool:
+    """will `order` leave the tests as they are? (without looking at them)"""
+    if cfg.schedule == 'plan':
+        return True
+    return cfg.schedule in HISTORY_ONLY and not (plan and db.has_status(plan))
+
+
+def order(cfg: Config, plan: str | None, tests: list[TestDescription]) -> list[TestDescription]:
+    """put the tests in the order given by cfg.schedule"""
+    if cfg.schedule == 'plan' or any(t.olines is None for t in tests):
+        return tests  # the server has to see these in order
+    try:
+        choose = SCHEDULES[cfg.schedule]
+    except KeyError:
+        raise ValueError(f'unknown test order {cfg.schedule!r} (try one of: {", ".join(SCHEDULES)})')
+    history = History.load(plan)
+    if cfg.schedule == 'focus':
+        history.focus_grp = focus_grp(cfg, tests, history)
+    return choose(tests, history)
@@ -0,0 +1,164 @@
+"""
+Pick tests out of a plan (the TEST_NAMES given to `test`, `run`,
+`watch` and `bench`). Each name is a selector:
+
+    echo.a         the test with exactly this name
+    io.*           a glob over the names (see fnmatch)
+    re:^io\\.(r|w)  a regular expression, searched for in the names
+    grp:3          the tests in group 3 (numbered as in `tanco stats`)
+    :failed        the tests whose latest run failed
+
+A test runs if any selector picks it, and the tests run in the order
+given by `--order`, whatever the order of the selectors.
+
+The lookups go through a TestIndex, which is kept on the Challenge (so
+`tanco watch` builds it once, see index_for). Exact names and groups come from dicts,
+except on the first lookup of plain names, which just scans the list.
+A glob is only matched against the names that start with its literal
+part (`io.` for `io.*`), which are found by bisecting the sorted names.
+Only a regular expression, or a glob that starts with a wildcard, has
+to look at every name.
+"""
+import bisect
+import fnmatch
+import re
+from typing import Callable
+
+from . import database as db
+from .model import Challenge, TestDescription
+
+GLOB_CHARS = re.compile(r'[*?\[]')
+
+
+class TestIndex:
+    """the positions of a plan's tests, by name, name prefix and group (each built when first needed)"""
+
+    def __init__(self, tests: list[TestDescription]):
+        self.tests = tests
+        self._by_name: dict[str, int] | None = None
+        self._sorted: list[str] | None = None
+        self._by_grp: dict[int, list[int]] | None = None
+        self.lookups = 0
+
+    @property
+    def by_name(self) -> dict[str, int]:
+        if self._by_name is None:
+            self._by_name = {t.name: i for i, t in enumerate(self.tests)}
+        return self._by_name
+
+    @property
+    def sorted_names(self) -> list[str]:
+        if self._sorted is None:
+            self._sorted = sorted(self.by_name)
+        return self._sorted
+
+    @property
+    def by_grp(self) -> dict[int, list[int]]:
+        if self._by_grp is None:
+            self._by_grp = {}
+            for i, t in enumerate(self.tests):
+                self._by_grp.setdefault(t.grp, []).append(i)
+        return self._by_grp
+
+    def with_prefix(self, prefix: str) -> list[str]:
+        names = self.sorted_names
+        return names[bisect.bisect_left(names, prefix):bisect.bisect_left(names, prefix + '\U0010ffff')]
+
+    def glob(self, pattern: str) -> list[str]:
+        prefix = pattern[:wild.start()] if (wild := GLOB_CHARS.search(pattern)) else pattern
+        candidates = self.with_prefix(prefix) if prefix else self.sorted_names
+        return [name for name in candidates if fnmatch.fnmatchcase(name, pattern)]
+
+    def positions(self, selector: str, plan: str | None) -> list[int]:
+        """where the tests that the selector picks are"""
+        match selector_kind(selector):
+            case 'failed':
+                names = db.last_failures(plan) if plan else []
+            case 'grp':
+                return self.by_grp.get(parse_grp(selector), [])
+            case 're':
+                pattern = compile_regex(selector)
+                names = [name for name in self.sorted_names if pattern.search(name)]
+            case 'glob':
+                names = self.glob(selector)
+            case _:
+                names = [selector]
+        return [i for name in names if (i := self.by_name.get(name)) is not None]
+
+    def select(self, selectors: list[str], plan: str | None = None) -> list[TestDescription]:
+        """the tests that any of the selectors picks, in plan order"""
+        self.lookups += 1
+        if self._by_name is None and self.lookups == 1 and (names := exact_names(selectors)):
+            # (one scan is cheaper than building the dict, for a plan that's only searched once)
+            return [t for t in self.tests if t.name in names]
+        picked = set()
+        for selector in selectors:
+            picked.update(self.positions(selector, plan))
+        return [self.tests[i] for i in sorted(picked)]
+
+
+def selector_kind(selector: str) -> str:
+    if selector == ':failed':
+        return 'failed'
+    if selector.startswith('grp:'):
+        return 'grp'
+    if selector.startswith('re:'):
+        return 're'
+    if GLOB_CHARS.search(selector):
+        return 'glob'
+    return 'name'
+
+
+def parse_grp(selector: str) -> int:
+    try:
+        return int(selector[4:])
+    except ValueError:
+        raise ValueError(f'invalid group selector {selector!r} (try grp:3)')
+
+
+def compile_regex(selector: str) -> re.Pattern:
+    try:
+        return re.compile(selector[3:])
+    except re.error as e:
+        raise ValueError(f'invalid regular expression in {selector!r}: {e}')
+
+
+def exact_names(selectors: list[str] | None) -> set[str] | None:
+    """the names, if every selector is a plain name (None if any isn't)"""
+    if selectors and all(selector_kind(s) == 'name' for s in selectors):
+        return set(selectors)
+    return None
+
+
+def matcher(selectors: list[str], plan: str | None = None) -> Callable[[TestDescription], bool]:
+    """a test -> bool version of the selectors, for tests that come one at a time"""
+    names = {s for s in selectors if selector_kind(s) == 'name'}
+    globs = [s for s in selectors if selector_kind(s) == 'glob']
+    regexes = [compile_regex(s) for s in selectors if selector_kind(s) == 're']
+    grps = {parse_grp(s) for s in selectors if selector_kind(s) == 'grp'}
+    if ':failed' in selectors and plan:
+        names.update(db.last_failures(plan))
+
+    def match(test: TestDescription) -> bool:
+        return (test.name in names or test.grp in grps
+                or any(fnmatch.fnmatchcase(test.name, g) for g in globs)
+                or any(r.search(test.name) for r in regexes))
+    return match
+
+
+def index_for(challenge: Challenge) -> TestIndex:
+    """the challenge's TestIndex, built the first time it's needed"""
+    index = getattr(challenge, 'test_index', None)
+    if index is None or index.tests is not challenge.tests:
+        index = challenge.test_index = TestIndex(challenge.tests)
+    return index
+
+
+def select(source: Challenge | list[TestDescription], selectors: list[str] | None,
+           plan: str | None = None) -> list[TestDescription]:
+    """the tests that the selectors pick (all of them, without selectors), in plan order"""
+    tests = source.tests if isinstance(source, Challenge) else source
+    if not selectors:
+        return tests
+    index = index_for(source) if isinstance(source, Challenge) else TestIndex(tests)
+    return index.select(selectors, plan)
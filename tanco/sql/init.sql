@@ -4,7 +4,7 @@ create table meta (
     key text primary key,
     val text);
 
-insert into meta values ('schema_version', '0.1');
+insert into meta values ('schema_version', '0.6');
 
 
 create table servers (
@@ -89,3 +89,53 @@ create table tests (
     olines text,
     unique(chid, name),
     unique(chid, grp, ord));
+
+
+-- client-side history of each test run, for adaptive timeouts.
+-- (added in schema 0.2: see upgrade-0.2.sql)
+create table test_runs (
+    id integer primary key,
+    ts datetime not null default current_timestamp,
+    plan text not null,  -- attempt code, or absolute path of the org file
+    test text not null,
+    passed integer not null,
+    secs real not null);
+
+create index test_runs_plan_test on test_runs (plan, test);
+
+
+-- client-side cache of passing results, keyed on a hash of the
+-- target and the test (see cache.py). added in schema 0.3.
+create table test_cache (
+    key text primary key,
+    ts datetime not null default current_timestamp);
+
+
+-- client-side latest result of each test, for ordering test runs.
+-- (added in schema 0.4)
+create table test_status (
+    plan text not null,
+    test text not null,
+    passed integer not null,
+    secs real not null,
+    run integer not null references test_runs(id),
+    primary key (plan, test));
+
+
+-- client-side cpu and memory use of each test run (wall time and
+-- the test are in test_runs). added in schema 0.5.
+create table test_usage (
+    run integer primary key references test_runs(id),
+    grp integer,  -- the test's group in the plan
+    user_secs real,  -- cpu time, if the os could tell us
+    sys_secs real,
+    max_rss integer);  -- peak resident memory in bytes
+
+
+-- client-side baseline timings from `tanco bench`. added in schema 0.6.
+create table bench_baselines (
+    plan text not null,
+    test text not null,
+    ts datetime not null default current_timestamp,
+    samples text not null,  -- json list of seconds
+    primary key (plan, test));
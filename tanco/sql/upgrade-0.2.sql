@@ -0,0 +1,13 @@
+-- schema 0.1 -> 0.2: client-side history of each test run
+
+create table test_runs (
+    id integer primary key,
+    ts datetime not null default current_timestamp,
+    plan text not null,  -- attempt code, or absolute path of the org file
+    test text not null,
+    passed integer not null,
+    secs real not null);
+
+create index test_runs_plan_test on test_runs (plan, test);
+
+update meta set val = '0.2' where key = 'schema_version';
@@ -0,0 +1,7 @@
+-- schema 0.2 -> 0.3: cache of passing test results
+
+create table test_cache (
+    key text primary key,
+    ts datetime not null default current_timestamp);
+
+update meta set val = '0.3' where key = 'schema_version';
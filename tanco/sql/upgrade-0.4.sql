@@ -0,0 +1,15 @@
+-- schema 0.3 -> 0.4: latest result of each test
+
+create table test_status (
+    plan text not null,
+    test text not null,
+    passed integer not null,
+    secs real not null,
+    run integer not null references test_runs(id),
+    primary key (plan, test));
+
+insert into test_status (plan, test, passed, secs, run)
+  select plan, test, passed, secs, id from test_runs
+  where id in (select max(id) from test_runs group by plan, test);
+
+update meta set val = '0.4' where key = 'schema_version';
@@ -0,0 +1,10 @@
+-- schema 0.4 -> 0.5: cpu and memory use of each test run
+
+create table test_usage (
+    run integer primary key references test_runs(id),
+    grp integer,  -- the test's group in the plan
+    user_secs real,  -- cpu time, if the os could tell us
+    sys_secs real,
+    max_rss integer);  -- peak resident memory in bytes
+
+update meta set val = '0.5' where key = 'schema_version';
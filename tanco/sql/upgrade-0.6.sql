@@ -0,0 +1,10 @@
+-- schema 0.5 -> 0.6: baseline timings for `tanco bench`
+
+create table bench_baselines (
+    plan text not null,
+    test text not null,
+    ts datetime not null default current_timestamp,
+    samples text not null,  -- json list of seconds
+    primary key (plan, test));
+
+update meta set val = '0.6' where key = 'schema_version';
@@ -0,0 +1,80 @@
+"""
+Show where the time goes in a test plan (`tanco stats`).
+
+Everything here comes from the runs recorded in the local database
+(test_runs, test_status and test_usage), so it only knows about the
+tests that have been run on this machine.
+"""
+import statistics
+
+from . import database as db
+
+# runs on each side of the trend comparison
+TREND_RUNS = 5
+SPARKS = '▁▂▃▄▅▆▇█'
+
+
+def fmt_secs(secs: float | None) -> str:
+    if secs is None:
+        return '-'
+    return f'{secs * 1000:.0f}ms' if secs < 10 else f'{secs:.1f}s'
+
+
+def fmt_bytes(size: int | None) -> str:
+    if size is None:
+        return '-'
+    return f'{size / 2 ** 20:.1f}M'
+
+
+def cpu(row: dict) -> float | None:
+    if row['user_secs'] is None:
+        return None
+    return row['user_secs'] + (row['sys_secs'] or 0)
+
+
+def sparkline(samples: list[float]) -> str:
+    """one character per run, oldest first"""
+    lo, hi = min(samples), max(samples)
+    span = (hi - lo) or 1
+    return ''.join(SPARKS[int((x - lo) / span * (len(SPARKS) - 1))] for x in samples)
+
+
+def trend(samples: list[float]) -> str:
+    """how the median of the latest runs compares to the runs before them (newest first)"""
+    recent, before = samples[:TREND_RUNS], samples[TREND_RUNS:2 * TREND_RUNS]
+    if not before:
+        return ''
+    was = statistics.median(before)
+    change = (statistics.median(recent) - was) / was * 100 if was else 0
+    return f'{change:+.0f}%'
+
+
+def show(plan: str, top: int = 10):
+    """print the slowest tests, how their run times are trending, and totals by group"""
+    rows = db.latest_usage(plan)
+    if not rows:
+        print('No test runs recorded for', plan)
+        return
+    history = db.recent_times(plan, 2 * TREND_RUNS)
+    print(f'Slowest tests (latest run, {len(rows)} tests):')
+    print(f"  {'test':30} {'wall':>8} {'cpu':>8} {'rss':>8}  {'trend':>6}  recent")
+    for row in rows[:top]:
+        samples = history.get(row['test'], [])
+        print(f"  {row['test']:30} {fmt_secs(row['secs']):>8} {fmt_secs(cpu(row)):>8}"
+              f" {fmt_bytes(row['max_rss']):>8}  {trend(samples):>6}  {sparkline(samples[::-1]) if samples else ''}"
+              + ('' if row['passed'] else '  (failed)'))
+    groups: dict[int | None, list[dict]] = {}
+    for row in rows:
+        groups.setdefault(row['grp'], []).append(row)
+    if len(groups) < 2:
+        return
+    print()
+    print('By group:')
+    print(f"  {'group':30} {'tests':>5} {'wall':>8} {'cpu':>8} {'max rss':>8}")
+    for grp, members in sorted(groups.items(), key=lambda kv: -sum(r['secs'] for r in kv[1])):
+        cpus = [c for r in members if (c := cpu(r)) is not None]
+        rss = [r['max_rss'] for r in members if r['max_rss'] is not None]
+        first = min(members, key=lambda r: r['test'])['test']
+        label = f'{grp} ({first}...)' if grp is not None else '(unknown)'
+        print(f"  {label:30} {len(members):>5} {fmt_secs(sum(r['secs'] for r in members)):>8}"
+              f" {fmt_secs(sum(cpus) if cpus else None):>8} {fmt_bytes(max(rss) if rss else None):>8}")
@@ -0,0 +1,382 @@
+"""
+Talk to a target while it runs: feed it input, check its output
+line by line, and capture its stderr.
+
+The runners used to read everything a target printed into memory
+before comparing it with the expected output. A program stuck in a
+loop could print gigabytes before the timeout. Now each line is
+compared as it arrives, and the runner stops reading (and kills the
+target) once the result is certain:
+
+  - a few lines after the first line that doesn't match, so the
+    diff still has some context, or
+  - when a passing result would need the rest of the output to be
+    blank lines, and there have been too many of those.
+
+Either way, CUT_NOTE is appended to the output, so the test fails
+(the unread part could have held anything) and the diff shows where
+we stopped. Tests checked by the server (no expected
+output) are capped at MAX_LINES.
+
+Meanwhile, whatever the target writes to stderr is pumped into a
+Capture on another thread (so neither pipe can fill up and stall
+the target). A Capture keeps the latest RING_SIZE bytes in memory
+and spills older bytes to a temp file, up to SPILL_LIMIT. Failed
+tests show an excerpt of it.
+
+The input goes in on a feeder thread too, so a target that answers
+before it has read all its input can't fill its stdout pipe while
+we're still blocked writing to its stdin. Large inputs go out in a
+few vectored writes (os.writev) instead of a write per line.
+
+A persistent worker answers every test on the same stdout, so its
+output is split into one reply per test by a Replies scanner: either
+at a delimiter line (`restart-expect`), found by scanning each byte
+once as it arrives, or (with `"framing": "length"` on the target) by
+reading a length header before each reply, with no scanning at all.
+"""
+import contextlib
+import mmap
+import os
+import queue
+import re
+import select
+import sys
+import tempfile
+import threading
+
+from .model import Config
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+# lines to keep after the first mismatch
+MISMATCH_CONTEXT = 10
+# blank lines to allow after the expected output before giving up
+OVERFLOW_MARGIN = 1000
+# most lines to keep when there's no expected output to compare with
+MAX_LINES = 100_000
+# longest line we keep (the rest of the line is dropped)
+MAX_LINE = 2 ** 16
+
+CUT_NOTE = '[... tanco stopped reading the output here ...]'
+
+# bytes of captured output kept in memory
+RING_SIZE = 2 ** 16
+# bytes spilled to disk before we start dropping the middle
+SPILL_LIMIT = 2 ** 26
+# the most stderr to show with a failure
+EXCERPT_SIZE = 2 ** 12
+# read this much at a time from a pipe
+CHUNK_SIZE = 2 ** 16
+# inputs up to this size are written without a feeder thread
+# (a pipe always holds this much, so the write can't block)
+PIPE_BUF = getattr(select, 'PIPE_BUF', 512)
+# ask linux for a pipe this big when feeding larger inputs
+PIPE_SIZE = 2 ** 20
+F_SETPIPE_SZ = 1031  # from <linux/fcntl.h>
+# most buffers per writev call
+IOV_MAX = os.sysconf('SC_IOV_MAX') if 'SC_IOV_MAX' in getattr(os, 'sysconf_names', {}) else 1024
+
+
+class LineMatcher:
+    """
+    Cleans up output lines as they arrive (like runner.clean_output),
+    and decides when we've seen enough of them.
+    """
+
+    def __init__(self, cfg: Config, expected: list[str] | None):
+        self.expected = expected
+        self.skip = cfg.skip_lines
+        self.kept: list[str] = []
+        self.mismatch: int | None = None  # index of the first line that doesn't match
+        self.cut = False  # did we stop before the end of the output?
+
+    def feed(self, line: str) -> bool:
+        """take one raw line of output. returns False once there's no point reading more"""
+        if self.skip:
+            self.skip -= 1
+            return True
+        line = line[:MAX_LINE].strip()
+        i = len(self.kept)
+        self.kept.append(line)
+        exp = self.expected
+        if exp is None:
+            self.cut = i + 1 >= MAX_LINES
+            return not self.cut
+        if self.mismatch is None:
+            if (i < len(exp) and line != exp[i]) or (i >= len(exp) and line):
+                self.mismatch = i
+            elif i + 1 >= len(exp) + OVERFLOW_MARGIN:
+                # nothing but blank lines since the expected output. we don't
+                # know what comes after them, so this can't count as a pass.
+                self.cut = True
+                return False
+        if self.mismatch is not None and i >= self.mismatch + MISMATCH_CONTEXT:
+            self.cut = True
+            return False
+        return True
+
+    def lines(self) -> list[str]:
+        """the cleaned up output (with CUT_NOTE at the end if we stopped early)"""
+        lines = list(self.kept)
+        while lines and lines[-1] == '':
+            lines.pop()
+        if self.cut:
+            lines.append(CUT_NOTE)
+        return lines
+
+
+def read_lines(stdout, matcher: LineMatcher) -> bool:
+    """
+    feed lines from a text stream to the matcher until the stream ends.
+    returns False if the matcher stopped reading early.
+    """
+    while line := stdout.readline(MAX_LINE):
+        if not line.endswith('\n') and len(line) == MAX_LINE:
+            # drop the rest of an overlong line
+            while (rest := stdout.readline(MAX_LINE)) and not rest.endswith('\n'):
+                pass
+        if not matcher.feed(line):
+            return False
+    return True
+
+
+class Capture:
+    """
+    Collects the bytes of an output stream. The last RING_SIZE bytes
+    stay in memory. Anything older goes to a temp file (read back with
+    mmap), and past SPILL_LIMIT the middle of the stream is dropped.
+    """
+
+    def __init__(self, ring_size: int = RING_SIZE, spill_limit: int = SPILL_LIMIT):
+        self.ring = bytearray()
+        self.ring_size = ring_size
+        self.spill_limit = spill_limit
+        self.spill = None  # temp file, created on the first overflow
+        self.spilled = 0  # bytes in the spill file
+        self.dropped = 0  # bytes we didn't keep at all
+
+    def __len__(self):
+        return self.spilled + self.dropped + len(self.ring)
+
+    def write(self, data: bytes):
+        self.ring += data
+        if (extra := len(self.ring) - self.ring_size) > 0:
+            self.spill_out(self.ring[:extra])
+            del self.ring[:extra]
+
+    def spill_out(self, data: bytes):
+        room = max(0, self.spill_limit - self.spilled)
+        if room and self.spill is None:
+            self.spill = tempfile.TemporaryFile(prefix='tanco-')
+        if room:
+            self.spill.write(data[:room])
+            self.spilled += min(room, len(data))
+        self.dropped += max(0, len(data) - room)
+
+    def head(self, size: int) -> bytes:
+        """the first `size` bytes we kept"""
+        if not self.spilled:
+            return bytes(self.ring[:size])
+        self.spill.flush()
+        with mmap.mmap(self.spill.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            res = mm[:size]
+        return res if len(res) == size or self.dropped else res + bytes(self.ring[:size - len(res)])
+
+    def getvalue(self) -> bytes:
+        """everything we kept (with the dropped part left out)"""
+        return self.head(self.spilled) + bytes(self.ring) if self.spilled else bytes(self.ring)
+
+    def excerpt(self, size: int = EXCERPT_SIZE) -> str:
+        """the text, or if it's longer than `size` bytes, its start and end"""
+        if len(self) <= size:
+            return self.getvalue().decode(errors='replace')
+        half = size // 2
+        tail = bytes(self.ring[-half:])
+        skipped = len(self) - half - len(tail)
+        return (self.head(half).decode(errors='replace')
+                + f'\n[... {skipped} bytes not shown ...]\n'
+                + tail.decode(errors='replace'))
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+
+
+def pump(stream, capture: Capture) -> threading.Thread:
+    """copy a binary stream into the capture on a background thread, until it ends"""
+    def run():
+        while chunk := stream.read1(CHUNK_SIZE):
+            capture.write(chunk)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def write_all(fd: int, bufs: list[bytes]):
+    """write the buffers to a file descriptor in as few calls as we can"""
+    if not hasattr(os, 'writev'):
+        data = memoryview(b''.join(bufs))
+        while data:
+            data = data[os.write(fd, data):]
+        return
+    i = 0
+    while i < len(bufs):
+        n = os.writev(fd, bufs[i:i + IOV_MAX])
+        # skip whatever went out whole, and trim a partial write
+        while i < len(bufs) and n >= len(bufs[i]):
+            n -= len(bufs[i])
+            i += 1
+        if n:
+            bufs[i] = bufs[i][n:]
+
+
+def feed(stdin, lines: list[str]) -> threading.Thread | None:
+    """
+    send the lines to a target's stdin and close it. small inputs are
+    written right away. otherwise a thread does the writing, and is
+    returned so the caller can join it once the output is read.
+    """
+    bufs = [(line + '\n').encode(stdin.encoding or 'utf-8') for line in lines]
+    stdin.flush()
+    fd = stdin.fileno()
+
+    def run():
+        with contextlib.suppress(OSError):  # (BrokenPipeError: it quit early)
+            write_all(fd, bufs)
+        with contextlib.suppress(OSError):
+            stdin.close()
+    if sum(map(len, bufs)) <= PIPE_BUF:
+        run()
+        return None
+    if fcntl is not None and sys.platform.startswith('linux'):
+        with contextlib.suppress(OSError):
+            fcntl.fcntl(fd, F_SETPIPE_SZ, PIPE_SIZE)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def chunks(stream) -> queue.SimpleQueue:
+    """read (and then close) a binary stream on a background thread.
+    the chunks land on the queue, then b'' at the end"""
+    q: queue.SimpleQueue[bytes] = queue.SimpleQueue()
+
+    def run():
+        with contextlib.suppress(OSError), stream:
+            while chunk := stream.read1(CHUNK_SIZE):
+                q.put(chunk)
+        q.put(b'')
+    threading.Thread(target=run, daemon=True).start()
+    return q
+
+
+class FrameError(ValueError):
+    """the target's output doesn't follow the framing protocol"""
+
+
+class Replies:
+    """splits a persistent target's output into one reply per test"""
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def feed(self, data: bytes):
+        self.buf += data
+
+    def next(self) -> bytes | None:
+        """the next whole reply (taken out of the buffer), or None if it hasn't all arrived"""
+        raise NotImplementedError
+
+    def pending(self) -> str:
+        """what's arrived since the last reply"""
+        return self.buf.decode(errors='replace')
+
+
+class DelimitedReplies(Replies):
+    """
+    each reply ends at the delimiter followed by a newline. (text before the
+    delimiter on its line is part of the reply.) a plain delimiter is found with
+    bytes.find, resuming where the last search left off. one with regular
+    expression characters is matched against each complete line instead, and an
+    empty one means a blank line.
+    """
+
+    def __init__(self, delim: str):
+        super().__init__()
+        self.delim = delim.encode()
+        self.pattern = None
+        if not delim or set(delim) & set('.^$*+?{}[]\\|()'):
+            self.pattern = re.compile(self.delim + rb'\r?\n$' if delim else rb'^\r?\n$')
+        self.pos = 0  # where to resume scanning
+
+    def next(self):
+        if self.pattern:
+            return self.next_line_match()
+        buf, delim = self.buf, self.delim
+        while (i := buf.find(delim, self.pos)) >= 0:
+            end = i + len(delim)
+            if end < len(buf) and buf[end] == 13:  # '\r'
+                end += 1
+            if end >= len(buf):
+                self.pos = i  # (look again once we know what follows it)
+                return None
+            if buf[end] == 10:  # '\n'
+                return self.take(i, end + 1)
+            self.pos = i + 1
+        # a delimiter can only start this far back now
+        self.pos = max(self.pos, len(buf) - len(delim) + 1)
+        return None
+
+    def next_line_match(self):
+        buf = self.buf
+        while (nl := buf.find(b'\n', self.pos)) >= 0:
+            if match := self.pattern.search(bytes(buf[self.pos:nl + 1])):
+                return self.take(self.pos + match.start(), nl + 1)
+            self.pos = nl + 1
+        return None
+
+    def take(self, stop: int, skip: int) -> bytes:
+        reply = bytes(self.buf[:stop])
+        del self.buf[:skip]
+        self.pos = 0
+        return reply
+
+
+class FramedReplies(Replies):
+    """each reply is sent as its length in bytes (in decimal, on a line of its own), then the bytes"""
+
+    def next(self):
+        buf = self.buf
+        if (nl := buf.find(b'\n')) < 0:
+            if len(buf) > 20:
+                raise FrameError(f'expected a length line, got: {self.pending()[:80]!r}')
+            return None
+        try:
+            size = int(buf[:nl])
+        except ValueError:
+            raise FrameError(f'expected a length line, got: {self.pending()[:80]!r}')
+        if len(buf) < nl + 1 + size:
+            return None
+        reply = bytes(buf[nl + 1:nl + 1 + size])
+        del buf[:nl + 1 + size]
+        return reply
+
+
+def replies(cfg: Config) -> Replies:
+    """the scanner for a persistent target's replies: `framing` if set, else the `restart_expect` line"""
+    return FramedReplies() if cfg.framing == 'length' else DelimitedReplies(cfg.restart_expect)
+
+
+def reply_lines(reply: bytes) -> list[str]:
+    """a reply as lines of text (without their line endings)"""
+    if not reply:
+        return []
+    text = reply.decode(errors='replace')
+    if text.endswith('\n'):
+        text = text[:-1]
+    return [line.rstrip('\r') for line in text.split('\n')]
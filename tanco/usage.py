@@ -0,0 +1,71 @@
+"""
+Measure the CPU time and peak memory of the target programs.
+
+A fresh process per test is reaped with os.wait4, which hands back
+its rusage. A persistent worker never exits between tests, so on
+Linux we read its counters from /proc before and after each test
+instead. Anywhere else, only the wall time is known.
+"""
+import contextlib
+import os
+import subprocess
+import sys
+import time
+
+from .model import Usage
+
+# ru_maxrss is in kilobytes on linux, bytes on macOS
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+# how often to check whether a program has exited (when procs.finish couldn't wait for it)
+POLL_MIN = 0.001
+POLL_MAX = 0.05
+# clock ticks per second, for /proc/<pid>/stat
+CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def wait(program: subprocess.Popen, lock=None, exited: bool = False) -> Usage | None:
+    """
+    wait for the program to exit, and return what it used (if the os can tell us).
+    it's only reaped while holding `lock`, so that whatever kills it can take the
+    same lock, and check that it hasn't been reaped (see runner.collect_output).
+    once it's known to have `exited` (see procs.finish), that's one wait4. until
+    then it's polled, as a blocking wait4 would keep the lock from the killer.
+    """
+    if not hasattr(os, 'wait4') or program.returncode is not None:
+        program.wait()
+        return None
+    pause = POLL_MIN
+    while True:
+        with lock or contextlib.nullcontext():
+            try:
+                pid, status, ru = os.wait4(program.pid, 0 if exited else os.WNOHANG)
+            except ChildProcessError:
+                program.wait()  # someone else reaped it
+                return None
+            if pid:
+                program.returncode = os.waitstatus_to_exitcode(status)
+                return Usage(user=ru.ru_utime, sys=ru.ru_stime, max_rss=ru.ru_maxrss * MAXRSS_UNIT)
+        time.sleep(pause)
+        pause = min(pause * 2, POLL_MAX)
+
+
+def snapshot(pid: int) -> Usage | None:
+    """cpu time so far and peak memory of a running process (linux only)"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # skip past the command name, which can contain spaces
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/status') as f:
+            hwm = next((line.split()[1] for line in f if line.startswith('VmHWM:')), None)
+    except (OSError, IndexError):
+        return None
+    # fields[11] and [12] are utime and stime (fields 14 and 15 in proc(5))
+    return Usage(user=int(fields[11]) / CLK_TCK, sys=int(fields[12]) / CLK_TCK,
+                 max_rss=int(hwm) * 1024 if hwm else None)
+
+
+def since(before: Usage | None, after: Usage | None) -> Usage | None:
+    """what a persistent process used between two snapshots (the peak is since it started)"""
+    if before is None or after is None:
+        return None
+    return Usage(user=after.user - before.user, sys=after.sys - before.sys, max_rss=after.max_rss)
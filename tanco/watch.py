@@ -0,0 +1,276 @@
+"""
+Rerun the tests whenever the project changes (`tanco watch`).
+
+Changes are picked up with inotify on Linux, and by polling
+file modification times everywhere else. A burst of saves
+(like an editor writing a backup and then the file) only
+triggers one run.
+
+Between runs, the session keeps the parsed challenge and a few
+warm target processes in memory, so a rerun doesn't have to
+start from scratch. Unless told otherwise, the tests run in
+'focus' order: the ones that failed most recently first, then
+the rest of the group being worked on, then everything else.
+"""
+import asyncio
+import contextlib
+import ctypes
+import ctypes.util
+import fnmatch
+import os
+import select
+import struct
+import sys
+import time
+
+from . import aiorunner, runner
+from .cache import target_files
+from .model import Challenge, Config
+
+# wait for this many seconds of quiet before running the tests
+DEBOUNCE = 0.2
+# how often the mtime watcher scans the tree
+POLL_INTERVAL = 0.5
+
+# directories that never affect the tests
+IGNORE_DIRS = {'.git', '.hg', '.svn', '__pycache__', 'node_modules',
+               '.venv', 'venv', '.mypy_cache', '.pytest_cache', '.idea'}
+# editor droppings and tanco's own files
+IGNORE_FILES = ['*~', '.#*', '#*#', '*.swp', '*.swx', '4913', '*.sdb', '*.sdb-journal']
+
+
+def ignore_rule(cfg: Config):
+    """
+    returns a function that tells whether a changed path can be ignored.
+    the input files the runner writes for each test are ignored too,
+    or every run would trigger the next one.
+    """
+    patterns = list(IGNORE_FILES)
+    if cfg.input_path:
+        root, ext = os.path.splitext(os.path.basename(cfg.input_path))
+        patterns += [root + ext, f'{root}.*{ext}']
+
+    def ignore(path: str) -> bool:
+        parts = os.path.normpath(path).split(os.sep)
+        return (any(part in IGNORE_DIRS for part in parts[:-1])
+                or any(fnmatch.fnmatch(parts[-1], p) for p in patterns))
+    return ignore
+
+
+class PollWatcher:
+    """notices changes by comparing the mtime and size of every file in the tree"""
+
+    def __init__(self, root: str, ignore):
+        self.root = root
+        self.ignore = ignore
+        self.files = self.scan()
+
+    def scan(self) -> dict[str, tuple[int, int]]:
+        res = {}
+        for folder, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if d not in IGNORE_DIRS]
+            for name in files:
+                path = os.path.join(folder, name)
+                if self.ignore(path):
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue  # deleted while we were looking
+                res[path] = (st.st_mtime_ns, st.st_size)
+        return res
+
+    def wait(self, timeout: float | None = None) -> set[str]:
+        """block until something changes (or timeout), and return the changed paths"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            pause = POLL_INTERVAL if deadline is None else min(POLL_INTERVAL, deadline - time.monotonic())
+            if pause > 0:
+                time.sleep(pause)
+            files = self.scan()
+            changed = {path for path in files.keys() | self.files.keys()
+                       if files.get(path) != self.files.get(path)}
+            self.files = files
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self):
+        pass
+
+
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len (then the name)
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+class InotifyWatcher:
+    """asks the linux kernel to tell us about changes (one watch per directory)"""
+
+    def __init__(self, root: str, ignore):
+        self.root = root
+        self.ignore = ignore
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.dirs: dict[int, str] = {}  # watch descriptor -> directory
+        self.add_tree(root)
+
+    def add_tree(self, top: str):
+        for folder, dirs, _files in os.walk(top):
+            dirs[:] = [d for d in dirs if d not in IGNORE_DIRS]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                if folder == top == self.root:
+                    raise OSError(errno, f'inotify_add_watch failed for {folder}')
+                continue  # probably gone already (or out of watches)
+            self.dirs[wd] = folder
+
+    def wait(self, timeout: float | None = None) -> set[str]:
+        """block until something changes (or timeout), and return the changed paths"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        changed: set[str] = set()
+        while not changed:
+            left = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not select.select([self.fd], [], [], left)[0]:
+                break
+            changed = self.read_events()
+        return changed
+
+    def read_events(self) -> set[str]:
+        try:
+            buf = os.read(self.fd, 2 ** 16)
+        except BlockingIOError:
+            return set()
+        changed, pos = set(), 0
+        while pos < len(buf):
+            wd, mask, _cookie, size = IN_EVENT.unpack_from(buf, pos)
+            name = buf[pos + IN_EVENT.size: pos + IN_EVENT.size + size].rstrip(b'\0')
+            pos += IN_EVENT.size + size
+            if mask & IN_Q_OVERFLOW:
+                changed.add(self.root)  # lost track: assume anything could have changed
+                continue
+            if wd not in self.dirs:
+                continue
+            path = os.path.join(self.dirs[wd], os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and os.path.basename(path) not in IGNORE_DIRS:
+                    self.add_tree(path)
+            elif not self.ignore(path):
+                changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(root: str, ignore):
+    """inotify if we can get it, otherwise polling"""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(root, ignore)
+        except (OSError, AttributeError):
+            pass
+    return PollWatcher(root, ignore)
+
+
+def next_changes(watcher, debounce: float = DEBOUNCE) -> set[str]:
+    """wait for a change, then keep collecting changes until things go quiet"""
+    paths: set[str] = set()
+    while not paths:
+        paths = watcher.wait()
+    while more := watcher.wait(debounce):
+        paths |= more
+    return paths
+
+
+class WatchSession:
+    """the state kept in between test runs"""
+
+    def __init__(self, cfg: Config, names=None):
+        self.cfg = cfg
+        self.names = names
+        path = cfg.test_path or cfg.test_plan
+        self.plan_path = os.path.abspath(path) if path else None
+        self.challenge: Challenge | None = None
+        # warm targets only help when each test gets a fresh process,
+        # and the input file (if any) is written just before the target starts
+        self.spawners: list[runner.Spawner] = []
+        if cfg.engine == 'threads' and not (cfg.restart_cmd or cfg.input_path):
+            jobs = cfg.jobs or os.cpu_count() or 1
+            self.spawners = [runner.Spawner(cfg) for _ in range(jobs)]
+
+    def changed(self, paths: set[str]):
+        """forget whatever the changes made stale"""
+        paths = {os.path.abspath(p) for p in paths}
+        plan = {p for p in paths if self.in_plan(p)}
+        if plan:
+            self.challenge = None
+        others = paths - plan
+        if self.cfg.cache_files:
+            # we know which files make up the target
+            others &= {os.path.abspath(p) for p in target_files(self.cfg)}
+        if others:
+            # the warm targets are running the old code
+            for spawner in self.spawners:
+                spawner.close()
+
+    def in_plan(self, path: str) -> bool:
+        """whether the file is (or could be) part of the test plan"""
+        if not self.plan_path:
+            return False
+        if path == self.plan_path or (self.challenge and path in map(os.path.abspath, self.challenge.includes)):
+            return True
+        return os.path.isdir(self.plan_path) and path.startswith(self.plan_path + os.sep) and path.endswith('.org')
+
+    def run(self):
+        """run the tests once (in the order chosen by cfg.schedule)"""
+        cfg = self.cfg
+        with contextlib.suppress(runner.StopTesting), runner.test_errors(cfg):
+            if self.challenge is None or not self.plan_path:
+                self.challenge = runner.get_challenge(cfg)
+            if cfg.engine == 'asyncio':
+                asyncio.run(aiorunner.run_tests(cfg, self.names, self.challenge))
+            else:
+                runner.run_tests(cfg, self.names, self.challenge, self.spawners)
+
+    def close(self):
+        for spawner in self.spawners:
+            spawner.close()
+
+
+def watch(cfg: Config, names=None, debounce: float = DEBOUNCE, poll: bool = False):
+    """run the tests, then run them again after every change, until interrupted"""
+    root = os.getcwd()
+    ignore = ignore_rule(cfg)
+    watcher = PollWatcher(root, ignore) if poll else make_watcher(root, ignore)
+    session = WatchSession(cfg, names)
+    kind = 'polling' if isinstance(watcher, PollWatcher) else 'inotify'
+    try:
+        session.run()
+        while True:
+            print(f'\nWatching {root} for changes ({kind}). Press Ctrl-C to stop.')
+            paths = next_changes(watcher, debounce)
+            start = time.perf_counter()
+            session.changed(paths)
+            # (skip temp files that came and went during the save)
+            shown = sorted(os.path.relpath(p, root) for p in paths if os.path.exists(p)) or ['(removed files)']
+            print('\n---', time.strftime('%H:%M:%S'), 'changed:', ' '.join(shown[:5]),
+                  f'(and {len(shown) - 5} more)' if len(shown) > 5 else '')
+            session.run()
+            print(f'({time.perf_counter() - start:.2f}s)')
+    except KeyboardInterrupt:
+        print()
+    finally:
+        session.close()
+        watcher.close()
@@ -0,0 +1,9 @@
+"""
+The tests use a database of their own (tests/tanco.sdb). tanco.database
+reads TANCO_SDB_PATH when it's imported, so it's set here, before any
+test module imports tanco.
+"""
+import os
+import pathlib
+
+os.environ['TANCO_SDB_PATH'] = str(pathlib.Path(__file__).parent / 'tanco.sdb')
@@ -10,6 +10,7 @@ TANCO_SERVER = 'fake://invalid url/'
 
 import tanco.client  # noqa: E402
 import tanco.database  # noqa: E402
+import tanco.diff  # noqa: E402
 import tanco.orgtest  # noqa: E402
 
 class BasicTest(unittest.TestCase):
@@ -73,3 +74,60 @@ class OrgTestParserTest(unittest.TestCase):
         self.assertEqual(len(c.tests), 2)
         self.assertEqual(c.tests[0].name, 'foo.bar-1')
         self.assertEqual(c.tests[1].name, 'baz_2.A')
+
+    def test_stream(self):
+        org = (
+            '#+tanco-format: 0.2\n'
+            '#+timeout: 2s\n'
+            '** TEST a : first\n'
+            '#+begin_src\n'
+            '> q\n'
+            '#+end_src\n'
+            'about a\n'
+            '#+timeout: 1s\n'
+            '** TEST b : second\n'
+            '#+begin_src\n'
+            '> q\n'
+            '#+end_src\n'
+        )
+        seen = []
+
+        def lines():
+            for line in org.splitlines():
+                seen.append(line)
+                yield line
+
+        tests = tanco.orgtest.TestReaderStateMachine().stream(lines())
+        first = next(tests)
+        self.assertEqual((first.name, first.body, first.timeout), ('a', 'about a', 1.0))
+        self.assertEqual(seen[-1], '** TEST b : second')  # (a is done once b starts)
+        self.assertEqual([t.name for t in tests], ['b'])
+        # tests that aren't selected are skipped:
+        picked = tanco.orgtest.TestReaderStateMachine().stream(org.splitlines(), names=['b'])
+        self.assertEqual([(t.name, t.timeout) for t in picked], [('b', 2.0)])
+
+
+class DiffTest(unittest.TestCase):
+
+    def test_shortest_edit_script(self):
+        a, b = list('abcabba'), list('cbabac')
+        script = tanco.diff.edit_script(a, b)
+        self.assertEqual(sum(op != '=' for op, _, _ in script), 5)
+        self.assertEqual([b[j] for op, _, j in script if op != '-'], b)
+        self.assertEqual([a[i] for op, i, _ in script if op != '+'], a)
+
+    def test_hunks(self):
+        actual = [f'row {i}' for i in range(1000)]
+        expected = list(actual)
+        expected[500] = 'row 500!'
+        lines = tanco.diff.compare(actual, expected)
+        self.assertEqual(lines[0], '@@ 497 matching lines @@')
+        self.assertEqual(lines[1:4], ['  row 497', '  row 498', '  row 499'])
+        self.assertEqual([line[0] for line in lines[4:8]], ['-', '+', '?', ' '])
+        self.assertEqual(lines[-1], '@@ 496 matching lines @@')
+        self.assertEqual(tanco.diff.compare(['a'], ['b'], 'difflib'), ['- a', '+ b'])
+
+    def test_output_is_capped(self):
+        lines = tanco.diff.compare([f'{i}' for i in range(5000)], [f'{i}x' for i in range(5000)])
+        self.assertLessEqual(len(lines), tanco.diff.MAX_LINES + 1)
+        self.assertRegex(lines[-1], r'^@@ \.\.\. and \d+ more changed lines @@$')
@@ -0,0 +1,1127 @@
+import asyncio
+import contextlib
+import io
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+TESTS_PATH = pathlib.Path(__file__).parent
+TANCO_SDB_PATH = TESTS_PATH / 'tanco.sdb'
+os.environ['TANCO_SDB_PATH'] = str(TANCO_SDB_PATH)
+
+import tanco.aiorunner  # noqa: E402
+import tanco.bench  # noqa: E402
+import tanco.database  # noqa: E402
+import tanco.limits  # noqa: E402
+import tanco.model  # noqa: E402
+import tanco.orgtest  # noqa: E402
+import tanco.plancache  # noqa: E402
+import tanco.plans  # noqa: E402
+import tanco.procs  # noqa: E402
+import tanco.runner  # noqa: E402
+import tanco.schedule  # noqa: E402
+import tanco.selection  # noqa: E402
+import tanco.stats  # noqa: E402
+import tanco.stream  # noqa: E402
+import tanco.usage  # noqa: E402
+from tanco.model import Config, TestDescription  # noqa: E402
+
+# a tiny target program: echoes each input line in upper case until 'q'
+ECHO_PROGRAM = """\
+import sys
+for line in sys.stdin:
+    line = line.strip()
+    if line == 'q':
+        break
+    print(line.upper())
+"""
+
+ECHO_PLAN = """\
+#+tanco-format: 0.2
+#+name: echo
+** TEST echo.a : one line
+#+begin_src
+> a
+A
+> q
+#+end_src
+** TEST echo.b : two lines
+#+begin_src
+> b
+> c
+B
+C
+> q
+#+end_src
+** TEST echo.c : no output
+#+begin_src
+> q
+#+end_src
+"""
+
+
+class RunnerTestCase(unittest.TestCase):
+    """runs an echo program against a small org file in a temp directory"""
+
+    def setUp(self) -> None:
+        TANCO_SDB_PATH.unlink(missing_ok=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            tanco.database.ensure_sdb()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = pathlib.Path(self.tmp.name)
+        os.environ['TANCO_CACHE_DIR'] = str(self.dir / 'cache')
+        (self.dir / 'echo.py').write_text(ECHO_PROGRAM)
+        self.write_plan(ECHO_PLAN)
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+        TANCO_SDB_PATH.unlink(missing_ok=True)
+
+    def write_plan(self, text: str):
+        (self.dir / 'plan.org').write_text(text)
+
+    def config(self, **kw) -> Config:
+        kw = {'test_path': str(self.dir / 'plan.org'), **kw}
+        return Config(program_args=[sys.executable, str(self.dir / 'echo.py')], **kw)
+
+    def run_tests(self, cfg: Config, names=None) -> str:
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            try:
+                if cfg.engine == 'asyncio':
+                    asyncio.run(tanco.aiorunner.run_tests(cfg, names))
+                else:
+                    tanco.runner.run_tests(cfg, names)
+            except tanco.runner.StopTesting:
+                pass
+        return out.getvalue()
+
+
+class ParallelRunnerTest(RunnerTestCase):
+
+    def test_parallel_pass(self):
+        out = self.run_tests(self.config(jobs=3))
+        self.assertIn('All 3 tests passed.', out)
+
+    def test_parallel_reports_first_failure_in_plan_order(self):
+        plan = ECHO_PLAN.replace('\nA\n', '\nX\n').replace('\nB\n', '\nY\n')
+        self.write_plan(plan)
+        out = self.run_tests(self.config(jobs=3))
+        self.assertIn('1 of 3 tests passed.', out)
+        self.assertIn('Failed: echo.a echo.b', out)
+        self.assertIn('Test [echo.a] failed.', out)
+
+    def test_worker_input_paths(self):
+        cfg = self.config(input_path=str(self.dir / 'input.txt'))
+        paths = {tanco.runner.worker_config(cfg, slot, 4).input_path for slot in range(4)}
+        self.assertEqual(len(paths), 4)
+        self.assertNotIn(cfg.input_path, paths)
+        self.assertIs(tanco.runner.worker_config(cfg, 0, 1), cfg)
+
+    def check_fixed_input_path(self, engine):
+        # a target that reads the input_path itself (not INPUT_PATH) gets one worker by default
+        path = self.dir / 'input.txt'
+        (self.dir / 'echo.py').write_text(f'for line in open({str(path)!r}):\n'
+                                          '    if line.strip() != "q": print(line.strip().upper())\n')
+        cfg = self.config(input_path=str(path), engine=engine)
+        self.assertEqual(tanco.runner.num_jobs(cfg, [TestDescription()] * 3), 1)
+        self.assertEqual(tanco.runner.num_jobs(self.config(input_path=str(path), jobs=2), [TestDescription()] * 3), 2)
+        self.assertIn('All 3 tests passed.', self.run_tests(cfg))
+        self.assertTrue(path.exists())
+
+    @mock.patch.object(tanco.runner.os, 'cpu_count', return_value=4)
+    def test_fixed_input_path(self, _cpu_count):
+        self.check_fixed_input_path('threads')
+
+    @mock.patch.object(tanco.runner.os, 'cpu_count', return_value=4)
+    def test_fixed_input_path_async(self, _cpu_count):
+        self.check_fixed_input_path('asyncio')
+
+
+class SpawnerTest(RunnerTestCase):
+
+    def test_prespawn_respects_limit(self):
+        spawner = tanco.runner.Spawner(self.config(prespawn=2), limit=2)
+        try:
+            program = spawner.take()
+            self.assertEqual(len(spawner.ready), 1)
+            program.kill()
+            program.communicate()
+            warm = spawner.ready[0]
+        finally:
+            spawner.close()
+        self.assertIsNotNone(warm.poll())
+
+    def test_fresh_process_for_time_budget(self):
+        spawner = tanco.runner.Spawner(self.config(prespawn=1))
+        try:
+            spawner.fill()
+            warm = spawner.ready[0]
+            before = time.perf_counter()
+            fresh = spawner.take(fresh=True)
+            # a fresh process is timed from its launch, a ready one from when it's taken
+            self.assertIsNot(fresh, warm)
+            self.assertGreaterEqual(fresh.clock, before)
+            self.assertIs(spawner.take(), warm)
+            self.assertGreaterEqual(warm.clock, fresh.clock)
+            for program in [fresh, warm]:
+                program.kill()
+                program.communicate()
+        finally:
+            spawner.close()
+
+    def test_parallel_run_launches_one_process_per_test(self):
+        cfg = self.config(jobs=2, prespawn=1)
+        challenge = tanco.runner.get_challenge(cfg)
+        spawn = tanco.runner.spawn
+        with mock.patch.object(tanco.runner, 'spawn', side_effect=spawn) as launched, \
+                contextlib.redirect_stdout(io.StringIO()) as out:
+            tanco.runner.run_tests(cfg, None, challenge)
+        self.assertIn('All 3 tests passed.', out.getvalue())
+        self.assertEqual(launched.call_count, 3)
+
+    def test_workers_share_ready_processes(self):
+        # 3 tests on 2 workers: each process launched ahead gets used by whichever worker is free
+        launches = tanco.runner.Launches(3)
+        one, two = (tanco.runner.Spawner(self.config(prespawn=1), launches) for _ in range(2))
+        one.peers, two.peers = [two], [one]
+        spawn = tanco.runner.spawn
+        try:
+            with mock.patch.object(tanco.runner, 'spawn', side_effect=spawn) as launched:
+                taken = [one.take(), two.take(), one.take()]
+            self.assertEqual(launched.call_count, 3)
+            self.assertEqual(len(set(taken)), 3)
+            self.assertFalse(one.ready or two.ready)
+        finally:
+            for program in taken:
+                program.kill()
+                program.communicate()
+            one.close()
+            two.close()
+
+    def test_waits_for_a_launch_that_is_starting(self):
+        # the run's last launch is still starting up in one worker, so the other waits for it
+        launches = tanco.runner.Launches(1)
+        one, two = (tanco.runner.Spawner(self.config(prespawn=1), launches) for _ in range(2))
+        one.peers, two.peers = [two], [one]
+        spawn, started, go = tanco.runner.spawn, threading.Event(), threading.Event()
+
+        def slow_spawn(*args, **kwargs):
+            started.set()
+            go.wait()
+            return spawn(*args, **kwargs)
+        taken = []
+        try:
+            with mock.patch.object(tanco.runner, 'spawn', side_effect=slow_spawn) as launched:
+                filler = threading.Thread(target=two.fill)
+                filler.start()
+                started.wait()
+                taker = threading.Thread(target=lambda: taken.append(one.take()))
+                taker.start()
+                taker.join(0.2)
+                self.assertTrue(taker.is_alive())
+                go.set()
+                filler.join()
+                taker.join()
+            self.assertEqual(launched.call_count, 1)
+            self.assertEqual(len(taken), 1)
+        finally:
+            go.set()
+            for program in taken:
+                program.kill()
+                program.communicate()
+            one.close()
+            two.close()
+
+    def test_no_prespawn_with_input_path(self):
+        spawner = tanco.runner.Spawner(self.config(prespawn=2, input_path=str(self.dir / 'in.txt')))
+        self.assertEqual(spawner.depth, 0)
+
+
+# a persistent version of the echo program: 'reset' ends each test with '---'.
+# the first time it sees 'boom', it crashes (leaving a marker file behind).
+PERSISTENT_PROGRAM = """\
+import os, sys
+for line in sys.stdin:
+    line = line.strip()
+    if line == 'reset':
+        print('---', flush=True)
+    elif line == 'boom' and not os.path.exists('boom.txt'):
+        open('boom.txt', 'w').close()
+        sys.exit(1)
+    elif line != 'q':
+        print(line.upper())
+"""
+
+
+# like PERSISTENT_PROGRAM, but each reply is sent as a length line, then the bytes
+FRAMED_PROGRAM = """\
+import sys
+out = []
+for line in sys.stdin:
+    line = line.strip()
+    if line == 'reset':
+        reply = ''.join(out).encode()
+        sys.stdout.buffer.write(b'%d\\n%s' % (len(reply), reply))
+        sys.stdout.flush()
+        out = []
+    elif line != 'q':
+        out.append(line.upper() + '\\n')
+"""
+
+
+class PersistentRunnerTest(RunnerTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        (self.dir / 'echo.py').write_text(PERSISTENT_PROGRAM)
+        self.cwd = os.getcwd()
+        os.chdir(self.dir)
+
+    def tearDown(self) -> None:
+        os.chdir(self.cwd)
+        super().tearDown()
+
+    def config(self, **kw) -> Config:
+        return super().config(restart_cmd='reset', restart_expect='---', **kw)
+
+    def test_worker_pool(self):
+        out = self.run_tests(self.config(jobs=2))
+        self.assertIn('All 3 tests passed.', out)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'reads /proc')
+    def test_usage_is_recorded(self):
+        self.run_tests(self.config(jobs=1))
+        rows = tanco.database.query('select max_rss from test_usage')
+        self.assertEqual(len(rows), 3)
+        self.assertTrue(all(row['max_rss'] > 0 for row in rows))
+
+    def check_framed(self, engine):
+        (self.dir / 'echo.py').write_text(FRAMED_PROGRAM)
+        cfg = super().config(restart_cmd='reset', framing='length', engine=engine, jobs=2)
+        self.assertIn('All 3 tests passed.', self.run_tests(cfg))
+
+    def test_framed(self):
+        self.check_framed('threads')
+
+    def test_framed_async(self):
+        self.check_framed('asyncio')
+
+    def test_crashed_worker_is_replaced(self):
+        self.write_plan(ECHO_PLAN.replace('> b\n', '> boom\n> b\n').replace('\nB\n', '\nBOOM\nB\n'))
+        out = self.run_tests(self.config(jobs=2))
+        self.assertIn('All 3 tests passed.', out)
+
+
+class AsyncRunnerTest(RunnerTestCase):
+
+    def test_async_pass(self):
+        out = self.run_tests(self.config(engine='asyncio', jobs=2))
+        self.assertIn('All 3 tests passed.', out)
+
+    def test_async_failure(self):
+        self.write_plan(ECHO_PLAN.replace('\nB\n', '\nX\n'))
+        out = self.run_tests(self.config(engine='asyncio', jobs=1))
+        self.assertIn('1 of 3 tests passed.', out)
+        self.assertIn('Test [echo.b] failed.', out)
+
+    def test_async_persistent(self):
+        (self.dir / 'echo.py').write_text(PERSISTENT_PROGRAM)
+        cfg = self.config(engine='asyncio', jobs=2, restart_cmd='reset', restart_expect='---')
+        self.assertIn('All 3 tests passed.', self.run_tests(cfg))
+
+    def test_async_target(self):
+        (self.dir / 'echo.py').write_text(PERSISTENT_PROGRAM)
+
+        async def talk():
+            target = tanco.aiorunner.AsyncTarget(self.config(), 'reset', '---')
+            try:
+                return [await target.send(['a', 'b']), await target.send(['c'])]
+            finally:
+                await target.stop()
+        self.assertEqual(asyncio.run(talk()), [['A', 'B'], ['C']])
+
+
+SLOW_PROGRAM = """\
+import sys, time
+for line in sys.stdin:
+    if line.startswith('sleep'):
+        time.sleep(float(line.split()[1]))
+    elif line.strip() != 'q':
+        print(line.strip().upper())
+"""
+
+
+class TimeoutTest(RunnerTestCase):
+
+    def test_org_timeouts_by_scope(self):
+        self.write_plan(
+            '#+tanco-format: 0.2\n'
+            '#+timeout: 3s\n'
+            '* first group\n'
+            '#+timeout: 250ms\n'
+            '** TEST a.one\n'
+            '#+timeout: 1.5\n'
+            '#+begin_src\n> q\n#+end_src\n'
+            '** TEST a.two\n'
+            '#+begin_src\n> q\n#+end_src\n'
+            '#+timeout: 100ms\n'
+            '** TEST a.three\n'
+            '#+begin_src\n> q\n#+end_src\n'
+            'the description\n'
+            '* second group\n'
+            '** TEST b.one\n'
+            '#+begin_src\n> q\n#+end_src\n')
+        c = tanco.orgtest.read_challenge(str(self.dir / 'plan.org'))
+        self.assertEqual([t.timeout for t in c.tests], [1.5, 0.1, 0.25, 3.0])
+        self.assertEqual(c.tests[2].body, 'the description')
+
+    def test_config_timeouts(self):
+        log = tanco.runner.RunLog(self.config(timeout='2s', timeouts={'a.one': '1s', 'a.*': 3}))
+        one, two, other = (TestDescription(name=n) for n in ['a.one', 'a.two', 'b.one'])
+        self.assertEqual([log.timeout(t) for t in (one, two, other)], [1.0, 3, 2.0])
+
+    def test_adaptive_timeout(self):
+        cfg = self.config(adaptive_timeout=2)
+        plan = tanco.runner.plan_key(cfg)
+        tanco.database.save_runs(plan, [('echo.a', True, 0.5 + i / 100) for i in range(10)])
+        log = tanco.runner.RunLog(cfg)
+        self.assertAlmostEqual(log.timeout(TestDescription(name='echo.a')), 1.18)
+        self.assertEqual(log.timeout(TestDescription(name='echo.b')), 5.0)
+
+    def test_timeout_is_enforced_and_recorded(self):
+        (self.dir / 'echo.py').write_text(SLOW_PROGRAM)
+        self.write_plan(ECHO_PLAN.replace('> b\n', '> sleep 5\n> b\n'))
+        out = self.run_tests(self.config(jobs=1, timeout=0.5))
+        self.assertIn('Test [echo.b] timed out.', out)
+        history = tanco.database.query('select test, passed from test_runs order by id')
+        self.assertEqual([(r['test'], r['passed']) for r in history], [('echo.a', 1), ('echo.b', 0)])
+
+
+class CacheTest(RunnerTestCase):
+
+    def config(self, **kw) -> Config:
+        return super().config(cache_files=[str(self.dir / '*.py')], **kw)
+
+    def test_unchanged_tests_are_skipped(self):
+        self.write_plan(ECHO_PLAN.replace('\nB\n', '\nX\n'))
+        self.assertIn('2 of 3 tests passed.', self.run_tests(self.config(jobs=2)))
+        out = self.run_tests(self.config(jobs=2))
+        self.assertIn('Skipping 2 unchanged tests', out)
+        self.assertIn('Test [echo.b] failed.', out)
+
+    def test_changes_invalidate_the_cache(self):
+        self.run_tests(self.config())
+        self.assertIn('Skipping 3', self.run_tests(self.config(engine='asyncio')))
+        # a new expected output for one test:
+        self.write_plan(ECHO_PLAN.replace('> a\nA\n', '> aa\nAA\n'))
+        self.assertIn('Skipping 2', self.run_tests(self.config()))
+        # a change to the program:
+        with open(self.dir / 'echo.py', 'a') as f:
+            f.write('# changed\n')
+        out = self.run_tests(self.config())
+        self.assertNotIn('Skipping', out)
+        self.assertIn('All 3 tests passed.', out)
+
+    def test_entries_in_use_are_kept(self):
+        old = f'-{tanco.database.CACHE_DAYS + 1} days'
+        tanco.database.commit("insert into test_cache (key, ts) values ('used', datetime('now', ?)),"
+                              " ('unused', datetime('now', ?))", [old, old])
+        self.assertEqual(tanco.database.cached_passes(['used', 'new']), {'used'})
+        tanco.database.save_cached_passes(['new'])  # (drops the entries that weren't used for too long)
+        self.assertEqual(tanco.database.cached_passes(['used', 'unused', 'new']), {'used', 'new'})
+
+    def test_no_cache(self):
+        self.run_tests(self.config())
+        out = self.run_tests(self.config(use_cache=False))
+        self.assertNotIn('Skipping', out)
+        self.assertIn('All 3 tests passed.', out)
+
+    def test_nothing_cached_without_cache_files(self):
+        self.run_tests(super().config())
+        self.assertNotIn('Skipping', self.run_tests(super().config()))
+
+
+class PlanCacheTest(RunnerTestCase):
+
+    def read(self) -> tanco.model.Challenge:
+        return tanco.plancache.read_challenge(str(self.dir / 'plan.org'))
+
+    def test_round_trip(self):
+        self.write_plan(ECHO_PLAN.replace('#+name: echo', '#+name: echo\n#+timeout: 2s\n#+budget: rss=64M')
+                        .replace('** TEST echo.b : two lines', '** TEST echo.b : two lines\n#+budget: time=1s'))
+        parsed = tanco.orgtest.read_challenge(str(self.dir / 'plan.org'))
+        self.assertEqual(self.read(), parsed)  # (parsed and saved)
+        self.assertEqual(self.read(), parsed)  # (loaded)
+        self.assertTrue(list((self.dir / 'cache' / 'plans').glob('*.marshal')))
+
+    def test_changes_invalidate_the_cache(self):
+        plan = self.dir / 'plan.org'
+        st = plan.stat()  # (just written, so the entry can't trust the mtime)
+        self.assertEqual(self.read().tests[0].olines, ['A'])
+        # same size, and (within a clock tick) the same mtime:
+        self.write_plan(ECHO_PLAN.replace('\nA\n', '\nX\n'))
+        os.utime(plan, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertEqual(self.read().tests[0].olines, ['X'])
+        # a new mtime, but the same contents:
+        os.utime(plan, (1_000_000, 1_000_000))
+        self.assertEqual(self.read().tests[0].olines, ['X'])
+        self.write_plan(ECHO_PLAN.replace('\nA\n', '\nAA\n'))
+        self.assertEqual(self.read().tests[0].olines, ['AA'])
+
+    def test_new_parser_invalidates_the_cache(self):
+        self.read()
+        try:
+            tanco.plancache.parser_version.cache_clear()
+            tanco.plancache.FORMAT += 1
+            self.assertIsNone(tanco.plancache.load(tanco.plancache.entry_path(str(self.dir / 'plan.org'))))
+        finally:
+            tanco.plancache.FORMAT -= 1
+            tanco.plancache.parser_version.cache_clear()
+
+    def test_model_changes_invalidate_the_cache(self):
+        # (#+timeout: and #+budget: are parsed by the model)
+        self.read()
+        model = self.dir / 'model.py'
+        model.write_text(pathlib.Path(tanco.model.__file__).read_text() + '# changed\n')
+        try:
+            tanco.plancache.parser_version.cache_clear()
+            with mock.patch.object(tanco.model, '__file__', str(model)):
+                self.assertIsNone(tanco.plancache.load(tanco.plancache.entry_path(str(self.dir / 'plan.org'))))
+        finally:
+            tanco.plancache.parser_version.cache_clear()
+
+    def test_parse_errors_are_not_cached(self):
+        self.write_plan(ECHO_PLAN.replace('#+name: echo', '#+timeout: soon'))
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                self.read()
+
+
+PART_PLAN = """\
+#+tanco-format: 0.2
+* more
+** TEST echo.d : in another file
+#+begin_src
+> d
+D
+> q
+#+end_src
+"""
+
+
+class PlanFilesTest(RunnerTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        (self.dir / 'parts').mkdir()
+        (self.dir / 'parts' / 'd.org').write_text(PART_PLAN)
+        (self.dir / 'parts' / 'e.org').write_text(PART_PLAN.replace('echo.d', 'echo.e'))
+
+    def read(self, path='plan.org') -> tanco.model.Challenge:
+        return tanco.plans.read_plan(str(self.dir / path))
+
+    def test_include(self):
+        self.write_plan(ECHO_PLAN.replace('#+name: echo', '#+name: echo\n#+include: parts/d.org'))
+        c = self.read()
+        self.assertEqual(c.name, 'echo')
+        self.assertEqual([(t.name, t.grp) for t in c.tests],
+                         [('echo.a', 0), ('echo.b', 0), ('echo.c', 0), ('echo.d', 2)])
+        self.assertIn('All 4 tests passed.', self.run_tests(self.config()))
+        self.assertIn('All 4 tests passed.', self.run_tests(self.config(schedule='plan')))  # (streamed)
+
+    def test_directory(self):
+        (self.dir / 'parts' / 'd.org').write_text(PART_PLAN + '#+include: e.org\n')
+        c = self.read('parts')
+        self.assertEqual([t.name for t in c.tests], ['echo.d', 'echo.e'])
+        self.assertIn('All 5 tests passed.', self.run_tests(self.config(test_path=str(self.dir))))
+
+    def test_parallel_parse(self):
+        for name in ['d.org', 'e.org']:
+            os.utime(self.dir / 'parts' / name, (1_000_000, 1_000_000))  # (so the cache trusts the mtime)
+        with mock.patch.object(tanco.plans, 'PARALLEL_BYTES', 0), \
+                mock.patch.object(tanco.plans.os, 'cpu_count', return_value=2):
+            c = self.read('parts')
+        self.assertEqual([(t.name, t.grp) for t in c.tests], [('echo.d', 1), ('echo.e', 3)])
+        self.assertIsNotNone(tanco.plancache.cached(str(self.dir / 'parts' / 'e.org')))
+
+    def test_mistakes(self):
+        self.write_plan(ECHO_PLAN + '#+include: parts/d.org\n')
+        (self.dir / 'parts' / 'e.org').write_text(PART_PLAN)
+        with self.assertRaisesRegex(ValueError, r"duplicate name 'echo.d' in .*e.org \(also in .*d.org\)"):
+            self.read('parts')
+        (self.dir / 'parts' / 'e.org').write_text('#+include: d.org\n')
+        (self.dir / 'parts' / 'd.org').write_text('#+include: e.org\n')
+        with self.assertRaisesRegex(ValueError, 'include cycle'):
+            self.read('parts')
+        with self.assertRaisesRegex(ValueError, 'd.org is part of an include cycle'):
+            self.read()
+        self.write_plan(ECHO_PLAN + '#+include: parts/d.org\n#+include: parts/d.org\n')
+        (self.dir / 'parts' / 'd.org').write_text(PART_PLAN)
+        with self.assertRaisesRegex(ValueError, 'd.org is included more than once'):
+            self.read()
+
+
+class StreamingPlanTest(RunnerTestCase):
+
+    def config(self, **kw) -> Config:
+        return super().config(schedule='plan', **kw)
+
+    def test_streams_in_plan_order(self):
+        cfg = self.config(jobs=2)
+        self.assertTrue(tanco.runner.streams(cfg))
+        self.assertIn('All 3 tests passed.', self.run_tests(cfg))
+        # once the plan has a history, failed-fastest needs all the tests to sort them
+        self.assertFalse(tanco.runner.streams(super().config()))
+
+    def test_first_run_streams_in_any_order(self):
+        cfg = super().config(jobs=2)
+        self.assertTrue(tanco.runner.streams(cfg))
+        self.assertIn('All 3 tests passed.', self.run_tests(cfg))
+        self.assertFalse(tanco.runner.streams(cfg))
+
+    def test_failure_and_names(self):
+        self.write_plan(ECHO_PLAN.replace('\nB\n', '\nX\n'))
+        out = self.run_tests(self.config(jobs=1))
+        self.assertIn('1 of 3 tests passed.', out)
+        self.assertIn('Test [echo.b] failed.', out)
+        self.assertIn('All 2 tests passed.', self.run_tests(self.config(), ['echo.a', 'echo.c']))
+
+    def test_parse_error_after_the_first_tests(self):
+        self.write_plan(ECHO_PLAN + '** TEST bad?name\n')
+        out = self.run_tests(self.config(jobs=1))
+        self.assertIn('invalid test name', out)
+
+    def test_empty_plan(self):
+        self.write_plan('#+tanco-format: 0.2\n')
+        with self.assertRaises(tanco.runner.NoTestsFoundError):
+            self.run_tests(self.config())
+
+    def test_cached_plan_is_not_streamed(self):
+        cfg = self.config()
+        self.assertFalse(tanco.plancache.fresh(cfg.test_path))
+        tanco.plancache.read_challenge(cfg.test_path)
+        os.utime(cfg.test_path, (1_000_000, 1_000_000))
+        self.assertFalse(tanco.plancache.fresh(cfg.test_path))
+        tanco.plancache.read_challenge(cfg.test_path)
+        self.assertTrue(tanco.plancache.fresh(cfg.test_path))
+        self.assertFalse(tanco.runner.streams(cfg))
+
+
+class SelectionTest(RunnerTestCase):
+
+    def test_selectors(self):
+        tests = [TestDescription(name=name, grp=grp) for name, grp in
+                 [('io.read', 1), ('io.write', 1), ('iox', 1), ('math.add', 2), ('math.io', 2), ('z', 3)]]
+        c = tanco.model.Challenge(tests=tests)
+
+        def names(*selectors):
+            picked = tanco.selection.select(c, list(selectors))
+            match = tanco.selection.matcher(list(selectors))
+            self.assertEqual(picked, [t for t in tests if match(t)])
+            return [t.name for t in picked]
+
+        self.assertEqual(names('z', 'io.read'), ['io.read', 'z'])  # (in plan order)
+        self.assertEqual(names('io.*'), ['io.read', 'io.write'])
+        self.assertEqual(names('io*'), ['io.read', 'io.write', 'iox'])
+        self.assertEqual(names('*.io', 'io.?ead'), ['io.read', 'math.io'])
+        self.assertEqual(names('re:^math|x$'), ['iox', 'math.add', 'math.io'])
+        self.assertEqual(names('grp:2', 'z'), ['math.add', 'math.io', 'z'])
+        self.assertEqual(names('nope', 'grp:9'), [])
+        self.assertEqual(tanco.selection.select(c, None), tests)
+        self.assertIs(tanco.selection.index_for(c), tanco.selection.index_for(c))  # (built once)
+        self.assertEqual(tanco.selection.exact_names(['a', 'b']), {'a', 'b'})
+        self.assertIsNone(tanco.selection.exact_names(['a', 'b*']))
+        for bad in ['grp:x', 're:(']:
+            with self.assertRaises(ValueError):
+                tanco.selection.select(c, [bad])
+
+    def test_failed_last_run(self):
+        self.write_plan(ECHO_PLAN.replace('\nB\n', '\nX\n'))
+        self.run_tests(self.config(jobs=2))
+        out = self.run_tests(self.config(), [':failed'])
+        self.assertRegex(out, r'^\s*Test \[echo.b\] failed.')  # (and nothing else ran)
+
+    def test_run_with_selectors(self):
+        for order in ['plan', 'failed-fastest']:  # (streamed, and not)
+            out = self.run_tests(self.config(schedule=order), ['echo.[ab]', 're:c$'])
+            self.assertIn('All 3 tests passed.', out)
+            self.assertIn('All 1 tests passed.', self.run_tests(self.config(schedule=order), ['*.b']))
+        self.assertIn('invalid group selector', self.run_tests(self.config(), ['grp:one']))
+
+
+class ScheduleTest(RunnerTestCase):
+
+    def test_strategies(self):
+        tests = [TestDescription(name=n, grp=g) for n, g in
+                 [('a', 1), ('b', 1), ('c', 2), ('d', 2), ('e', 3), ('new', 3)]]
+        status = {'a': 0.3, 'b': 0.1, 'c': 0.2, 'd': 0.5, 'e': 0.4}
+        history = tanco.schedule.History(
+            status={n: {'passed': n not in 'ce', 'secs': secs, 'run': 0} for n, secs in status.items()},
+            failed=['e', 'c'], focus_grp=1)
+
+        def order(name):
+            return ' '.join(t.name for t in tanco.schedule.SCHEDULES[name](tests, history))
+        self.assertEqual(order('plan'), 'a b c d e new')
+        self.assertEqual(order('failed-first'), 'e c a b d new')
+        self.assertEqual(order('fastest'), 'new b c a e d')
+        self.assertEqual(order('failed-fastest'), 'e c new b a d')
+        self.assertEqual(order('focus'), 'e c b a new d')
+
+    def test_history_from_runs(self):
+        cfg = self.config()
+        plan = tanco.runner.plan_key(cfg)
+        tanco.database.save_runs(plan, [('echo.a', True, 0.2), ('echo.b', False, 0.1)])
+        tanco.database.save_runs(plan, [('echo.c', False, 0.3), ('echo.b', True, 0.05)])
+        history = tanco.schedule.History.load(plan)
+        self.assertEqual(history.failed, ['echo.c'])
+        self.assertEqual(history.secs(TestDescription(name='echo.b')), 0.05)
+
+    def test_last_failure_is_reported_first(self):
+        self.write_plan(ECHO_PLAN.replace('\nA\n', '\nX\n').replace('\nB\n', '\nY\n'))
+        self.assertIn('Test [echo.a] failed.', self.run_tests(self.config(jobs=2)))
+        # now echo.b is the one to fix
+        self.write_plan(ECHO_PLAN.replace('\nB\n', '\nY\n'))
+        self.run_tests(self.config(jobs=2))
+        self.write_plan(ECHO_PLAN.replace('\nA\n', '\nX\n').replace('\nB\n', '\nY\n'))
+        out = self.run_tests(self.config(jobs=2))
+        self.assertIn('Failed: echo.b echo.a', out)
+        self.assertIn('Test [echo.b] failed.', out)
+        out = self.run_tests(self.config(jobs=2, schedule='plan'))
+        self.assertIn('Failed: echo.a echo.b', out)
+
+
+# prints its input in upper case, then (on 'loop') the same line forever
+RUNAWAY_PROGRAM = """\
+import sys
+for line in sys.stdin:
+    line = line.strip()
+    if line == 'loop':
+        while True:
+            print('Y' * 1000)
+    elif line != 'q':
+        print(line.upper())
+"""
+
+
+class StreamTest(RunnerTestCase):
+
+    def test_matcher(self):
+        cfg = self.config(skip_lines=1)
+        m = tanco.stream.LineMatcher(cfg, ['A', 'B'])
+        for line in ['banner\n', ' A \n', 'B\n']:
+            self.assertTrue(m.feed(line))
+        # a few trailing blank lines don't fail a test, but we don't wait forever for them
+        self.assertTrue(all(m.feed('\n') for _ in range(tanco.stream.OVERFLOW_MARGIN - 1)))
+        self.assertEqual(m.lines(), ['A', 'B'])
+        self.assertFalse(m.feed('\n'))
+        self.assertEqual(m.lines(), ['A', 'B', tanco.stream.CUT_NOTE])
+        m = tanco.stream.LineMatcher(self.config(), ['A', 'B'])
+        self.assertTrue(m.feed('X'))
+        self.assertTrue(all(m.feed('B') for _ in range(tanco.stream.MISMATCH_CONTEXT - 1)))
+        self.assertFalse(m.feed('B'))
+        self.assertEqual(m.lines()[-1], tanco.stream.CUT_NOTE)
+        self.assertEqual(len(m.lines()), tanco.stream.MISMATCH_CONTEXT + 2)
+
+    def check_runaway(self, engine):
+        (self.dir / 'echo.py').write_text(RUNAWAY_PROGRAM)
+        self.write_plan(ECHO_PLAN.replace('> b\n', '> b\n> loop\n'))
+        start = time.perf_counter()
+        out = self.run_tests(self.config(jobs=1, engine=engine, timeout=30))
+        self.assertLess(time.perf_counter() - start, 10)
+        self.assertIn('Test [echo.b] failed.', out)
+        self.assertIn(tanco.stream.CUT_NOTE, out)
+        self.assertNotIn('timed out', out)
+
+    def test_runaway_target_is_stopped(self):
+        self.check_runaway('threads')
+
+    def test_runaway_target_is_stopped_async(self):
+        self.check_runaway('asyncio')
+
+    def check_blank_lines_then_output(self, engine):
+        # output after a long run of blank lines still counts
+        blanks = tanco.stream.OVERFLOW_MARGIN + 100
+        (self.dir / 'echo.py').write_text(f'print("A")\nprint("\\n" * {blanks})\nprint("GARBAGE")\n')
+        out = self.run_tests(self.config(jobs=1, engine=engine), ['echo.a'])
+        self.assertIn('Test [echo.a] failed.', out)
+        self.assertIn(tanco.stream.CUT_NOTE, out)
+
+    def test_blank_lines_then_output(self):
+        self.check_blank_lines_then_output('threads')
+
+    def test_blank_lines_then_output_async(self):
+        self.check_blank_lines_then_output('asyncio')
+
+    def test_capture_spills_to_disk(self):
+        cap = tanco.stream.Capture(ring_size=8, spill_limit=16)
+        try:
+            cap.write(b'0123456789')
+            self.assertEqual(cap.getvalue(), b'0123456789')
+            self.assertIsNotNone(cap.spill)
+            cap.write(b'abcdefghijklmnopqrstuvwxyz')
+            # 16 bytes on disk, 12 dropped, the last 8 in memory
+            self.assertEqual(len(cap), 36)
+            self.assertEqual(cap.getvalue(), b'0123456789abcdefstuvwxyz')
+            self.assertEqual(cap.excerpt(10), '01234\n[... 26 bytes not shown ...]\nvwxyz')
+        finally:
+            cap.close()
+
+    def check_stderr(self, engine):
+        # a megabyte of stderr before reading any input used to be a deadlock risk
+        (self.dir / 'echo.py').write_text(
+            'import sys\nsys.stderr.write("x" * 2 ** 20)\nsys.stderr.write("\\nlast words\\n")\n' + ECHO_PROGRAM)
+        self.write_plan(ECHO_PLAN.replace('\nB\n', '\nX\n'))
+        out = self.run_tests(self.config(jobs=1, engine=engine))
+        self.assertIn('Test [echo.b] failed.', out)
+        self.assertIn('---- what your program wrote to stderr ----', out)
+        self.assertIn('last words', out)
+        self.assertLess(len(out), 3 * tanco.stream.EXCERPT_SIZE)
+
+    def test_stderr_excerpt(self):
+        self.check_stderr('threads')
+
+    def test_stderr_excerpt_async(self):
+        self.check_stderr('asyncio')
+
+    def check_big_input(self, engine):
+        # the echo program answers each line right away, so with input this big
+        # its stdout pipe fills up long before we're done writing its stdin
+        n = 50_000
+        lines = '\n'.join(f'> line {i}' for i in range(n)) + '\n' + '\n'.join(f'LINE {i}' for i in range(n))
+        self.write_plan(ECHO_PLAN.replace('> a\nA\n', lines + '\n'))
+        out = self.run_tests(self.config(jobs=1, engine=engine, timeout=20))
+        self.assertIn('All 3 tests passed.', out)
+
+    def test_big_input(self):
+        self.check_big_input('threads')
+
+    def test_big_input_async(self):
+        self.check_big_input('asyncio')
+
+    def test_input_file_is_replaced_whole(self):
+        path = self.dir / 'input.txt'
+        path.write_text('old\n')
+        tanco.runner.write_input(str(path), ['a', 'b'])
+        self.assertEqual(path.read_text(), 'a\nb\n')
+        self.assertEqual(sorted(p.name for p in self.dir.iterdir() if p.name.startswith('input')), ['input.txt'])
+
+    def check_replies(self, make, data: bytes, expected: list[bytes]):
+        """feed the data in every possible pair of chunks: the replies should always come out the same"""
+        for cut in range(len(data) + 1):
+            replies, got = make(), []
+            for chunk in [data[:cut], data[cut:]]:
+                replies.feed(chunk)
+                while (reply := replies.next()) is not None:
+                    got.append(reply)
+            self.assertEqual(got, expected, f'cut at {cut}')
+
+    def test_replies(self):
+        S = tanco.stream
+        self.check_replies(lambda: S.DelimitedReplies('---'), b'A\nB\n---\r\nX---x\npre---\n---\n',
+                           [b'A\nB\n', b'X---x\npre', b''])
+        self.check_replies(lambda: S.DelimitedReplies('-+'), b'A\n--\nB\n', [b'A\n'])  # (a regular expression)
+        self.check_replies(lambda: S.DelimitedReplies(''), b'A\nB\n\nC\n\r\n', [b'A\nB\n', b'C\n'])
+        self.check_replies(S.FramedReplies, b'4\nA\nB\n0\n6\n---\n\n\n', [b'A\nB\n', b'', b'---\n\n\n'])
+        self.assertEqual(S.reply_lines(b'A\r\nB\npre'), ['A', 'B', 'pre'])
+        replies = S.FramedReplies()
+        replies.feed(b'HELLO\n')
+        with self.assertRaises(S.FrameError):
+            replies.next()
+
+
+class UsageTest(RunnerTestCase):
+
+    def test_usage_is_recorded(self):
+        head, tail = ECHO_PLAN.split('** TEST echo.c', 1)
+        self.write_plan(f'* first\n{head}* second\n** TEST echo.c{tail}')
+        for _ in range(2):
+            self.run_tests(self.config(jobs=2, use_cache=False))
+        rows = tanco.database.query('select r.test, u.* from test_usage u join test_runs r on u.run = r.id')
+        self.assertEqual(len(rows), 6)
+        self.assertEqual({row['test']: row['grp'] for row in rows}, {'echo.a': 1, 'echo.b': 1, 'echo.c': 2})
+        if hasattr(os, 'wait4'):
+            self.assertTrue(all(row['user_secs'] is not None and row['max_rss'] > 0 for row in rows))
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            tanco.stats.show(tanco.runner.plan_key(self.config()))
+        self.assertIn('Slowest tests (latest run, 3 tests):', out.getvalue())
+        self.assertIn('By group:', out.getvalue())
+        self.assertRegex(out.getvalue(), r'echo\.a +\d+ms +\d+ms +[\d.]+M')
+
+    @unittest.skipUnless(hasattr(os, 'wait4'), 'needs wait4')
+    def test_reaps_only_under_the_lock(self):
+        program = subprocess.Popen([sys.executable, '-c', 'pass'])
+        lock = threading.Lock()
+        with lock:
+            waiter = threading.Thread(target=tanco.usage.wait, args=(program, lock))
+            waiter.start()
+            time.sleep(0.3)  # long enough for the program to exit
+            self.assertIsNone(program.returncode)
+        waiter.join()
+        self.assertEqual(program.returncode, 0)
+
+    @unittest.skipUnless(hasattr(os, 'waitid'), 'needs waitid')
+    def test_one_wait_once_finished(self):
+        program = subprocess.Popen([sys.executable, '-c', 'pass'], **tanco.procs.popen_kw())
+        self.assertTrue(tanco.procs.finish(program))
+        self.assertIsNone(program.returncode)  # (not reaped yet)
+        with mock.patch.object(tanco.usage.time, 'sleep') as sleep:
+            used = tanco.usage.wait(program, threading.Lock(), exited=True)
+        sleep.assert_not_called()
+        self.assertEqual(program.returncode, 0)
+        self.assertIsNotNone(used)
+        self.assertFalse(tanco.procs.finish(program))
+
+
+class BenchTest(RunnerTestCase):
+
+    def test_statistics(self):
+        samples = [i / 100 for i in range(1, 101)]
+        s = tanco.bench.Summary.of(samples)
+        self.assertEqual((s.min, s.p95, s.p99), (0.01, 0.95, 0.99))
+        self.assertAlmostEqual(s.median, 0.505)
+        old = [0.010 + i / 10000 for i in range(20)]
+        self.assertLess(tanco.bench.slower_p([x * 1.5 for x in old], old), 0.001)
+        self.assertGreater(tanco.bench.slower_p(old, old), 0.4)
+        self.assertTrue(tanco.bench.verdict([x * 1.5 for x in old], old).startswith('SLOWER +50%'))
+        self.assertEqual(tanco.bench.verdict(old, old), '+0%')
+
+    def test_bench_saves_and_compares_baseline(self):
+        cfg = self.config()
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            results = tanco.bench.bench(cfg, ['echo.a', 'echo.c'], runs=3, warmup=1)
+        self.assertEqual({k: len(v) for k, v in results.items()}, {'echo.a': 3, 'echo.c': 3})
+        self.assertIn('Saved the timings of 2 tests', out.getvalue())
+        plan = tanco.runner.plan_key(cfg)
+        tanco.database.save_bench_baselines(plan, {'echo.a': [1e-6] * 10})
+        self.write_plan(ECHO_PLAN.replace('\nA\n', '\nX\n'))
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            tanco.bench.bench(cfg, runs=10, warmup=0)
+        self.assertRegex(out.getvalue(), r'echo\.a +\(failed\)')
+        self.assertIn('Saved the timings of 1 tests', out.getvalue())  # echo.b is new
+        self.assertEqual(set(tanco.database.bench_baselines(plan)), {'echo.a', 'echo.b', 'echo.c'})
+
+
+class BudgetTest(RunnerTestCase):
+
+    def test_budgets_by_scope(self):
+        self.write_plan(
+            '#+tanco-format: 0.2\n'
+            '#+budget: time=1s rss=64M\n'
+            '* group\n'
+            '#+budget: cpu=500ms\n'
+            '** TEST a.one\n'
+            '#+budget: rss=1.5G\n'
+            '#+begin_src\n> q\n#+end_src\n'
+            '** TEST a.two\n'
+            '#+begin_src\n> q\n#+end_src\n')
+        one, two = tanco.orgtest.read_challenge(str(self.dir / 'plan.org')).tests
+        self.assertEqual(one.budget, tanco.model.Budget(time=1.0, cpu=0.5, rss=3 * 2 ** 29))
+        self.assertEqual(two.budget, tanco.model.Budget(time=1.0, cpu=0.5, rss=2 ** 26))
+
+    def check_overrun(self, **kw):
+        self.write_plan(ECHO_PLAN.replace('** TEST echo.b : two lines\n',
+                                          '** TEST echo.b : two lines\n#+budget: time=1us\n'))
+        out = self.run_tests(self.config(jobs=1, **kw))
+        self.assertIn('Test [echo.b] failed.', out)
+        self.assertIn('your program went over budget', out)
+        self.assertRegex(out, r'time: [\d.]+ms \(budget: 0.001ms\)')
+
+    def test_overrun_fails_async_persistent(self):
+        (self.dir / 'echo.py').write_text(PERSISTENT_PROGRAM)
+        self.check_overrun(engine='asyncio', restart_cmd='reset', restart_expect='---')
+
+    def test_overrun_fails(self):
+        self.check_overrun()
+        res = tanco.model.TestResult.from_data(tanco.model.TestResult(
+            tanco.model.ResultKind.Fail, error=tanco.model.BudgetFailure(['time: 2ms (budget: 1ms)'])).to_data())
+        self.assertEqual(res.error.overruns, ['time: 2ms (budget: 1ms)'])
+
+
+# echoes like ECHO_PROGRAM, but 'spin' burns cpu and 'write' makes a 1M file
+GREEDY_PROGRAM = """\
+import sys
+for line in sys.stdin:
+    line = line.strip()
+    if line == 'spin':
+        while True:
+            pass
+    elif line == 'write':
+        with open('big.out', 'wb') as f:
+            f.write(bytes(2 ** 20))
+    elif line != 'q':
+        print(line.upper())
+"""
+
+
+@unittest.skipIf(tanco.limits.resource is None, 'needs setrlimit')
+class LimitTest(RunnerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        (self.dir / 'echo.py').write_text(GREEDY_PROGRAM)
+        self.cwd = os.getcwd()
+        os.chdir(self.dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        super().tearDown()
+
+    def test_parse(self):
+        cfg = self.config(limits={'cpu': '1.5s', 'memory': '512M', 'fsize': 4096, 'nproc': 64})
+        self.assertEqual(cfg.limits, tanco.model.Limits(cpu=1.5, memory=2 ** 29, fsize=4096, nproc=64))
+        with self.assertRaises(ValueError):
+            self.config(limits={'stack': '8M'})
+
+    def test_cpu_limit(self):
+        self.write_plan(ECHO_PLAN.replace('> b\n', '> b\n> spin\n'))
+        out = self.run_tests(self.config(jobs=1, timeout=30, limits={'cpu': 1}))
+        self.assertIn('Test [echo.b] failed.', out)
+        self.assertIn('your program went over its cpu limit', out)
+        self.assertIn('It used more than 1s of cpu time.', out)
+
+    def check_cpu_limit_with_matching_output(self, engine):
+        # echo.c expects no output, and gets none: the limit still fails it
+        self.write_plan(ECHO_PLAN.replace('no output\n#+begin_src\n', 'no output\n#+begin_src\n> spin\n'))
+        out = self.run_tests(self.config(jobs=1, engine=engine, timeout=30, limits={'cpu': 1}), ['echo.c'])
+        self.assertIn('Test [echo.c] failed.', out)
+        self.assertIn('It used more than 1s of cpu time.', out)
+
+    def test_cpu_limit_with_matching_output(self):
+        self.check_cpu_limit_with_matching_output('threads')
+
+    def test_cpu_limit_with_matching_output_asyncio(self):
+        self.check_cpu_limit_with_matching_output('asyncio')
+
+    def check_fsize_limit(self, engine):
+        self.write_plan(ECHO_PLAN.replace('> b\n', '> b\n> write\n'))
+        out = self.run_tests(self.config(jobs=1, engine=engine, limits={'fsize': '64k'}))
+        self.assertIn('your program went over its fsize limit', out)
+        self.assertIn('It tried to write a file bigger than 0.0625M.', out)
+        self.assertIn('File too large', out)  # (python ignores SIGXFSZ, so it's on stderr)
+
+    def test_fsize_limit(self):
+        self.check_fsize_limit('threads')
+
+    def test_fsize_limit_asyncio(self):
+        self.check_fsize_limit('asyncio')
+
+    def test_cgroup_events(self):
+        base = self.dir / 'cgroup'
+        base.mkdir()
+        lim = tanco.model.Limits(memory=2 ** 26, nproc=8, cgroup=str(base))
+        with self.assertRaises(ValueError):
+            tanco.limits.Cgroup.create(lim)  # not cgroup v2
+        (base / 'cgroup.controllers').write_text('memory pids\n')
+        group = tanco.limits.Cgroup.create(lim)
+        path = pathlib.Path(group.path)
+        self.assertEqual((path / 'memory.max').read_text(), str(2 ** 26))
+        self.assertEqual((path / 'pids.max').read_text(), '8')
+        # the cgroup stands in for RLIMIT_AS and RLIMIT_NPROC
+        self.assertEqual(tanco.limits.rlimits(lim, cgroup=group), [])
+        self.assertIsNone(tanco.limits.breach(lim, -9, None, '', group))
+        (path / 'memory.events').write_text('low 0\nhigh 0\nmax 3\noom 1\noom_kill 1\n')
+        self.assertEqual(tanco.limits.breach(lim, -9, None, '', group), 'memory')
+        res = tanco.model.TestResult(tanco.model.ResultKind.Fail, error=tanco.model.MessageFailure(['oops']))
+        res = tanco.model.TestResult.from_data(tanco.limits.check(lim, res, -9, None, group).to_data())
+        self.assertEqual(res.error.limit, 'memory')
+        self.assertEqual(res.error.lines, ['It ran out of memory (limit: 64M).', '', 'oops'])
+        # a run that a limit stopped fails even when its output matched
+        res = tanco.limits.check(lim, tanco.model.TestResult(tanco.model.ResultKind.Pass), -9, None, group)
+        self.assertEqual(res.kind, tanco.model.ResultKind.Fail)
+        self.assertEqual(res.error.lines, ['It ran out of memory (limit: 64M).'])
+
+
+# echoes like ECHO_PROGRAM, but first starts a helper that sleeps for a minute
+# (adding its pid to helper.pid), and on 'hang' stops answering
+FORKING_PROGRAM = """\
+import subprocess, sys, time
+helper = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+with open('helper.pid', 'a') as f:
+    f.write(f'{helper.pid}\\n')
+for line in sys.stdin:
+    line = line.strip()
+    if line == 'hang':
+        time.sleep(60)
+    elif line == 'q':
+        break
+    print(line.upper(), flush=True)
+"""
+
+
+def running(pid: int) -> bool:
+    """is the process alive? (zombies waiting for someone else to reap them don't count)"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'reads /proc')
+class ProcessTreeTest(RunnerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        (self.dir / 'echo.py').write_text(FORKING_PROGRAM)
+        self.cwd = os.getcwd()
+        os.chdir(self.dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        super().tearDown()
+
+    def helper_pids(self) -> list[int]:
+        path = self.dir / 'helper.pid'
+        return [int(line) for line in path.read_text().split()] if path.exists() else []
+
+    def assert_gone(self, pids: list[int]):
+        for _ in range(100):
+            if not any(running(pid) for pid in pids):
+                return
+            time.sleep(0.01)
+        self.fail(f'processes still running: {[pid for pid in pids if running(pid)]}')
+
+    def test_leftovers_killed_after_exit(self):
+        cfg = self.config(prespawn=0)
+        test = tanco.orgtest.read_challenge(cfg.test_path).tests[0]
+        program = tanco.runner.spawn(cfg)
+        res = tanco.runner.timed_result(cfg, program, test, 10)
+        self.assertTrue(res.is_pass())
+        self.assert_gone(self.helper_pids())
+        self.assertNotIn(program.pid, tanco.procs.LIVE)
+
+    def check_shell_tree_killed_on_timeout(self, engine):
+        self.write_plan(ECHO_PLAN.replace('> b\n', '> b\n> hang\n'))
+        cfg = self.config(jobs=1, engine=engine, timeout=0.5, prespawn=0)
+        cfg.program_args = ['-c', f'{sys.executable} echo.py']
+        out = self.run_tests(cfg)
+        self.assertIn('timed out', out.lower())
+        self.assertEqual(len(self.helper_pids()), 2)  # (echo.a exits normally, echo.b hangs)
+        self.assert_gone(self.helper_pids())
+        self.assertFalse(tanco.procs.LIVE)
+
+    def test_shell_tree_killed_on_timeout(self):
+        self.check_shell_tree_killed_on_timeout('threads')
+
+    def test_shell_tree_killed_on_timeout_asyncio(self):
+        self.check_shell_tree_killed_on_timeout('asyncio')
+
+    def test_kill_all(self):
+        program = tanco.runner.spawn(self.config())
+        for _ in range(100):
+            if self.helper_pids():
+                break
+            time.sleep(0.01)
+        tanco.procs.kill_all()
+        program.communicate()
+        self.assertFalse(tanco.procs.LIVE)
+        self.assert_gone(self.helper_pids())
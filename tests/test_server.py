@@ -0,0 +1,102 @@
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import tanco.client
+import tanco.database as db
+import tanco.orgtest
+import tanco.runner
+from tests.test_runner import RunnerTestCase
+
+TANCO_SERVER = 'fake://invalid url/'
+
+
+def import_app():
+    """the app loads its signing key from the current directory"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                            serialization.NoEncryption())
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'tanco_auth_key.pem'), 'wb') as f:
+            f.write(pem)
+        os.chdir(tmp)
+        try:
+            import tanco.app
+        finally:
+            os.chdir(cwd)
+    return tanco.app
+
+
+app = import_app()
+
+
+class BatchCheckTest(RunnerTestCase):
+    """the client and server share one database here, like a local dev server"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        with db.begin() as conn:
+            sid = conn.execute('insert into servers (url, name, info) values (?, ?, ?)',
+                               (TANCO_SERVER, 'fakeserver', 'fake')).lastrowid
+            uid = conn.execute('insert into users (sid, authid, username) values (?, ?, ?)',
+                               (sid, 'fakeauthid', 'fakeuser')).lastrowid
+            conn.execute('insert into tokens (uid, jwt) values (?, ?)', (uid, 'fakejwt'))
+            chid = conn.execute('insert into challenges (sid, name, title) values (?, ?, ?)',
+                                (sid, 'echo', 'echo')).lastrowid
+            for i, t in enumerate(self.challenge().tests):
+                conn.execute('insert into tests (chid, grp, name, head, body, ilines, olines)'
+                             ' values (?, ?, ?, ?, ?, ?, ?)',
+                             (chid, i, t.name, t.head or '', t.body, '\n'.join(t.ilines), '\n'.join(t.olines)))
+            conn.execute("insert into attempts (uid, chid, code, state) values (?, ?, 'abc', 'build')",
+                         (uid, chid))
+        self.posts = []
+        patcher = mock.patch.dict(os.environ, {'TANCO_SERVER': TANCO_SERVER})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def challenge(self):
+        return tanco.orgtest.read_challenge(str(self.dir / 'plan.org'))
+
+    def post(self, url, data):
+        """send the client's requests straight to the app"""
+        self.posts.append(url)
+
+        async def call():
+            res = await app.app.test_client().post('/' + url, json=data)
+            return await res.get_json()
+        return asyncio.run(call())
+
+    def test_batch_endpoint(self):
+        with mock.patch.object(tanco.client.TancoClient, 'post', self.post), \
+                contextlib.redirect_stdout(io.StringIO()):
+            results = tanco.client.TancoClient().check_outputs(
+                'abc', [('echo.a', ['A']), ('echo.b', ['B', 'X']), ('echo.c', [])])
+        self.assertEqual([r.kind.name for r in results], ['Pass', 'Fail', 'Pass'])
+        progress = db.query('select t.name from progress p join tests t on p.tid = t.id order by t.name')
+        self.assertEqual([row['name'] for row in progress], ['echo.a', 'echo.c'])
+        self.assertEqual(db.current_status('abc')['focus'], 'echo.b')
+
+    def test_runner_checks_a_group_in_one_request(self):
+        challenge = self.challenge()
+        for t in challenge.tests:
+            t.olines = None  # like tests fresh from `tanco next`
+        cfg = self.config(test_path=None, attempt='abc', jobs=2)
+        out = io.StringIO()
+        with mock.patch.object(tanco.client.TancoClient, 'post', self.post), contextlib.redirect_stdout(out):
+            tanco.runner.run_tests(cfg, challenge=challenge)
+        self.assertIn('All 3 tests passed.', out.getvalue())
+        self.assertEqual(self.posts, ['a/abc/check', 'a/abc/pass'])
+        olines = db.query("select olines from tests where name='echo.b'")[0]['olines']
+        self.assertEqual(olines, 'B\nC')
+
+
+if __name__ == '__main__':
+    unittest.main()
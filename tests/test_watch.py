@@ -0,0 +1,99 @@
+import contextlib
+import io
+import sys
+import threading
+import time
+import unittest
+
+import tanco.watch as tw
+from tanco.model import Config
+from tests.test_runner import ECHO_PLAN, RunnerTestCase
+
+class IgnoreRuleTest(unittest.TestCase):
+
+    def test_ignore_rule(self):
+        ignore = tw.ignore_rule(self.config_with_input())
+        self.assertTrue(ignore('/x/.git/index'))
+        self.assertTrue(ignore('/x/src/main.py~'))
+        self.assertTrue(ignore('/x/input.3.txt'))
+        self.assertFalse(ignore('/x/src/main.py'))
+
+    @staticmethod
+    def config_with_input():
+        return Config(input_path='/x/input.txt')
+
+
+class WatcherTest(RunnerTestCase):
+
+    def check_watcher(self, watcher):
+        try:
+            def save():
+                time.sleep(0.1)
+                (self.dir / 'echo.py').write_text('# saved\n')
+                (self.dir / 'echo.py~').write_text('# backup\n')
+                time.sleep(0.05)
+                (self.dir / 'new.py').write_text('# created\n')
+            thread = threading.Thread(target=save)
+            thread.start()
+            paths = tw.next_changes(watcher, debounce=0.8)
+            thread.join()
+        finally:
+            watcher.close()
+        self.assertEqual(paths, {str(self.dir / 'echo.py'), str(self.dir / 'new.py')})
+
+    def test_poll_watcher(self):
+        self.check_watcher(tw.PollWatcher(str(self.dir), tw.ignore_rule(self.config())))
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'inotify is linux only')
+    def test_inotify_watcher(self):
+        self.check_watcher(tw.InotifyWatcher(str(self.dir), tw.ignore_rule(self.config())))
+
+
+class WatchSessionTest(RunnerTestCase):
+
+    def run_session(self, session) -> str:
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            session.run()
+        return out.getvalue()
+
+    def test_last_failure_runs_first(self):
+        self.write_plan(ECHO_PLAN.replace('\nB\n', '\nX\n'))
+        session = tw.WatchSession(self.config(jobs=1, schedule='focus'))
+        try:
+            self.assertIn('Test [echo.b] failed.', self.run_session(session))
+            self.assertEqual(len(session.spawners[0].ready), 1)  # warm for next time
+            # no dots the second time: echo.b goes first, and fails again
+            self.assertRegex(self.run_session(session), r'^\s*Test \[echo.b\] failed.')
+        finally:
+            session.close()
+
+    def test_changes(self):
+        session = tw.WatchSession(self.config(jobs=1))
+        try:
+            self.run_session(session)
+            self.assertIsNotNone(session.challenge)
+            warm = session.spawners[0].ready[0]
+            # the plan changed: parse it again, but keep the warm target
+            session.changed({str(self.dir / 'plan.org')})
+            self.assertIsNone(session.challenge)
+            self.assertIs(session.spawners[0].ready[0], warm)
+            # anything else: the warm target is stale
+            session.changed({str(self.dir / 'echo.py')})
+            self.assertFalse(session.spawners[0].ready)
+            self.assertIsNotNone(warm.poll())
+        finally:
+            session.close()
+
+    def test_included_file_changes(self):
+        (self.dir / 'more.org').write_text(ECHO_PLAN.replace('echo.', 'more.'))
+        self.write_plan(ECHO_PLAN + '#+include: more.org\n')
+        session = tw.WatchSession(self.config(jobs=1))
+        try:
+            self.assertIn('All 6 tests passed.', self.run_session(session))
+            warm = session.spawners[0].ready[0]
+            session.changed({str(self.dir / 'more.org')})
+            self.assertIsNone(session.challenge)
+            self.assertIs(session.spawners[0].ready[0], warm)
+        finally:
+            session.close()